@@ -0,0 +1,216 @@
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+from models import db, StudentQuizAttempt
+import quiz_cache
+
+# Item analytics per quiz: difficulty, discrimination and distractors.
+#
+# Attempts of a quiz's current content (its snapshot) are read in batches
+# into a students x questions matrix of selected option numbers (int8, 0 for
+# no answer). Each batch is reduced with whole-array operations to a few
+# additive sums. The results come from those sums:
+# - p-value: share of students answering correctly (higher is easier)
+# - point-biserial discrimination: correlation of getting the item right
+#   with the score on the other items
+# - share choosing each option, including no answer
+# - score distribution
+#
+# The sums are cached per process under (quiz id, quizzes.version), like the
+# quiz cache. Each view reads only the attempts added since the last one,
+# so an entry is updated incrementally. Any edit to the quiz bumps its
+# version and starts a new entry.
+#
+# "Added since" is tracked by the highest attempt id seen. SQLite commits
+# one writer at a time, so ids become visible in order. Elsewhere (Postgres)
+# a transaction can commit a lower id after a higher one was read, and that
+# attempt would never be folded in: there each view also counts the
+# attempts up to the mark, and starts the entry over if the counts differ.
+
+DEFAULT_SIZE = 64
+BATCH_SIZE = 5000
+OPTIONS = 4
+
+# Dialects whose attempt ids become visible in id order
+ORDERED_COMMIT_DIALECTS = {'sqlite'}
+
+ItemStats = namedtuple('ItemStats', [
+    'question_id', 'text', 'answer', 'p_value', 'discrimination', 'option_rates', 'no_answer_rate',
+])
+
+QuizAnalytics = namedtuple('QuizAnalytics', [
+    'quiz_id', 'version', 'name', 'attempts', 'mean_score', 'score_distribution', 'items',
+])
+
+
+class ItemAccumulator:
+    # Additive sums over the attempts seen so far of one snapshot.
+    def __init__(self, answer_key):
+        self.key = np.array([answer or 0 for answer in answer_key], dtype=np.int8)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Back to no attempts seen
+        questions = len(self.key)
+        self.last_attempt_id = 0
+        self.count = 0
+        self.correct = np.zeros(questions, dtype=np.int64)           # sum x
+        self.score_sum = 0                                           # sum t
+        self.score_squares = 0                                       # sum t^2
+        self.correct_scores = np.zeros(questions, dtype=np.int64)    # sum x*t
+        self.option_counts = np.zeros((questions, OPTIONS + 1), dtype=np.int64)
+        self.score_counts = np.zeros(questions + 1, dtype=np.int64)
+
+    def add(self, selections):
+        # Fold in a (students x questions) int8 matrix of option numbers.
+        if not len(selections):
+            return
+        correct = (selections == self.key) & (self.key > 0)
+        scores = correct.sum(axis=1)
+        self.count += len(selections)
+        self.correct += correct.sum(axis=0)
+        self.score_sum += int(scores.sum())
+        self.score_squares += int((scores.astype(np.int64) ** 2).sum())
+        self.correct_scores += scores @ correct
+        self.option_counts += (selections[:, :, None] == np.arange(OPTIONS + 1)).sum(axis=0)
+        self.score_counts += np.bincount(scores, minlength=len(self.key) + 1)
+
+    def p_values(self):
+        return self.correct / self.count
+
+    def discrimination(self):
+        # Corrected point-biserial: item x against the rest score y = t - x,
+        # with the sums of y, y^2 and x*y derived from the totals (x^2 = x).
+        n = self.count
+        x_sum = self.correct
+        y_sum = self.score_sum - x_sum
+        y_squares = self.score_squares - 2 * self.correct_scores + x_sum
+        xy_sum = self.correct_scores - x_sum
+        covariance = xy_sum / n - (x_sum / n) * (y_sum / n)
+        x_variance = x_sum / n - (x_sum / n) ** 2
+        y_variance = y_squares / n - (y_sum / n) ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = covariance / np.sqrt(x_variance * y_variance)
+        # Undefined when everyone (or no one) got the item right
+        return np.where((x_variance > 0) & (y_variance > 0), r, np.nan)
+
+
+def selection_matrix(rows, questions):
+    # int8 matrix of option numbers from the attempts' selections lists;
+    # short lists (attempts of fewer questions) are padded with no answer.
+    matrix = np.zeros((len(rows), questions), dtype=np.int8)
+    for i, selections in enumerate(rows):
+        values = [value or 0 for value in selections[:questions]]
+        matrix[i, :len(values)] = values
+    return matrix
+
+
+def new_attempts_statement(quiz_id, snapshot_hash, after_id, limit=BATCH_SIZE):
+    attempt = StudentQuizAttempt
+    return (
+        select(attempt.id, attempt.selections)
+        .where(attempt.quiz_id == quiz_id, attempt.snapshot_hash == snapshot_hash, attempt.id > after_id)
+        .order_by(attempt.id)
+        .limit(limit)
+    )
+
+
+def seen_attempts_statement(quiz_id, snapshot_hash, up_to_id):
+    attempt = StudentQuizAttempt
+    return select(func.count()).where(
+        attempt.quiz_id == quiz_id, attempt.snapshot_hash == snapshot_hash, attempt.id <= up_to_id,
+    )
+
+
+class AnalyticsCache:
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, answer_key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                entry = self._entries[key] = ItemAccumulator(answer_key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                    'maxsize': self.maxsize}
+
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = AnalyticsCache(current_app.config.get('ANALYTICS_CACHE_SIZE', DEFAULT_SIZE))
+    return _cache
+
+
+def quiz_analytics(quiz_id):
+    # QuizAnalytics for the quiz's current content, or None if it does not exist.
+    quiz = quiz_cache.get_quiz(quiz_id)
+    if quiz is None:
+        return None
+    questions = quiz.snapshot['questions']
+    entry = _get_cache().get_or_create((quiz.id, quiz.version), [item['answer'] for item in questions])
+    with entry.lock:
+        _catch_up(entry, quiz, len(questions))
+        if entry.count and db.session.get_bind().dialect.name not in ORDERED_COMMIT_DIALECTS:
+            seen = db.session.execute(
+                seen_attempts_statement(quiz.id, quiz.snapshot_hash, entry.last_attempt_id)
+            ).scalar()
+            if seen != entry.count:
+                # An attempt committed below the mark after it was read
+                entry.reset()
+                _catch_up(entry, quiz, len(questions))
+        return _results(quiz, questions, entry)
+
+
+def _catch_up(entry, quiz, questions):
+    # Fold in the attempts after the entry's mark.
+    while True:
+        rows = db.session.execute(
+            new_attempts_statement(quiz.id, quiz.snapshot_hash, entry.last_attempt_id)
+        ).all()
+        if not rows:
+            return
+        entry.add(selection_matrix([selections or [] for _, selections in rows], questions))
+        entry.last_attempt_id = rows[-1].id
+
+
+def _results(quiz, questions, entry):
+    if not entry.count:
+        return QuizAnalytics(quiz.id, quiz.version, quiz.name, 0, None, entry.score_counts.tolist(), [])
+    p_values = entry.p_values()
+    discrimination = entry.discrimination()
+    rates = entry.option_counts / entry.count
+    items = [
+        ItemStats(
+            item['id'], item['text'], item['answer'], float(p_values[i]),
+            None if np.isnan(discrimination[i]) else float(discrimination[i]),
+            rates[i, 1:].tolist(), float(rates[i, 0]),
+        )
+        for i, item in enumerate(questions)
+    ]
+    return QuizAnalytics(quiz.id, quiz.version, quiz.name, entry.count, entry.score_sum / entry.count,
+                         entry.score_counts.tolist(), items)
+
+
+def cache_info():
+    return _get_cache().info()
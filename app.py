@@ -1,18 +1,49 @@
+import os
 from flask import Flask
-from models import db, init_db
+from models import db
 from routes import app as routes_app
+from bootstrap import bootstrap, register_commands
+import stats
+import search
+import importer
+import exporter
+import submissions
+import engines
+import metrics
+import users
+import leaderboard
+import regrade
+import assets
+import warmup
 
-app = Flask(__name__)
+# The templates live at the repository root
+app = Flask(__name__, template_folder='.')
 
 app.config.from_object('config.Config')
+warmup.configure_templates(app)
 
+engines.configure(app)
 db.init_app(app)
+metrics.init_app(app)
+assets.init_app(app)
 
-@app.before_request
-def create_tables():
-    init_db(app)
+register_commands(app)
+stats.register_commands(app)
+search.register_commands(app)
+importer.register_commands(app)
+exporter.register_commands(app)
+submissions.register_commands(app)
+users.register_commands(app)
+leaderboard.register_commands(app)
+regrade.register_commands(app)
+assets.register_commands(app)
 
 app.register_blueprint(routes_app)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)  
\ No newline at end of file
+    bootstrap(app)
+    metrics.clear(app)
+    # Development server only; production runs gunicorn via start.sh
+    debug = os.getenv('FLASK_DEBUG', '1') == '1'
+    app.jinja_env.auto_reload = debug
+    app.run(host='0.0.0.0', debug=debug)  
@@ -0,0 +1,232 @@
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import urllib.error
+import urllib.request
+import brotli
+import click
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+# Static assets: vendored libraries, the shared stylesheet and images.
+#
+# Sources live under static/: static/vendor/ holds Bootstrap, jQuery,
+# Popper and Chart.js (Chart.js is committed, the others are fetched from
+# their CDNs by `flask build-assets`, which refuses a download whose digest
+# differs from the one pinned here), static/css/app.css the styles the
+# pages share. The build copies every
+# source to static/dist/ under a name carrying a hash of its content, next
+# to gzip and brotli variants of the text files, and writes the name map to
+# static/dist/manifest.json. Templates link assets with asset_url(name).
+# /assets/ serves a built file with a year-long immutable Cache-Control,
+# since any change gives it a new name, and picks the variant the client
+# accepts (Content-Encoding, Vary: Accept-Encoding), so no request ever
+# compresses anything. Without a build, asset_url falls back to /static/
+# for local files and to the CDN for vendored ones.
+
+DEFAULT_MAX_AGE = 365 * 24 * 3600  # seconds
+HASH_LENGTH = 12
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.txt'}
+# variant suffix per Content-Encoding, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# name under static/ -> (upstream copy, its digest in subresource integrity form)
+VENDOR = {
+    'vendor/bootstrap.min.css': ('https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css',
+                                 'sha384-JcKb8q3iqJ61gNV9KGb8thSsNjpSL0n8PARn9HuZOnIxN0hoP+VmmDGMN5t9UJ0Z'),
+    'vendor/bootstrap.min.js': ('https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/js/bootstrap.min.js',
+                                'sha384-B4gt1jrGC7Jh4AgTPSdUtOBvfO8shuf57BaghqFfPlYxofvL8/KUEfYiJOMMV+rV'),
+    'vendor/jquery.min.js': ('https://code.jquery.com/jquery-3.5.1.min.js',
+                             'sha256-9/aliU8dGd2tb6OSsuzixeV4y/faTqgFtohetphbbj0='),
+    'vendor/popper.min.js': ('https://cdn.jsdelivr.net/npm/@popperjs/core@2.9.2/dist/umd/popper.min.js',
+                             'sha384-IQsoLXl5PILFhosVNubq5LC7Qb9DXgDA9i+tQ8Zj3iwWAwPtgFTxbJ8NT4GN1R8p'),
+    'vendor/chart.umd.js': ('https://cdn.jsdelivr.net/npm/chart.js@4.5.1/dist/chart.umd.js',
+                            'sha384-hfkuqrKeWFmnTMWN31VWyoe8xgdTADD11kgxmdpx2uyE6j5Az5uZq6u6AKYYmAOw'),
+}
+INTEGRITY_ALGORITHMS = {'sha256', 'sha384', 'sha512'}
+
+bp = Blueprint('assets', __name__)
+
+
+def _dist_dir(app):
+    return os.path.join(app.static_folder, 'dist')
+
+
+def fingerprinted(name, data):
+    # 'css/app.css' -> 'css/app.<hash of data>.css'
+    stem, dot, extension = name.rpartition('.')
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return f'{stem}.{digest}.{extension}' if dot else f'{name}.{digest}'
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def integrity(data, algorithm='sha384'):
+    # Subresource integrity form of a digest: '<algorithm>-<base64>'
+    digest = hashlib.new(algorithm, data).digest()
+    return f'{algorithm}-{base64.b64encode(digest).decode()}'
+
+
+def verify(name, data, pinned):
+    algorithm = pinned.partition('-')[0]
+    if algorithm not in INTEGRITY_ALGORITHMS:
+        raise IntegrityError(f'{name}: unsupported integrity {pinned!r}')
+    actual = integrity(data, algorithm)
+    if actual != pinned:
+        raise IntegrityError(f'{name}: downloaded {actual}, pinned {pinned}')
+
+
+def fetch_vendor(app, force=False):
+    # Download the vendored files that are missing; returns their names. Raises IntegrityError, writing nothing, on a digest mismatch.
+    fetched = []
+    for name, (url, pinned) in VENDOR.items():
+        path = os.path.join(app.static_folder, name)
+        if os.path.exists(path) and not force:
+            continue
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        verify(name, data, pinned)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        fetched.append(name)
+    return fetched
+
+
+def _write(path, data):
+    if os.path.exists(path):  # same name, same content
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def _sources(app):
+    # (name, path) of the files under static/, outside static/dist/
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder and 'dist' in dirs:
+            dirs.remove('dist')
+        for filename in files:
+            if filename.startswith('.') or filename.endswith('.tmp'):
+                continue
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, app.static_folder).replace(os.sep, '/'), path
+
+
+def build(app):
+    # Fingerprint and precompress every source asset; returns the manifest.
+    # Files of earlier builds are kept, for pages rendered before a deploy.
+    dist = _dist_dir(app)
+    manifest = {}
+    for name, path in sorted(_sources(app)):
+        with open(path, 'rb') as f:
+            data = f.read()
+        built = fingerprinted(name, data)
+        target = os.path.join(dist, built)
+        _write(target, data)
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            variants = {'.gz': gzip.compress(data, 9, mtime=0),
+                        '.br': brotli.compress(data, quality=11)}
+            for suffix, compressed in variants.items():
+                # Not worth a Content-Encoding unless clearly smaller
+                if len(compressed) < len(data) * 0.9:
+                    _write(target + suffix, compressed)
+        manifest[name] = built
+    _write_manifest(dist, manifest)
+    return manifest
+
+
+def _write_manifest(dist, manifest):
+    path = os.path.join(dist, 'manifest.json')
+    os.makedirs(dist, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _get_manifest():
+    global _manifest
+    if _manifest is None:
+        # gthread workers render their first pages concurrently
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = _load_manifest(current_app)
+    return _manifest
+
+
+def _load_manifest(app):
+    path = os.path.join(_dist_dir(app), 'manifest.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        app.logger.warning('No %s; run `flask build-assets`. Assets are served unversioned.', path)
+        return {}
+
+
+def asset_url(name):
+    built = _get_manifest().get(name)
+    if built is not None:
+        return url_for('assets.asset', filename=built)
+    if name in VENDOR and not os.path.exists(os.path.join(current_app.static_folder, name)):
+        return VENDOR[name][0]
+    return url_for('static', filename=name)
+
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    path = safe_join(_dist_dir(current_app), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         max_age=current_app.config.get('ASSET_MAX_AGE', DEFAULT_MAX_AGE))
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.content_encoding = encoding
+    return response
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.jinja_env.globals['asset_url'] = asset_url
+
+
+def register_commands(app):
+    @app.cli.command('build-assets')
+    @click.option('--offline', is_flag=True, help='Do not download missing vendored files.')
+    @click.option('--refetch', is_flag=True, help='Download the vendored files again.')
+    def build_assets_command(offline, refetch):
+        """Vendor, fingerprint and precompress the static assets."""
+        if not offline:
+            try:
+                for name in fetch_vendor(app, force=refetch):
+                    click.echo(f'Fetched {name}')
+            except urllib.error.URLError as e:
+                raise click.ClickException(f'Could not fetch the vendored files ({e.reason}); '
+                                           f'--offline builds without them.')
+            except IntegrityError as e:
+                raise click.ClickException(f'Refusing a vendored file, its digest changed: {e}')
+        manifest = build(app)
+        missing = [name for name in VENDOR if name not in manifest]
+        click.echo(f'Built {len(manifest)} assets into {_dist_dir(app)}.')
+        if missing:
+            click.echo(f'Not vendored, linked from the CDN: {", ".join(missing)}')
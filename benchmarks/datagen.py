@@ -0,0 +1,143 @@
+import random
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, insert
+from werkzeug.security import generate_password_hash
+from models import db, User, Course, Chapter, Quiz, Question, StudentQuizAttempt
+from stats import rebuild_rollups
+from leaderboard import rebuild_leaderboards
+import page_cache
+import snapshots
+
+# Deterministic synthetic data for benchmarks and query-plan checks.
+
+QUALIFICATIONS = ('Foundation', 'Diploma', 'Degree')
+
+BATCH_SIZE = 5000
+
+# Named scale points: generate(**SCALES[name]).
+SCALES = {
+    'small': dict(users_per_qualification=50, courses_per_category=5, chapters_per_course=3,
+                  quizzes_per_chapter=2, questions_per_quiz=10, attempts_per_user=10),
+    'medium': dict(users_per_qualification=500, courses_per_category=20, chapters_per_course=5,
+                   quizzes_per_chapter=3, questions_per_quiz=10, attempts_per_user=20),
+    'large': dict(users_per_qualification=5000, courses_per_category=50, chapters_per_course=8,
+                  quizzes_per_chapter=4, questions_per_quiz=20, attempts_per_user=40),
+}
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def generate(users_per_qualification=200, courses_per_category=20, chapters_per_course=5,
+             quizzes_per_chapter=3, questions_per_quiz=10, attempts_per_user=20, seed=42):
+    # Must be called inside an app context on a migrated database; ids
+    # continue after any existing rows (e.g. the seeded admin).
+    rng = random.Random(seed)
+    password_hash = generate_password_hash('password')
+    base_date = datetime(2024, 1, 1)
+
+    user_base, course_base, chapter_base, quiz_base, question_base = (
+        _next_id(User), _next_id(Course), _next_id(Chapter), _next_id(Quiz), _next_id(Question))
+
+    users = []
+    for qualification in QUALIFICATIONS:
+        for i in range(users_per_qualification):
+            users.append({
+                'id': user_base + len(users),
+                'username': f'{qualification.lower()}{i}@example.com',
+                'password_hash': password_hash,
+                'full_name': f'{qualification} Student {i}',
+                'qualification': qualification,
+                'dob': date(2000, 1, 1),
+                'is_admin': False,
+            })
+    _insert(User, users)
+
+    courses, chapters, quizzes, questions = [], [], [], []
+    quizzes_by_category = {q: [] for q in QUALIFICATIONS}
+    for category in QUALIFICATIONS:
+        for i in range(courses_per_category):
+            course_id = course_base + len(courses)
+            courses.append({'id': course_id, 'name': f'{category} Course {i}', 'category': category})
+            for j in range(chapters_per_course):
+                chapter_id = chapter_base + len(chapters)
+                chapters.append({'id': chapter_id, 'name': f'Chapter {j} of course {course_id}',
+                                 'course_id': course_id})
+                for k in range(quizzes_per_chapter):
+                    quiz_id = quiz_base + len(quizzes)
+                    quizzes.append({
+                        'id': quiz_id,
+                        'name': f'Quiz {k} of chapter {chapter_id}',
+                        'course_id': course_id,
+                        'chapter_id': chapter_id,
+                        'date_of_quiz': (base_date + timedelta(days=rng.randint(0, 730))).date(),
+                        'time_duration': '30',
+                        'remarks': '',
+                    })
+                    quizzes_by_category[category].append(quiz_id)
+                    for n in range(questions_per_quiz):
+                        questions.append({
+                            'id': question_base + len(questions),
+                            'question_statement': f'Question {n} of quiz {quiz_id}?',
+                            'quiz_id': quiz_id,
+                            'chapter_id': chapter_id,
+                            'option1': 'Answer A',
+                            'option2': 'Answer B',
+                            'option3': 'Answer C',
+                            'option4': 'Answer D',
+                            'correct_answer': f'option{rng.randint(1, 4)}',
+                        })
+    _insert(Course, courses)
+    _insert(Chapter, chapters)
+    _insert(Quiz, quizzes)
+    _insert(Question, questions)
+
+    # One snapshot per quiz; attempts pick random options and are graded
+    # against it so scores and selections agree.
+    quiz_snapshots = {}
+    questions_by_quiz = {}
+    for row in questions:
+        questions_by_quiz.setdefault(row['quiz_id'], []).append(row)
+    for quiz_id, rows in questions_by_quiz.items():
+        content = {'questions': [{
+            'id': row['id'],
+            'text': row['question_statement'],
+            'options': [row['option1'], row['option2'], row['option3'], row['option4']],
+            'answer': int(row['correct_answer'][-1]),
+        } for row in rows]}
+        snapshot_hash = snapshots.content_hash(content)
+        snapshots.store_snapshot(db.session.connection(), snapshot_hash, quiz_id, content)
+        quiz_snapshots[quiz_id] = (snapshot_hash, content)
+
+    attempts = []
+    for user in users:
+        candidates = quizzes_by_category[user['qualification']]
+        for _ in range(attempts_per_user):
+            quiz_id = rng.choice(candidates)
+            snapshot_hash, content = quiz_snapshots[quiz_id]
+            selections = [rng.randint(1, 4) for _ in content['questions']]
+            attempts.append({
+                'student_id': user['id'],
+                'quiz_id': quiz_id,
+                'score': snapshots.grade(content, selections),
+                'total_questions': questions_per_quiz,
+                'attempt_date': base_date + timedelta(minutes=rng.randint(0, 1051200)),
+                'snapshot_hash': snapshot_hash,
+                'selections': selections,
+            })
+    _insert(StudentQuizAttempt, attempts)
+    rebuild_rollups(db.session.connection())
+    rebuild_leaderboards(db.session.connection())
+    page_cache.bump_catalogue(db.session.connection())
+    db.session.commit()
+
+    return {
+        'users': len(users), 'courses': len(courses), 'chapters': len(chapters),
+        'quizzes': len(quizzes), 'questions': len(questions), 'attempts': len(attempts),
+    }
@@ -0,0 +1,125 @@
+"""Login storm benchmark.
+
+Seeds a small dataset into a throwaway SQLite database and starts gunicorn
+in each of three modes: sync workers hashing on the request thread (the old
+setup), gthread workers hashing on the request thread, and gthread workers
+with the password executor and its admission control. In each mode,
+--logins clients sign in over and over while --readers logged-in clients
+load /courses. Reports successful logins per second, logins refused with
+503, login latency, and the latency of the concurrent page loads.
+
+    python -m benchmarks.logins [--workers N] [--logins N] [--readers N] [--seconds N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.report import percentile
+from benchmarks.serving import Client, free_port, start_server, stop_server
+
+UNBOUNDED = '100000'
+
+MODES = [
+    ('sync, inline hashing', {'GUNICORN_WORKER_CLASS': 'sync', 'PASSWORD_HASH_WORKERS': '0',
+                              'PASSWORD_HASH_MAX_PENDING': UNBOUNDED}),
+    ('gthread, inline hashing', {'GUNICORN_WORKER_CLASS': 'gthread', 'PASSWORD_HASH_WORKERS': '0',
+                                 'PASSWORD_HASH_MAX_PENDING': UNBOUNDED}),
+    ('gthread, hash executor', {'GUNICORN_WORKER_CLASS': 'gthread'}),
+]
+
+
+def storm(port, usernames, readers, seconds):
+    # Returns (login latencies, refused logins, page latencies).
+    login_latencies, page_latencies, refused = [], [], []
+    lock = threading.Lock()
+    clients = []
+    for i in range(readers):
+        client = Client(port)
+        client.login(usernames[i % len(usernames)])
+        clients.append(client)
+    deadline = []
+    workers = len(usernames) + readers
+    barrier = threading.Barrier(workers, action=lambda: deadline.append(time.monotonic() + seconds))
+
+    def login(username):
+        client = Client(port)
+        barrier.wait()
+        while time.monotonic() < deadline[0]:
+            started = time.perf_counter()
+            status = client.request('POST', '/login', {'username': username, 'password': 'password'}).status
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status == 302:
+                    login_latencies.append(elapsed)
+                else:
+                    refused.append(status)
+            if status == 503:
+                time.sleep(0.05)
+
+    def read(client):
+        barrier.wait()
+        while time.monotonic() < deadline[0]:
+            started = time.perf_counter()
+            client.expect('GET', '/courses', 200)
+            with lock:
+                page_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=login, args=(username,)) for username in usernames]
+    threads += [threading.Thread(target=read, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return login_latencies, refused, page_latencies
+
+
+def _ms(values, fraction):
+    return f'{percentile(values, fraction) * 1000:.0f}ms' if values else '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers in every mode')
+    parser.add_argument('--logins', type=int, default=16, help='clients signing in')
+    parser.add_argument('--readers', type=int, default=4, help='clients loading pages meanwhile')
+    parser.add_argument('--seconds', type=float, default=10, help='duration per mode')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='quizmaster-logins-')
+    env = dict(os.environ,
+               SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'logins.db'),
+               SUBMISSION_LOG_DIR=os.path.join(workdir, 'log'),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               WEB_CONCURRENCY=str(args.workers))
+    os.environ.update(env)
+
+    from app import app
+    from bootstrap import upgrade
+    from benchmarks import datagen
+
+    upgrade(app)
+    with app.app_context():
+        datagen.generate(users_per_qualification=max(args.logins, args.readers), attempts_per_user=1)
+    usernames = [f'foundation{i}@example.com' for i in range(args.logins)]
+    print(f'{args.workers} workers, {args.logins} clients signing in, {args.readers} loading /courses, '
+          f'{args.seconds:g}s per mode')
+
+    for name, mode_env in MODES:
+        port = free_port()
+        process = start_server(dict(env, **mode_env), port, workdir)
+        try:
+            logins, refused, pages = storm(port, usernames, args.readers, args.seconds)
+        finally:
+            stop_server(process)
+        print(f'{name}: {len(logins) / args.seconds:.1f} logins/s '
+              f'(p50 {_ms(logins, 0.5)}, p95 {_ms(logins, 0.95)}), {len(refused)} refused; '
+              f'/courses {len(pages) / args.seconds:.1f} req/s, p50 {_ms(pages, 0.5)}, '
+              f'p95 {_ms(pages, 0.95)}, p99 {_ms(pages, 0.99)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
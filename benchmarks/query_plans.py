@@ -0,0 +1,156 @@
+"""Query-plan regression check.
+
+Seeds a synthetic dataset into a throwaway SQLite database and runs
+EXPLAIN QUERY PLAN on the queries each route issues. Any plan step that
+scans a table without an index fails the check, so a model or route change
+cannot silently bring back a full scan.
+
+    python -m benchmarks.query_plans [--users N] [--attempts N]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+
+# Each entry is (route, description, statement factory). Keep these in step
+# with the queries in routes.py.
+def hot_queries():
+    import analytics
+    import leaderboard
+    import loaders
+    import pagination
+    from models import User, Course, Chapter, Quiz, Question, StudentQuizAttempt, AttemptStatsRollup
+    from models import course_sort_category
+
+    def page(statement, columns, key, **kwargs):
+        return pagination.keyset_statement(statement, columns, key, **kwargs)
+
+    return [
+        ('home', 'courses for a qualification, next page',
+         page(select(Course).where(Course.category == 'Diploma'), [Course.id], (10,))),
+        ('courses', 'all courses, next page',
+         page(select(Course), [Course.id], (10,))),
+        ('admin_dashboard', 'courses by category, next page',
+         page(select(Course), [course_sort_category, Course.id], ('Diploma', 10))),
+        ('chapters', 'chapters of a course with quizzes, next page',
+         page(loaders.course_chapters_statement(1), [Chapter.id], (1,))),
+        ('chapters', 'quizzes of a chapter',
+         select(Quiz).where(Quiz.chapter_id == 1)),
+        ('view_questions', 'questions of a quiz, next page',
+         page(select(Question).where(Question.quiz_id == 1), [Question.id], (1,))),
+        ('take_test', 'questions of a quiz',
+         select(Question).where(Question.quiz_id == 1)),
+        ('submit_test', 'questions of a quiz',
+         select(Question).where(Question.quiz_id == 1)),
+        ('view_attempt', 'questions of a quiz',
+         select(Question).where(Question.quiz_id == 1)),
+        ('student_chapters', 'chapters of a course with quizzes',
+         loaders.course_chapters_statement(1)),
+        ('student_chapters', 'latest attempt per quiz',
+         loaders.latest_attempts_statement(1, 1)),
+        ('user_stats', 'attempt totals of a student',
+         select(func.count(StudentQuizAttempt.id), func.sum(StudentQuizAttempt.score))
+         .where(StudentQuizAttempt.student_id == 1)),
+        ('user_stats', 'score series of a student per course',
+         loaders.score_series_statement(1, 30)),
+        ('user_stats', 'attempts of a student, next page',
+         page(select(StudentQuizAttempt).where(StudentQuizAttempt.student_id == 1),
+              [StudentQuizAttempt.id], (1000,), descending=True)),
+        ('admin_stats', 'users per qualification',
+         select(User.qualification, func.count(User.id))
+         .where(User.qualification.in_(['Foundation', 'Diploma', 'Degree']))
+         .group_by(User.qualification)),
+        ('admin_stats', 'score rollups per qualification',
+         select(AttemptStatsRollup.qualification, func.sum(AttemptStatsRollup.attempt_count))
+         .where(AttemptStatsRollup.qualification.in_(['Foundation', 'Diploma', 'Degree']))
+         .group_by(AttemptStatsRollup.qualification)),
+        ('view_attempt', 'top of the quiz leaderboard',
+         leaderboard.top_statement('quiz', 1)),
+        ('view_attempt', 'leaderboard entries ahead of a student',
+         leaderboard.ahead_statement('quiz', 1, 1, 5, datetime(2024, 1, 1))),
+        ('student_chapters', 'top of the course leaderboard',
+         leaderboard.top_statement('course', 1)),
+        ('student_chapters', 'course leaderboard entries ahead of a student',
+         leaderboard.ahead_statement('course', 1, 1, 20, datetime(2024, 1, 1))),
+        ('quiz_analytics', 'new attempts of a quiz version',
+         analytics.new_attempts_statement(1, 'hash', 0)),
+        ('quiz_analytics', 'attempts of a quiz version up to the mark',
+         analytics.seen_attempts_statement(1, 'hash', 1000)),
+        ('delete_chapter', 'attempts of a quiz',
+         select(StudentQuizAttempt.id).where(StudentQuizAttempt.quiz_id == 1)),
+    ]
+
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan, tables):
+    # "SCAN t USING [COVERING] INDEX ..." walks an index and scans of
+    # subqueries read materialized rows; a bare "SCAN t" of a real table
+    # (or an alias such as "quizzes_1") reads the whole table.
+    scans = []
+    for step in plan:
+        if not step.startswith('SCAN ') or ' USING ' in step:
+            continue
+        name = re.sub(r'_\d+$', '', step.split()[1])
+        if name in tables:
+            scans.append(step)
+    return scans
+
+
+def check(app):
+    from models import db
+    failures = []
+    tables = set(db.metadata.tables)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for route, description, statement in hot_queries():
+                plan = explain(conn, statement)
+                scans = full_scans(plan, tables)
+                status = 'FAIL' if scans else 'ok'
+                print(f'[{status}] {route}: {description}: ' + ' | '.join(plan))
+                if scans:
+                    failures.append((route, description, scans))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500, help='users per qualification')
+    parser.add_argument('--attempts', type=int, default=20, help='attempts per user')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='quizmaster-plans-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'plans.db')
+
+    from app import app
+    from bootstrap import upgrade
+    from benchmarks import datagen
+    from models import db
+
+    upgrade(app)
+    with app.app_context():
+        counts = datagen.generate(users_per_qualification=args.users, attempts_per_user=args.attempts)
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+    print('Seeded ' + ', '.join(f'{n} {name}' for name, n in counts.items()))
+
+    failures = check(app)
+    if failures:
+        print(f'{len(failures)} quer{"y" if len(failures) == 1 else "ies"} fell back to a full table scan.')
+        return 1
+    print('All hot queries use an index.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
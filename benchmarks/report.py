@@ -0,0 +1,87 @@
+import json
+import os
+
+# Latency summaries, result tables and saved baselines for the benchmarks.
+#
+# A baseline is a JSON file holding a run's settings and its per-route
+# summary. Comparing a run against one flags every route whose p95 latency
+# rose, or whose throughput fell, by more than the tolerance.
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+DEFAULT_TOLERANCE = 0.2
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies, errors, seconds):
+    # Summary of one route: latencies in seconds over a run of `seconds`.
+    summary = {'requests': len(latencies), 'errors': errors,
+               'rps': round(len(latencies) / seconds, 2) if seconds else 0.0}
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        summary[name] = round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+    return summary
+
+
+def _ms(value):
+    return '-' if value is None else f'{value:.1f}'
+
+
+def print_table(results, baseline=None):
+    # One line per route; with a baseline, p95 and throughput changes too.
+    header = f'{"route":<18}{"requests":>9}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}'
+    if baseline is not None:
+        header += f'{"p95 vs base":>13}{"req/s vs base":>15}'
+    print(header)
+    for route, summary in results.items():
+        line = (f'{route:<18}{summary["requests"]:>9}{summary["rps"]:>9.1f}{_ms(summary["p50_ms"]):>9}'
+                f'{_ms(summary["p95_ms"]):>9}{_ms(summary["p99_ms"]):>9}{summary["errors"]:>8}')
+        base = (baseline or {}).get(route)
+        if base is not None:
+            line += f'{_change(summary["p95_ms"], base["p95_ms"]):>13}{_change(summary["rps"], base["rps"]):>15}'
+        print(line)
+
+
+def _change(value, base):
+    if value is None or not base:
+        return '-'
+    return f'{(value - base) / base:+.0%}'
+
+
+def baseline_path(name):
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, name + '.json')
+
+
+def save_baseline(name, settings, results):
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'settings': settings, 'results': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    # (route, description) for every route slower or less productive than
+    # its baseline by more than tolerance.
+    found = []
+    for route, summary in results.items():
+        base = baseline.get(route)
+        if base is None:
+            continue
+        if summary['p95_ms'] is not None and base['p95_ms'] and \
+                summary['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            found.append((route, f'p95 {base["p95_ms"]:.1f}ms -> {summary["p95_ms"]:.1f}ms'))
+        if base['rps'] and summary['rps'] < base['rps'] * (1 - tolerance):
+            found.append((route, f'throughput {base["rps"]:.1f} -> {summary["rps"]:.1f} req/s'))
+        if summary['errors'] > base['errors']:
+            found.append((route, f'errors {base["errors"]} -> {summary["errors"]}'))
+    return found
@@ -0,0 +1,256 @@
+"""Route-level load benchmark.
+
+Generates a dataset at one of the datagen scale points (or reuses the
+database given with --database), then has --clients students replay a
+weighted mix of routes for --seconds, either in-process through Flask's test
+client or over HTTP against a local gunicorn started with gunicorn_config.py.
+Prints requests, throughput and p50/p95/p99 latency per route. --save stores
+the run as a baseline; --compare prints the change against one and exits
+non-zero when a route regressed by more than --tolerance.
+
+    python -m benchmarks.scenarios [--scale small|medium|large] [--mix NAME]
+        [--target client|gunicorn] [--clients N] [--seconds N]
+        [--database PATH] [--save NAME] [--compare NAME] [--tolerance F]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import report
+
+# Route weights per mix. 'exam' is the burst at the start and end of a
+# scheduled quiz, 'browse' a quiet day, 'mixed' both plus an admin.
+MIXES = {
+    'exam': {'take_test': 4, 'submit_test': 4, 'view_attempt': 2},
+    'browse': {'home': 4, 'student_chapters': 4, 'view_attempt': 2},
+    'mixed': {'home': 3, 'student_chapters': 3, 'take_test': 2, 'submit_test': 2, 'view_attempt': 2,
+              'admin_stats': 1},
+}
+
+ADMIN_PASSWORD = '20210'  # as seeded by bootstrap.seed_admin
+
+
+class Student:
+    # A client's student and the ids its requests pick from.
+    def __init__(self, user_id, username, course_ids, quizzes, attempt_ids):
+        self.user_id = user_id
+        self.username = username
+        self.course_ids = course_ids
+        self.quizzes = quizzes  # quiz id -> question ids
+        self.attempt_ids = attempt_ids
+
+
+def load_students(app, count):
+    # `count` students spread over the qualifications, with the courses and
+    # quizzes of their qualification and their own seeded attempts.
+    from models import db, User, Course, Quiz, Question, StudentQuizAttempt
+    with app.app_context():
+        users = db.session.execute(
+            db.select(User.id, User.username, User.qualification)
+            .where(User.is_admin.isnot(True)).order_by(User.id)
+        ).all()
+        by_qualification = {}
+        for user in users:
+            by_qualification.setdefault(user.qualification, []).append(user)
+        picked = []
+        for i in range(count):
+            group = list(by_qualification.values())[i % len(by_qualification)]
+            picked.append(group[(i // len(by_qualification)) % len(group)])
+
+        courses, quizzes = {}, {}
+        for qualification in {user.qualification for user in picked}:
+            courses[qualification] = db.session.execute(
+                db.select(Course.id).where(Course.category == qualification)
+            ).scalars().all()
+            rows = db.session.execute(
+                db.select(Question.quiz_id, Question.id)
+                .join(Quiz, Quiz.id == Question.quiz_id)
+                .join(Course, Course.id == Quiz.course_id)
+                .where(Course.category == qualification)
+                .order_by(Question.quiz_id, Question.id)
+            ).all()
+            quizzes[qualification] = {}
+            for quiz_id, question_id in rows:
+                quizzes[qualification].setdefault(quiz_id, []).append(question_id)
+
+        students = []
+        for user in picked:
+            attempt_ids = db.session.execute(
+                db.select(StudentQuizAttempt.id).where(StudentQuizAttempt.student_id == user.id)
+            ).scalars().all()
+            students.append(Student(user.id, user.username, courses[user.qualification],
+                                    quizzes[user.qualification], attempt_ids))
+        return students
+
+
+class TestClientSession:
+    # In-process requests; the session is set directly instead of logging in.
+    def __init__(self, app, user_id, is_admin=False):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['is_admin'] = is_admin
+
+    def request(self, method, path, form=None):
+        response = self.client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code
+
+
+class HTTPSession:
+    # Requests to a local gunicorn, logged in like a browser.
+    def __init__(self, port, username, password='password'):
+        from benchmarks.serving import Client
+        self.client = Client(port)
+        self.client.login(username, password)
+
+    def request(self, method, path, form=None):
+        return self.client.request(method, path, form).status
+
+
+def step(route, student, rng, student_session, admin_session):
+    # The next request of `route`: (session, method, path, form, expected status).
+    if route == 'home':
+        return student_session, 'GET', '/', None, 200
+    if route == 'student_chapters':
+        return student_session, 'GET', f'/student/chapters/{rng.choice(student.course_ids)}', None, 200
+    if route == 'take_test':
+        return student_session, 'GET', f'/quizzes/{rng.choice(list(student.quizzes))}/take_test', None, 200
+    if route == 'submit_test':
+        quiz_id = rng.choice(list(student.quizzes))
+        form = {f'question_{question_id}': f'option{rng.randint(1, 4)}'
+                for question_id in student.quizzes[quiz_id]}
+        return student_session, 'POST', f'/submit_test/{quiz_id}', form, 302
+    if route == 'view_attempt':
+        return student_session, 'GET', f'/view_attempt/{rng.choice(student.attempt_ids)}', None, 200
+    if route == 'admin_stats':
+        return admin_session, 'GET', '/admin/stats', None, 200
+    raise ValueError(f'Unknown route {route!r}')
+
+
+def run(make_session, admin_login, students, mix, seconds, seed=42):
+    # Every client loops over routes drawn from the mix until the time is up.
+    # Returns {route: summary}.
+    routes, weights = list(mix), list(mix.values())
+    if not all(student.attempt_ids for student in students):
+        weights = [0 if route == 'view_attempt' else weight for route, weight in zip(routes, weights)]
+    latencies = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    lock = threading.Lock()
+    deadline = []
+    # The clock starts once every client has logged in and warmed up
+    barrier = threading.Barrier(len(students), action=lambda: deadline.append(time.monotonic() + seconds))
+
+    def client(index, student):
+        rng = random.Random(seed + index)
+        student_session = make_session(student)
+        admin_session = admin_login() if 'admin_stats' in mix else None
+        # One untimed pass over the mix warms this client's path
+        for route in [route for route, weight in zip(routes, weights) if weight]:
+            session, method, path, form, _ = step(route, student, rng, student_session, admin_session)
+            session.request(method, path, form)
+        barrier.wait()
+        while time.monotonic() < deadline[0]:
+            route = rng.choices(routes, weights)[0]
+            session, method, path, form, expected = step(route, student, rng, student_session, admin_session)
+            started = time.perf_counter()
+            try:
+                ok = session.request(method, path, form) == expected
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies[route].append(elapsed)
+                else:
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=client, args=(i, student)) for i, student in enumerate(students)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {route: report.summarize(latencies[route], errors[route], seconds)
+            for route in routes if latencies[route] or errors[route]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=('small', 'medium', 'large'), default='small')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent students')
+    parser.add_argument('--seconds', type=float, default=20, help='measured duration')
+    parser.add_argument('--database', help='SQLite file to use; generated at --scale if missing')
+    parser.add_argument('--save', metavar='NAME', help='save the results as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with baseline NAME')
+    parser.add_argument('--tolerance', type=float, default=report.DEFAULT_TOLERANCE,
+                        help='allowed p95/throughput change before a route counts as regressed')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='quizmaster-scenarios-')
+    database = os.path.abspath(args.database or os.path.join(workdir, 'scenarios.db'))
+    fresh = not os.path.exists(database)
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    os.environ['SUBMISSION_LOG_DIR'] = os.path.join(workdir, 'log')
+
+    from app import app
+    from bootstrap import ADMIN_USERNAME, bootstrap
+    from benchmarks import datagen
+    from models import db, User
+
+    bootstrap(app)
+    if fresh:
+        started = time.perf_counter()
+        with app.app_context():
+            counts = datagen.generate(**datagen.SCALES[args.scale])
+        print(f'Generated {args.scale} dataset in {time.perf_counter() - started:.1f}s: '
+              + ', '.join(f'{n} {name}' for name, n in counts.items()))
+    students = load_students(app, args.clients)
+
+    settings = {'scale': args.scale if fresh else f'database {database}', 'mix': args.mix,
+                'target': args.target, 'clients': args.clients, 'seconds': args.seconds}
+    mix = MIXES[args.mix]
+    if args.target == 'client':
+        with app.app_context():
+            admin_id = db.session.execute(
+                db.select(User.id).where(User.username == ADMIN_USERNAME)
+            ).scalar_one()
+        results = run(lambda student: TestClientSession(app, student.user_id),
+                      lambda: TestClientSession(app, admin_id, is_admin=True),
+                      students, mix, args.seconds)
+    else:
+        from benchmarks.serving import free_port, start_server, stop_server
+        port = free_port()
+        process = start_server(dict(os.environ), port, workdir)
+        try:
+            results = run(lambda student: HTTPSession(port, student.username),
+                          lambda: HTTPSession(port, ADMIN_USERNAME, ADMIN_PASSWORD),
+                          students, mix, args.seconds)
+        finally:
+            stop_server(process)
+
+    print(', '.join(f'{key} {value}' for key, value in settings.items()))
+    baseline = report.load_baseline(args.compare) if args.compare else None
+    if baseline and baseline['settings'] != settings:
+        print('Note: the baseline was recorded with different settings: '
+              + ', '.join(f'{key} {value}' for key, value in baseline['settings'].items()))
+    report.print_table(results, baseline['results'] if baseline else None)
+    if args.save:
+        print(f'Saved baseline {report.save_baseline(args.save, settings, results)}')
+    if baseline:
+        found = report.regressions(results, baseline['results'], args.tolerance)
+        for route, description in found:
+            print(f'REGRESSION {route}: {description}')
+        if found:
+            return 1
+        print(f'No route regressed by more than {args.tolerance:.0%} against {args.compare}.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
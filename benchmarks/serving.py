@@ -0,0 +1,208 @@
+"""Serving-mode benchmark for the take_test/submit_test path.
+
+Seeds a synthetic dataset into a throwaway SQLite database, then starts
+gunicorn with gunicorn_config.py once per mode (sync without preload, sync,
+gthread, and gevent when installed), all with the same worker count. For
+each mode it reports the first take_test after start-up (cold caches show
+up here) and, under load from --clients logged-in students each looping
+take_test -> submit_test -> submission status for --seconds, the request
+rate and p50/p95/p99 latency of one such round.
+
+    python -m benchmarks.serving [--workers N] [--clients N] [--seconds N]
+"""
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.report import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = [
+    ('sync, no preload', {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_PRELOAD': '0'}),
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync'}),
+    ('gthread', {'GUNICORN_WORKER_CLASS': 'gthread'}),
+    ('gevent', {'GUNICORN_WORKER_CLASS': 'gevent'}),
+]
+
+
+class Client:
+    # One keep-alive connection with a cookie jar; redirects are not followed.
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, form=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v.value}' for k, v in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        return response
+
+    def login(self, username, password='password'):
+        self.expect('POST', '/login', 302, {'username': username, 'password': password})
+
+    def expect(self, method, path, status, form=None):
+        # status: the expected status, or a tuple of those accepted
+        response = self.request(method, path, form)
+        if response.status not in (status if isinstance(status, tuple) else (status,)):
+            raise RuntimeError(f'{method} {path} answered {response.status}, expected {status}')
+        return response
+
+    def round(self, quiz_id, form):
+        # take_test, submit_test and the submission status page it redirects
+        # to, which forwards to the attempt once it is stored
+        self.expect('GET', f'/quizzes/{quiz_id}/take_test', 200)
+        response = self.expect('POST', f'/submit_test/{quiz_id}', 302, form)
+        self.expect('GET', urlsplit(response.headers['Location']).path, (200, 202, 302))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env, port, workdir):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '-b', f'127.0.0.1:{port}',
+         '--pid', os.path.join(workdir, 'gunicorn.pid'), 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'gunicorn.log'), 'a'),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited, see {workdir}/gunicorn.log')
+        try:
+            Client(port).request('GET', '/login')
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+def load(port, usernames, quiz_id, form, seconds):
+    clients = []
+    for username in usernames:
+        client = Client(port)
+        client.login(username)
+        clients.append(client)
+    latencies, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(clients) + 1)
+    deadline = []
+
+    def run(client):
+        barrier.wait()
+        while time.monotonic() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                client.round(quiz_id, form)
+            except Exception as exc:
+                with lock:
+                    errors.append(exc)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=run, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    deadline.append(time.monotonic() + seconds)
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers in every mode')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent students')
+    parser.add_argument('--seconds', type=float, default=10, help='load duration per mode')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='quizmaster-serving-')
+    env = dict(os.environ,
+               SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'serving.db'),
+               SUBMISSION_LOG_DIR=os.path.join(workdir, 'log'),
+               WEB_CONCURRENCY=str(args.workers),
+               # The generated quizzes are spread over two years; warm them all
+               WARMUP_QUIZ_DAYS='100000')
+    os.environ.update(env)
+
+    from app import app
+    from bootstrap import upgrade
+    from benchmarks import datagen
+    from models import db, Course, Quiz, Question
+
+    upgrade(app)
+    with app.app_context():
+        per_qualification = max(1, args.clients)
+        datagen.generate(users_per_qualification=per_qualification, attempts_per_user=2)
+        quiz = db.session.execute(
+            db.select(Quiz).join(Course, Course.id == Quiz.course_id)
+            .where(Course.category == 'Foundation').order_by(Quiz.id)
+        ).scalars().first()
+        questions = db.session.execute(
+            db.select(Question).where(Question.quiz_id == quiz.id).order_by(Question.id)
+        ).scalars().all()
+        form = {f'question_{q.id}': q.correct_answer for q in questions}
+        quiz_id = quiz.id
+    usernames = [f'foundation{i}@example.com' for i in range(args.clients)]
+    print(f'{args.workers} workers, {args.clients} clients, {args.seconds:g}s per mode')
+
+    for name, mode_env in MODES:
+        if mode_env['GUNICORN_WORKER_CLASS'] == 'gevent':
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print(f'{name}: skipped, gevent is not installed')
+                continue
+        port = free_port()
+        process = start_server(dict(env, **mode_env), port, workdir)
+        try:
+            client = Client(port)
+            client.login(usernames[0])
+            started = time.perf_counter()
+            client.expect('GET', f'/quizzes/{quiz_id}/take_test', 200)
+            first = time.perf_counter() - started
+            latencies, errors = load(port, usernames, quiz_id, form, args.seconds)
+        finally:
+            stop_server(process)
+        if not latencies:
+            print(f'{name}: no round completed, {len(errors)} errors ({errors[:1]})')
+            continue
+        print(f'{name}: first take_test {first * 1000:.1f}ms, '
+              f'{len(latencies) / args.seconds:.1f} rounds/s, '
+              f'p50 {percentile(latencies, 0.50) * 1000:.1f}ms, '
+              f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms, '
+              f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms, {len(errors)} errors')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Exam-end submission burst benchmark.
+
+Seeds a synthetic dataset into a throwaway SQLite database, then releases
+N students at once onto POST /submit_test, first with the synchronous
+insert-per-request path and then with the write-behind submission queue.
+Reports acknowledgement latency (p50/p95/max), failed requests, and how
+long it took until every attempt was in the database.
+
+    python -m benchmarks.submissions [--submissions N] [--concurrency N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.report import percentile
+
+
+def burst(app, students, quiz_id, form, concurrency):
+    # Submit once per student from `concurrency` threads released together.
+    # Returns (latencies in seconds, failed request count, wall time, start).
+    chunks = [students[i::concurrency] for i in range(concurrency)]
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def run(chunk):
+        client = app.test_client()
+        barrier.wait()
+        for student_id in chunk:
+            with client.session_transaction() as session:
+                session['user_id'] = student_id
+            started = time.perf_counter()
+            try:
+                response = client.post(f'/submit_test/{quiz_id}', data=form)
+                ok = response.status_code == 302
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures.append(student_id)
+
+    threads = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks if chunk]
+    barrier = threading.Barrier(len(threads) + 1)
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, len(failures), time.perf_counter() - started, started
+
+
+def wait_for_rows(app, quiz_id, expected, started, timeout=60):
+    # Seconds from the start of the burst until `expected` attempts exist.
+    from models import db, StudentQuizAttempt
+    deadline = time.monotonic() + timeout
+    with app.app_context():
+        while time.monotonic() < deadline:
+            count = db.session.execute(
+                db.select(db.func.count(StudentQuizAttempt.id)).where(StudentQuizAttempt.quiz_id == quiz_id)
+            ).scalar()
+            db.session.remove()
+            if count >= expected:
+                return time.perf_counter() - started
+            time.sleep(0.005)
+    return None
+
+
+def report(name, latencies, failures, wall, landed):
+    print(f'{name}: {len(latencies)} submissions in {wall:.2f}s, '
+          f'ack p50 {percentile(latencies, 0.50) * 1000:.1f}ms, '
+          f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms, '
+          f'max {max(latencies) * 1000:.1f}ms, {failures} failed, '
+          + (f'all rows stored after {landed:.2f}s' if landed is not None else 'rows still missing'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=1000, help='students submitting at once')
+    parser.add_argument('--concurrency', type=int, default=200, help='client threads')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='quizmaster-submissions-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'submissions.db')
+
+    from app import app
+    from bootstrap import upgrade
+    from benchmarks import datagen
+    from models import db, User, Quiz, Question
+
+    app.config['SUBMISSION_LOG_DIR'] = os.path.join(workdir, 'log')
+    upgrade(app)
+    with app.app_context():
+        per_qualification = -(-args.submissions // len(datagen.QUALIFICATIONS))
+        datagen.generate(users_per_qualification=per_qualification, attempts_per_user=0)
+        students = db.session.execute(
+            db.select(User.id).where(User.is_admin.isnot(True)).order_by(User.id).limit(args.submissions)
+        ).scalars().all()
+        quizzes = db.session.execute(db.select(Quiz.id).order_by(Quiz.id).limit(2)).scalars().all()
+        forms = {}
+        for quiz_id in quizzes:
+            questions = db.session.execute(
+                db.select(Question).where(Question.quiz_id == quiz_id).order_by(Question.id)
+            ).scalars().all()
+            forms[quiz_id] = {f'question_{q.id}': q.correct_answer for q in questions}
+    print(f'{len(students)} students, {args.concurrency} client threads')
+
+    # One quiz per mode so the row counts do not mix
+    for (name, queued), quiz_id in zip((('sync', False), ('queued', True)), quizzes):
+        app.config['SUBMISSION_QUEUE'] = queued
+        latencies, failures, wall, started = burst(app, students, quiz_id, forms[quiz_id], args.concurrency)
+        landed = wait_for_rows(app, quiz_id, len(students) - failures, started)
+        report(name, latencies, failures, wall, landed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
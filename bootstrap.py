@@ -0,0 +1,252 @@
+import click
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from models import (db, User, Course, Chapter, Quiz, Question, StudentQuizAttempt, AttemptStatsRollup, QuizSnapshot,
+                    AppCounter, QuizLeaderboardEntry, CourseLeaderboardEntry, RegradeRun, QuizScoreCount,
+                    CourseScoreCount)
+from stats import rebuild_rollups
+from leaderboard import rebuild_leaderboards, rebuild_score_counts
+import search
+import snapshots
+
+# Schema bootstrap: versioned migrations, a drift check and admin seeding.
+# Run once per deploy (`flask db-upgrade && flask seed-admin`, or the gunicorn
+# on_starting hook) so the request path never issues DDL or seeding queries.
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+
+ADMIN_USERNAME = 'admin@example.com'
+
+
+class SchemaDriftError(RuntimeError):
+    pass
+
+
+def _create_tables(conn, *models):
+    for model in models:
+        model.__table__.create(conn, checkfirst=True)
+
+
+def _create_indexes(conn, model, *names):
+    # Only the indexes a migration names: the model also has those of later
+    # migrations, on columns an older database does not have yet. IF NOT
+    # EXISTS rather than checkfirst: SQLite does not reflect expression indexes.
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        conn.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+
+def _add_column(conn, model, column_name):
+    table = model.__table__
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    if column_name in existing:
+        return
+    column = table.c[column_name]
+    ddl = column.type.compile(dialect=conn.dialect)
+    constraints = ''
+    if column.server_default is not None:
+        constraints = f' DEFAULT {column.server_default.arg}'
+        if not column.nullable:
+            constraints += ' NOT NULL'
+    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_name} {ddl}{constraints}'))
+
+
+def _0001_baseline(conn):
+    _create_tables(conn, User, Course, Chapter, Quiz, Question, StudentQuizAttempt)
+
+
+def _0002_filter_indexes(conn):
+    _create_indexes(conn, User, 'ix_users_qualification')
+    _create_indexes(conn, Course, 'ix_courses_category')
+    _create_indexes(conn, Chapter, 'ix_chapters_course_id')
+    _create_indexes(conn, Quiz, 'ix_quizzes_course_id', 'ix_quizzes_chapter_id')
+    _create_indexes(conn, Question, 'ix_questions_quiz_id', 'ix_questions_chapter_id')
+    _create_indexes(conn, StudentQuizAttempt, 'ix_student_quiz_attempts_quiz_id', 'ix_attempts_student_quiz_date')
+
+
+def _0003_attempt_stats_rollups(conn):
+    _create_tables(conn, AttemptStatsRollup)
+    rebuild_rollups(conn)
+
+
+def _0004_search_index(conn):
+    search.create_index(conn)
+
+
+def _0005_quiz_version(conn):
+    _add_column(conn, Quiz, 'version')
+
+
+def _0006_attempt_snapshots(conn):
+    _create_tables(conn, QuizSnapshot)
+    _add_column(conn, StudentQuizAttempt, 'snapshot_hash')
+    _add_column(conn, StudentQuizAttempt, 'selections')
+    snapshots.convert_legacy_attempts(conn)
+
+
+def _0007_attempt_pagination_index(conn):
+    _create_indexes(conn, StudentQuizAttempt, 'ix_attempts_student_id')
+
+
+def _0008_app_counters(conn):
+    _create_tables(conn, AppCounter)
+
+
+def _0009_submission_tokens(conn):
+    _add_column(conn, StudentQuizAttempt, 'submission_token')
+    _create_indexes(conn, StudentQuizAttempt, 'ix_student_quiz_attempts_submission_token')
+
+
+def _0010_user_session_version(conn):
+    _add_column(conn, User, 'session_version')
+
+
+def _0011_leaderboards(conn):
+    # rebuild_leaderboards also fills the score counts of migration 14
+    _create_tables(conn, QuizLeaderboardEntry, CourseLeaderboardEntry, QuizScoreCount, CourseScoreCount)
+    rebuild_leaderboards(conn)
+
+
+def _0012_regrade_runs(conn):
+    _create_tables(conn, RegradeRun)
+
+
+def _0013_course_category_sort_index(conn):
+    _create_indexes(conn, Course, 'ix_courses_category_sort')
+
+
+def _0014_leaderboard_score_counts(conn):
+    _create_tables(conn, QuizScoreCount, CourseScoreCount)
+    rebuild_score_counts(conn, 'quiz')
+    rebuild_score_counts(conn, 'course')
+
+
+# Ordered list of (version, description, function). Every migration must be
+# idempotent: fresh databases get tables created from the current models, so
+# later steps can find their work already done.
+MIGRATIONS = [
+    (1, 'baseline schema', _0001_baseline),
+    (2, 'indexes on foreign-key and filter columns', _0002_filter_indexes),
+    (3, 'attempt statistics rollups', _0003_attempt_stats_rollups),
+    (4, 'catalogue search index', _0004_search_index),
+    (5, 'quiz content version counter', _0005_quiz_version),
+    (6, 'compact attempts with quiz snapshots', _0006_attempt_snapshots),
+    (7, 'index for paging student attempts', _0007_attempt_pagination_index),
+    (8, 'shared counters for the page cache', _0008_app_counters),
+    (9, 'submission tokens for queued attempts', _0009_submission_tokens),
+    (10, 'session version for signing users out', _0010_user_session_version),
+    (11, 'quiz and course leaderboards', _0011_leaderboards),
+    (12, 'regrade audit records', _0012_regrade_runs),
+    (13, 'index for paging courses by category', _0013_course_category_sort_index),
+    (14, 'students per score on each leaderboard', _0014_leaderboard_score_counts),
+]
+
+HEAD_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(255) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def current_version(conn):
+    if not inspect(conn).has_table(SCHEMA_VERSION_TABLE):
+        return 0
+    version = conn.execute(text(f'SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}')).scalar()
+    return version or 0
+
+
+def upgrade(app, echo=print):
+    with app.app_context():
+        with db.engine.begin() as conn:
+            _ensure_version_table(conn)
+            applied = current_version(conn)
+            for version, description, migrate in MIGRATIONS:
+                if version <= applied:
+                    continue
+                echo(f'Applying migration {version:04d}: {description}')
+                migrate(conn)
+                conn.execute(
+                    text(f'INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_at) '
+                         'VALUES (:version, :description, :applied_at)'),
+                    {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                )
+        return HEAD_VERSION
+
+
+def check_schema(app):
+    # Fail fast if the database is behind (or ahead of) the code, or if any
+    # mapped table/column is missing.
+    with app.app_context():
+        with db.engine.connect() as conn:
+            version = current_version(conn)
+            if version != HEAD_VERSION:
+                raise SchemaDriftError(
+                    f'Database schema is at version {version}, code expects {HEAD_VERSION}. '
+                    'Run `flask db-upgrade`.'
+                )
+            inspector = inspect(conn)
+            problems = []
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    problems.append(f'missing table {table.name}')
+                    continue
+                existing = {c['name'] for c in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        problems.append(f'missing column {table.name}.{column.name}')
+            if problems:
+                raise SchemaDriftError('Schema drift detected: ' + ', '.join(problems))
+
+
+def seed_admin(app):
+    with app.app_context():
+        if User.query.filter_by(username=ADMIN_USERNAME).first() is not None:
+            return False
+        admin = User(
+            username=ADMIN_USERNAME,
+            full_name='Quiz Master',
+            qualification='Admin',
+            dob=datetime.strptime('2000-01-01', '%Y-%m-%d').date(),
+            is_admin=True
+        )
+        admin.set_password('20210')
+        db.session.add(admin)
+        db.session.commit()
+        return True
+
+
+def bootstrap(app):
+    upgrade(app)
+    seed_admin(app)
+    check_schema(app)
+
+
+def register_commands(app):
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Apply pending schema migrations."""
+        version = upgrade(app, echo=click.echo)
+        click.echo(f'Schema is at version {version}.')
+
+    @app.cli.command('check-schema')
+    def check_schema_command():
+        """Exit non-zero if the database schema does not match the code."""
+        try:
+            check_schema(app)
+        except SchemaDriftError as e:
+            raise click.ClickException(str(e))
+        click.echo('Schema is up to date.')
+
+    @app.cli.command('seed-admin')
+    def seed_admin_command():
+        """Create the default admin account if it does not exist."""
+        if seed_admin(app):
+            click.echo('Admin user created.')
+        else:
+            click.echo('Admin user already exists.')
@@ -6,4 +6,42 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
-    SQLALCHEMY_TRACK_MODIFICATIONS = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
+    QUIZ_CACHE_SIZE = int(os.getenv('QUIZ_CACHE_SIZE', 256))
+    PURGE_SYNC_LIMIT = int(os.getenv('PURGE_SYNC_LIMIT', 5000))
+    PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', 1000))
+    PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 512))
+    RELEASE = os.getenv('RELEASE', os.getenv('RENDER_GIT_COMMIT', ''))
+    SUBMISSION_QUEUE = os.getenv('SUBMISSION_QUEUE', '1') == '1'
+    SUBMISSION_LOG_DIR = os.getenv('SUBMISSION_LOG_DIR')  # default: <instance>/submissions
+    SUBMISSION_BATCH_SIZE = int(os.getenv('SUBMISSION_BATCH_SIZE', 200))
+    SUBMISSION_MAX_DELAY = float(os.getenv('SUBMISSION_MAX_DELAY', 0.05))
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 2))  # gunicorn workers
+    WARMUP_QUIZ_DAYS = int(os.getenv('WARMUP_QUIZ_DAYS', 7))  # quizzes cached before serving
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))  # per worker
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_MAX_CONNECTIONS = os.getenv('DB_MAX_CONNECTIONS')  # across all workers
+    SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))  # ms
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    METRICS_DIR = os.getenv('METRICS_DIR')  # default: <instance>/metrics
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))  # seconds
+    SERVER_TIMING = os.getenv('SERVER_TIMING', '1') == '1'
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+    SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')  # werkzeug method string
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # 0: hash on the request thread
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    USER_CLAIMS_TTL = float(os.getenv('USER_CLAIMS_TTL', 60))  # seconds session claims are trusted
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 4096))
+    ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', 64))  # quizzes
+    SCORE_SERIES_POINTS = int(os.getenv('SCORE_SERIES_POINTS', 30))  # per course on /student/stats
+    REGRADE_SYNC_LIMIT = int(os.getenv('REGRADE_SYNC_LIMIT', 5000))  # attempts regraded within the request
+    REGRADE_BATCH_SIZE = int(os.getenv('REGRADE_BATCH_SIZE', 5000))
+    TEMPLATE_BYTECODE_CACHE = os.getenv('TEMPLATE_BYTECODE_CACHE', '1') == '1'
+    TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR')  # default: <instance>/jinja
+    TEMPLATES_AUTO_RELOAD = os.getenv('TEMPLATES_AUTO_RELOAD', '0') == '1'  # the development server turns it on
+    ASSET_MAX_AGE = int(os.getenv('ASSET_MAX_AGE', 365 * 24 * 3600))  # seconds fingerprinted assets are cached
@@ -0,0 +1,188 @@
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import Pool, QueuePool
+
+# Engine options per database backend, and connection pool metrics.
+#
+# configure(app) fills SQLALCHEMY_ENGINE_OPTIONS from the profile matching
+# SQLALCHEMY_DATABASE_URI before db.init_app; anything already set there
+# wins. Both profiles use TimedQueuePool, which records how long each
+# checkout waited for a connection; every pool also records how long
+# connections stay checked out.
+#
+# sqlite: every new connection switches to WAL (readers no longer block on
+#   the writer), waits SQLITE_BUSY_TIMEOUT ms for a lock instead of failing,
+#   syncs at SQLITE_SYNCHRONOUS (NORMAL is durable in WAL mode except for the
+#   last transactions on power loss) and memory-maps up to SQLITE_MMAP_SIZE.
+#   In-memory databases keep Flask-SQLAlchemy's StaticPool.
+# server databases: pooled connections are pinged before use and recycled
+#   after DB_POOL_RECYCLE seconds, so restarts and idle timeouts on the server
+#   or a proxy do not surface as request errors.
+#
+# Pool sizes are per process. With DB_MAX_CONNECTIONS set, pool_size plus
+# max_overflow is capped at that budget divided by WEB_CONCURRENCY, the
+# gunicorn worker count, so all workers together stay within it.
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.checkins = 0
+            self.held_total = 0.0
+            self.held_max = 0.0
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_held(self, seconds):
+        with self._lock:
+            self.checkins += 1
+            self.held_total += seconds
+            self.held_max = max(self.held_max, seconds)
+
+    def info(self):
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / waits * 1000, 3) if waits else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'held_avg_ms': round(self.held_total / self.checkins * 1000, 3) if self.checkins else 0.0,
+                'held_max_ms': round(self.held_max * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records the time spent waiting for each checkout
+    # (including opening a new connection).
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeout:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return record
+
+
+_sqlite_pragmas = ()
+
+
+def sqlite_pragmas(config):
+    synchronous = config.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f'SQLITE_SYNCHRONOUS must be one of {", ".join(SYNCHRONOUS_MODES)}.')
+    return (
+        ('journal_mode', 'WAL'),
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT', 5000))),
+        ('synchronous', synchronous),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 0))),
+    )
+
+
+def _is_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def pool_sizes(config):
+    pool_size = int(config.get('DB_POOL_SIZE', 5))
+    max_overflow = int(config.get('DB_MAX_OVERFLOW', 10))
+    budget = config.get('DB_MAX_CONNECTIONS')
+    if budget:
+        per_worker = max(1, int(budget) // max(1, int(config.get('WEB_CONCURRENCY', 1))))
+        pool_size = min(pool_size, per_worker)
+        max_overflow = max(0, min(max_overflow, per_worker - pool_size))
+    return pool_size, max_overflow
+
+
+def engine_options(uri, config):
+    # Engine options for the database at uri, per its backend's profile.
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and _is_memory(url):
+        return {}
+    pool_size, max_overflow = pool_sizes(config)
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': float(config.get('DB_POOL_TIMEOUT', 30)),
+    }
+    if url.get_backend_name() != 'sqlite':
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = int(config.get('DB_POOL_RECYCLE', 1800))
+    return options
+
+
+def configure(app):
+    # Call before db.init_app(app).
+    global _sqlite_pragmas
+    _sqlite_pragmas = sqlite_pragmas(app.config)
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if uri:
+        options = engine_options(uri, app.config)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.record_connect()
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for name, value in _sqlite_pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out_at'] = time.perf_counter()
+
+
+@event.listens_for(Pool, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop('checked_out_at', None)
+    if checked_out_at is not None:
+        pool_stats.record_held(time.perf_counter() - checked_out_at)
+
+
+def pool_info(engine):
+    # Pool metrics of this process, plus the current state of engine's pool.
+    info = pool_stats.info()
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        info.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                    overflow=pool.overflow())
+    info['pool'] = type(pool).__name__
+    return info
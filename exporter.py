@@ -0,0 +1,178 @@
+import csv
+import io
+import json
+import click
+from sqlalchemy import Date, DateTime, func, select
+from models import db, User, Quiz, StudentQuizAttempt
+
+# Streaming export of attempts and gradebooks for a quiz, chapter or course.
+#
+# Rows come from one joined query executed with yield_per, so they are
+# fetched from the database in batches while earlier batches are already
+# being written out, and memory stays flat however many rows there are.
+# 'attempts' is one row per attempt; 'gradebook' is one row per student and
+# quiz with the attempt count, best score and date of the last attempt.
+
+FORMATS = ('csv', 'jsonl')
+
+KINDS = ('attempts', 'gradebook')
+
+SCOPES = ('quiz', 'chapter', 'course')
+
+DEFAULT_BATCH_SIZE = 1000
+
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# A CSV cell starting with one of these is run as a formula by spreadsheet
+# applications; names and usernames are chosen by students.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _scope_filter(scope, scope_id):
+    column = {'quiz': Quiz.id, 'chapter': Quiz.chapter_id, 'course': Quiz.course_id}.get(scope)
+    if column is None:
+        raise ExportError(f'Unknown export scope {scope!r}; expected one of {", ".join(SCOPES)}.')
+    return column == scope_id
+
+
+def attempts_statement(scope, scope_id):
+    attempt = StudentQuizAttempt
+    return (
+        select(
+            attempt.id.label('attempt_id'),
+            User.id.label('student_id'),
+            User.username,
+            User.full_name,
+            User.qualification,
+            Quiz.course_id,
+            Quiz.chapter_id,
+            Quiz.id.label('quiz_id'),
+            Quiz.name.label('quiz_name'),
+            attempt.attempt_date,
+            attempt.score,
+            attempt.total_questions,
+        )
+        .join(User, User.id == attempt.student_id)
+        .join(Quiz, Quiz.id == attempt.quiz_id)
+        .where(_scope_filter(scope, scope_id))
+        # Quiz by quiz, in the order of the attempts' quiz_id index: no sort
+        .order_by(attempt.quiz_id, attempt.id)
+    )
+
+
+def gradebook_statement(scope, scope_id):
+    attempt = StudentQuizAttempt
+    return (
+        select(
+            User.id.label('student_id'),
+            User.username,
+            User.full_name,
+            User.qualification,
+            Quiz.course_id,
+            Quiz.chapter_id,
+            Quiz.id.label('quiz_id'),
+            Quiz.name.label('quiz_name'),
+            func.count(attempt.id).label('attempts'),
+            func.max(attempt.score).label('best_score'),
+            func.max(attempt.total_questions).label('total_questions'),
+            func.max(attempt.attempt_date).label('last_attempt_date'),
+        )
+        .join(User, User.id == attempt.student_id)
+        .join(Quiz, Quiz.id == attempt.quiz_id)
+        .where(_scope_filter(scope, scope_id))
+        .group_by(User.id, User.username, User.full_name, User.qualification,
+                  Quiz.course_id, Quiz.chapter_id, Quiz.id, Quiz.name)
+        .order_by(User.id, Quiz.id)
+    )
+
+
+STATEMENTS = {'attempts': attempts_statement, 'gradebook': gradebook_statement}
+
+
+def iter_batches(kind, scope, scope_id, batch_size=DEFAULT_BATCH_SIZE):
+    # Yield the header (a tuple of column names), then lists of up to
+    # batch_size row tuples, with dates as ISO 8601 strings.
+    statement = STATEMENTS[kind](scope, scope_id).execution_options(yield_per=batch_size)
+    dates = [i for i, column in enumerate(statement.selected_columns)
+             if isinstance(column.type, (Date, DateTime))]
+    result = db.session.execute(statement)
+    yield tuple(result.keys())
+    for partition in result.partitions():
+        if not dates:
+            yield partition
+            continue
+        batch = []
+        for row in partition:
+            row = list(row)
+            for i in dates:
+                if row[i] is not None:
+                    row[i] = row[i].isoformat()
+            batch.append(row)
+        yield batch
+
+
+def _csv_cell(value):
+    # Quote a would-be formula so a spreadsheet shows it as text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_chunks(batches, fmt):
+    # Encode batches as CSV or JSON Lines, yielding one string per batch. The
+    # CSV header goes out on its own so a download starts at once.
+    header = next(batches)
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        yield buffer.getvalue()
+        for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([_csv_cell(value) for value in row] for row in batch)
+            yield buffer.getvalue()
+    else:
+        for batch in batches:
+            yield ''.join(json.dumps(dict(zip(header, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+def export(kind, scope, scope_id, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    # Generator of text chunks. Arguments are checked before it is returned,
+    # so errors surface before a response has started.
+    if kind not in STATEMENTS:
+        raise ExportError(f'Unknown export {kind!r}; expected one of {", ".join(KINDS)}.')
+    if fmt not in FORMATS:
+        raise ExportError(f'Unsupported format {fmt!r}; expected one of {", ".join(FORMATS)}.')
+    _scope_filter(scope, scope_id)
+    return iter_chunks(iter_batches(kind, scope, scope_id, batch_size), fmt)
+
+
+def filename(kind, scope, scope_id, fmt):
+    return f'{scope}-{scope_id}-{kind}.{fmt}'
+
+
+def register_commands(app):
+    @app.cli.command('export-attempts')
+    @click.option('--quiz', 'quiz_id', type=int, help='Export one quiz.')
+    @click.option('--chapter', 'chapter_id', type=int, help='Export every quiz of a chapter.')
+    @click.option('--course', 'course_id', type=int, help='Export every quiz of a course.')
+    @click.option('--kind', type=click.Choice(KINDS), default='attempts', show_default=True)
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv', show_default=True)
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+    @click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='Output file (default: stdout).')
+    def export_attempts_command(quiz_id, chapter_id, course_id, kind, fmt, batch_size, output):
+        """Stream attempts or a gradebook as CSV or JSON Lines."""
+        targets = [(scope, value) for scope, value in
+                   (('quiz', quiz_id), ('chapter', chapter_id), ('course', course_id))
+                   if value is not None]
+        if len(targets) != 1:
+            raise click.UsageError('Pass exactly one of --quiz, --chapter or --course.')
+        scope, scope_id = targets[0]
+        for chunk in export(kind, scope, scope_id, fmt, batch_size):
+            output.write(chunk)
@@ -1,2 +1,87 @@
+import os
+
+# Production serving: `gunicorn -c gunicorn_config.py app:app` (start.sh).
+#
+# GUNICORN_WORKER_CLASS  sync, gthread (default) or gevent (needs the gevent
+#                        package from requirements.txt)
+# WEB_CONCURRENCY        worker processes, by default derived from the CPUs
+# GUNICORN_THREADS       threads per gthread worker (default 4)
+# GUNICORN_PRELOAD       1 (default) loads and warms up the app once in the
+#                        master; workers fork from it ready to serve
+#
+# A HUP restarts the workers gracefully but, with preload, from the code
+# already loaded in the master. To deploy new code without dropping
+# requests use `./start.sh reload`, which starts a new master with USR2 and
+# retires the old one once it is up.
+
 bind = "0.0.0.0:10000"
-workers = 2
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent":
+    # Patch before the app, its locks and its threads are created
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise RuntimeError("GUNICORN_WORKER_CLASS=gevent needs gevent: pip install -r requirements.txt") from None
+    monkey.patch_all()
+
+
+def _cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _default_workers():
+    # A sync worker serves one request at a time, so more processes cover
+    # the time spent waiting on the database; gthread and gevent workers
+    # overlap those waits themselves.
+    cpus = _cpu_count()
+    return {"sync": 2 * cpus + 1, "gthread": cpus + 1}.get(worker_class, cpus)
+
+
+workers = int(os.getenv("WEB_CONCURRENCY") or _default_workers())
+# The database pools are sized per worker from this, see engines.py
+os.environ["WEB_CONCURRENCY"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", 4)) if worker_class == "gthread" else 1
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+pidfile = os.getenv("GUNICORN_PIDFILE", "/tmp/quizmaster-gunicorn.pid")
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Apply migrations and seed the admin once in the master, before any
+    # worker starts serving requests. The master imports the app for this
+    # even without preload, so it always closes its connections afterwards.
+    from app import app
+    from bootstrap import bootstrap
+    from metrics import clear
+    from warmup import warm_up, dispose_engines
+    bootstrap(app)
+    clear(app)
+    if preload_app:
+        warm_up(app)
+    dispose_engines(app, close=True)
+
+
+def post_fork(server, worker):
+    # Workers inherit the master's app module, with or without preload;
+    # drop the pool they inherited so no connection is shared.
+    from app import app
+    from engines import pool_stats
+    from warmup import dispose_engines
+    dispose_engines(app)
+    pool_stats.reset()
+
+
+def post_worker_init(worker):
+    from bootstrap import check_schema
+    from submissions import replay_orphaned_logs
+    check_schema(worker.wsgi)
+    # Submissions acknowledged by a worker that died are committed now
+    replay_orphaned_logs(worker.wsgi)
+    if not preload_app:
+        from warmup import warm_up
+        warm_up(worker.wsgi)
@@ -0,0 +1,205 @@
+import csv
+import io
+import json
+import click
+from sqlalchemy import insert
+from models import db, Quiz, Question
+import quiz_cache
+
+# Streaming bulk import of questions from CSV or JSON Lines.
+#
+# Rows are parsed one at a time, validated, and inserted in executemany
+# batches inside a single transaction, so a 2,000-question bank is one commit
+# and memory stays flat regardless of file size. Columns (CSV header or JSON
+# keys): question_statement, option1-option4, correct_answer and, when
+# importing into a chapter, quiz_id. correct_answer may be 'option1'-'option4',
+# 1-4, or the exact text of one of the options.
+
+FORMATS = ('csv', 'jsonl')
+
+DEFAULT_BATCH_SIZE = 500
+
+# Only the first errors are kept for reporting; the rest are just counted.
+MAX_REPORTED_ERRORS = 100
+
+OPTION_COLUMNS = ('option1', 'option2', 'option3', 'option4')
+
+_LENGTHS = {'question_statement': 255, 'option1': 100, 'option2': 100, 'option3': 100,
+            'option4': 100}
+
+
+class QuestionImportError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []  # (line number, message)
+        self.committed = False
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def guess_format(filename):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, fmt):
+    # Yield (line number, dict) from a binary stream without reading it whole.
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(text_stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+                continue
+            yield line_number, row
+    else:
+        raise QuestionImportError(f'Unsupported format {fmt!r}; expected one of {", ".join(FORMATS)}.')
+
+
+def _correct_answer(value, options):
+    value = str(value).strip()
+    if value in OPTION_COLUMNS:
+        number = OPTION_COLUMNS.index(value) + 1
+    elif value in ('1', '2', '3', '4'):
+        number = int(value)
+    elif value and value in options:
+        number = options.index(value) + 1
+    else:
+        return None
+    return OPTION_COLUMNS[number - 1] if options[number - 1] else None
+
+
+def validate_row(row, quizzes, default_quiz_id):
+    # Returns (values for Question, None) or (None, error message).
+    if not isinstance(row, dict):
+        return None, 'row is not an object'
+    values = {}
+    for column in ('question_statement',) + OPTION_COLUMNS:
+        value = row.get(column)
+        value = '' if value is None else str(value).strip()
+        if len(value) > _LENGTHS[column]:
+            return None, f'{column} is longer than {_LENGTHS[column]} characters'
+        values[column] = value or None
+    for column in ('question_statement', 'option1', 'option2'):
+        if not values[column]:
+            return None, f'{column} is required'
+
+    options = [values[column] for column in OPTION_COLUMNS]
+    correct = _correct_answer(row.get('correct_answer') or '', options)
+    if correct is None:
+        return None, 'correct_answer does not match any option'
+    values['correct_answer'] = correct
+
+    quiz_id = row.get('quiz_id') or default_quiz_id
+    try:
+        quiz_id = int(quiz_id)
+    except (TypeError, ValueError):
+        return None, 'quiz_id is required'
+    if quiz_id not in quizzes:
+        return None, f'quiz {quiz_id} is not part of this import target'
+    values['quiz_id'] = quiz_id
+    values['chapter_id'] = quizzes[quiz_id]
+    return values, None
+
+
+def import_questions(stream, fmt, quiz_id=None, chapter_id=None,
+                     batch_size=DEFAULT_BATCH_SIZE, strict=False):
+    # Import into one quiz, or into the quizzes of one chapter (rows then
+    # name their quiz_id). With strict, any invalid row rolls back the lot.
+    if quiz_id is not None:
+        quiz = db.session.get(Quiz, quiz_id)
+        if quiz is None:
+            raise QuestionImportError(f'Quiz {quiz_id} does not exist.')
+        quizzes = {quiz.id: quiz.chapter_id}
+    elif chapter_id is not None:
+        rows = db.session.execute(
+            db.select(Quiz.id, Quiz.chapter_id).where(Quiz.chapter_id == chapter_id)
+        ).all()
+        quizzes = dict(rows)
+        if not quizzes:
+            raise QuestionImportError(f'Chapter {chapter_id} has no quizzes to import into.')
+    else:
+        raise QuestionImportError('An import needs a quiz or a chapter.')
+
+    result = ImportResult()
+    touched = set()
+    batch = []
+    try:
+        for line, row in iter_rows(stream, fmt):
+            if isinstance(row, Exception):
+                result.add_error(line, f'invalid JSON: {row}')
+                continue
+            values, error = validate_row(row, quizzes, quiz_id)
+            if error:
+                result.add_error(line, error)
+                continue
+            batch.append(values)
+            touched.add(values['quiz_id'])
+            if len(batch) >= batch_size:
+                db.session.execute(insert(Question), batch)
+                result.inserted += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(Question), batch)
+            result.inserted += len(batch)
+
+        if strict and result.error_count:
+            db.session.rollback()
+            result.inserted = 0
+            return result
+        for touched_quiz_id in touched:
+            quiz_cache.invalidate(touched_quiz_id)
+        db.session.commit()
+        result.committed = True
+    except UnicodeDecodeError:
+        db.session.rollback()
+        raise QuestionImportError('The file is not valid UTF-8.')
+    except Exception:
+        db.session.rollback()
+        raise
+    return result
+
+
+def register_commands(app):
+    @app.cli.command('import-questions')
+    @click.argument('file', type=click.File('rb'))
+    @click.option('--quiz', 'quiz_id', type=int, help='Quiz to import into.')
+    @click.option('--chapter', 'chapter_id', type=int,
+                  help='Chapter to import into; rows must carry a quiz_id.')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS),
+                  help='Input format (default: from the file extension).')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+    @click.option('--strict', is_flag=True, help='Import nothing if any row is invalid.')
+    def import_questions_command(file, quiz_id, chapter_id, fmt, batch_size, strict):
+        """Bulk import questions from a CSV or JSON Lines file."""
+        if (quiz_id is None) == (chapter_id is None):
+            raise click.UsageError('Pass exactly one of --quiz or --chapter.')
+        try:
+            result = import_questions(file, fmt or guess_format(file.name), quiz_id=quiz_id,
+                                      chapter_id=chapter_id, batch_size=batch_size, strict=strict)
+        except QuestionImportError as e:
+            raise click.ClickException(str(e))
+        for line, message in result.errors:
+            click.echo(f'line {line}: {message}', err=True)
+        if result.error_count > len(result.errors):
+            click.echo(f'... and {result.error_count - len(result.errors)} more errors', err=True)
+        click.echo(f'Imported {result.inserted} questions, {result.error_count} rows rejected.')
+        if result.error_count:
+            raise SystemExit(1)
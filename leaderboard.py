@@ -0,0 +1,269 @@
+from collections import namedtuple
+import click
+from sqlalchemy import and_, case, delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import (db, User, Quiz, StudentQuizAttempt, QuizLeaderboardEntry, CourseLeaderboardEntry,
+                    QuizScoreCount, CourseScoreCount)
+
+# Per-quiz and per-course leaderboards.
+#
+# A board keeps one row per student. For a quiz, the row holds the student's
+# best score. For a course, it holds the sum of their best quiz scores. Each
+# row also records when that score was reached. submit_test (or the
+# submission writer) folds every attempt into both rows with two upserts in
+# the attempt's transaction, so no view ever sorts attempts. The boards are
+# indexed in ranking order. The top of a board is one index range. Each
+# board also keeps how many students have each score, moved along with
+# every row that changes score. A student's rank is then the sum of the
+# counts above their score plus the students tied with them who reached it
+# earlier: a read bounded by the number of distinct scores and the ties,
+# not by how far down the board the student is.
+# `flask rebuild-leaderboards` recomputes the boards from the attempts table.
+
+DEFAULT_TOP = 10
+
+Standing = namedtuple('Standing', ['rank', 'student_id', 'full_name', 'score', 'reached_at'])
+
+# scope -> (model, column of the quiz or course id, score count model)
+BOARDS = {
+    'quiz': (QuizLeaderboardEntry, 'quiz_id', QuizScoreCount),
+    'course': (CourseLeaderboardEntry, 'course_id', CourseScoreCount),
+}
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _board(scope):
+    model, key, _ = BOARDS[scope]
+    return model.__table__, model.__table__.c[key]
+
+
+def _counts(scope):
+    _, key, model = BOARDS[scope]
+    return model.__table__, model.__table__.c[key]
+
+
+def _upsert(table, key, values, changes):
+    dialect_insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).values(**key, **values)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=list(key), set_=changes))
+        return
+    result = db.session.execute(
+        update(table).where(*(table.c[name] == value for name, value in key.items())).values(changes)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(**key, **values))
+
+
+def _score(scope, scope_id, student_id):
+    table, key = _board(scope)
+    return db.session.execute(
+        select(table.c.score).where(key == scope_id, table.c.student_id == student_id)
+    ).scalar()
+
+
+def _move_count(scope, scope_id, old, new):
+    # A student's row went from score old (None: no row) to new
+    if old == new:
+        return
+    table, key = _counts(scope)
+    if old is not None:
+        db.session.execute(
+            update(table).where(key == scope_id, table.c.score == old).values(entries=table.c.entries - 1)
+        )
+        db.session.execute(delete(table).where(key == scope_id, table.c.score == old, table.c.entries <= 0))
+    _upsert(table, {key.name: scope_id, 'score': new}, {'entries': 1}, {'entries': table.c.entries + 1})
+
+
+def record_attempt(student_id, quiz_id, course_id, score, attempt_date):
+    # Fold one attempt into the student's rows; call in the attempt's
+    # transaction. course_id is looked up when not given.
+    quiz_board = QuizLeaderboardEntry.__table__
+    course_board = CourseLeaderboardEntry.__table__
+    if course_id is None:
+        course_id = db.session.execute(select(Quiz.course_id).where(Quiz.id == quiz_id)).scalar()
+    old_quiz_score = _score('quiz', quiz_id, student_id)
+    if course_id is not None:
+        old_course_score = _score('course', course_id, student_id)
+
+    if course_id is not None:
+        # Runs first: the course total grows by the improvement on the
+        # student's previous best for this quiz
+        previous = (
+            select(quiz_board.c.score)
+            .where(quiz_board.c.quiz_id == quiz_id, quiz_board.c.student_id == student_id)
+            .scalar_subquery()
+        )
+        gain = case((previous.is_(None), score), (previous < score, score - previous), else_=0)
+        _upsert(course_board, {'course_id': course_id, 'student_id': student_id},
+                {'score': score, 'reached_at': attempt_date, 'quiz_count': 1},
+                {'score': course_board.c.score + gain,
+                 'reached_at': case((gain > 0, attempt_date), else_=course_board.c.reached_at),
+                 'quiz_count': course_board.c.quiz_count + case((previous.is_(None), 1), else_=0)})
+
+    improved = quiz_board.c.score < score
+    # An equal score counts from the earlier attempt; replayed logs can be late
+    earlier = and_(quiz_board.c.score == score, quiz_board.c.reached_at > attempt_date)
+    _upsert(quiz_board, {'quiz_id': quiz_id, 'student_id': student_id},
+            {'score': score, 'reached_at': attempt_date, 'attempt_count': 1},
+            {'score': case((improved, score), else_=quiz_board.c.score),
+             'reached_at': case((improved, attempt_date), (earlier, attempt_date),
+                                else_=quiz_board.c.reached_at),
+             'attempt_count': quiz_board.c.attempt_count + 1})
+
+    _move_count('quiz', quiz_id, old_quiz_score, _score('quiz', quiz_id, student_id))
+    if course_id is not None:
+        _move_count('course', course_id, old_course_score, _score('course', course_id, student_id))
+
+
+def top_statement(scope, scope_id, limit=DEFAULT_TOP, offset=0):
+    table, key = _board(scope)
+    return (
+        select(table.c.student_id, User.full_name, table.c.score, table.c.reached_at)
+        .join(User, User.id == table.c.student_id)
+        .where(key == scope_id)
+        .order_by(table.c.score.desc(), table.c.reached_at, table.c.student_id)
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+def top(scope, scope_id, limit=DEFAULT_TOP, offset=0):
+    # A page of the board in ranking order.
+    rows = db.session.execute(top_statement(scope, scope_id, limit, offset)).all()
+    return [Standing(offset + i + 1, *row) for i, row in enumerate(rows)]
+
+
+def ahead_statement(scope, scope_id, student_id, score, reached_at):
+    # Number of entries ranked before (score, reached_at, student_id): the
+    # counts of the higher scores plus the earlier entries with this one.
+    table, key = _board(scope)
+    counts, count_key = _counts(scope)
+    higher = select(func.coalesce(func.sum(counts.c.entries), 0)).where(
+        count_key == scope_id, counts.c.score > score,
+    ).scalar_subquery()
+    tied = select(func.count()).where(
+        key == scope_id, table.c.score == score,
+        tuple_(table.c.reached_at, table.c.student_id) < tuple_(reached_at, student_id),
+    ).scalar_subquery()
+    return select(higher + tied)
+
+
+def rank(scope, scope_id, student_id):
+    # The student's Standing on the board, or None without an entry.
+    table, key = _board(scope)
+    row = db.session.execute(
+        select(User.full_name, table.c.score, table.c.reached_at)
+        .join(User, User.id == table.c.student_id)
+        .where(key == scope_id, table.c.student_id == student_id)
+    ).first()
+    if row is None:
+        return None
+    ahead = db.session.execute(ahead_statement(scope, scope_id, student_id, row.score, row.reached_at)).scalar()
+    return Standing(ahead + 1, student_id, *row)
+
+
+def summary(scope, scope_id, student_id=None, limit=DEFAULT_TOP):
+    # The top of the board and the student's Standing (None without an entry).
+    leaders = top(scope, scope_id, limit)
+    standing = next((entry for entry in leaders if entry.student_id == student_id), None)
+    if standing is None and student_id is not None:
+        standing = rank(scope, scope_id, student_id)
+    return leaders, standing
+
+
+def rebuild_score_counts(conn, scope, scope_ids=None):
+    # Recount the students per score from a board, optionally for some
+    # quizzes or courses only.
+    table, key = _board(scope)
+    counts, count_key = _counts(scope)
+    clear = delete(counts)
+    source = select(key, table.c.score, func.count()).group_by(key, table.c.score)
+    if scope_ids is not None:
+        clear = clear.where(count_key.in_(scope_ids))
+        source = source.where(key.in_(scope_ids))
+    conn.execute(clear)
+    conn.execute(insert(counts).from_select([count_key.name, 'score', 'entries'], source))
+
+
+def rebuild_course_boards(conn, course_ids=None):
+    # Recompute course rows from the quiz rows, optionally for some courses only.
+    course_board = CourseLeaderboardEntry.__table__
+    quiz_board = QuizLeaderboardEntry.__table__
+    quizzes = Quiz.__table__
+    clear = delete(course_board)
+    source = (
+        select(
+            quizzes.c.course_id,
+            quiz_board.c.student_id,
+            func.sum(quiz_board.c.score),
+            # When the total last grew: the latest quiz best that added to it
+            func.coalesce(func.max(case((quiz_board.c.score > 0, quiz_board.c.reached_at))),
+                          func.min(quiz_board.c.reached_at)),
+            func.count(),
+        )
+        .join_from(quiz_board, quizzes, quizzes.c.id == quiz_board.c.quiz_id)
+        .where(quizzes.c.course_id.is_not(None))
+        .group_by(quizzes.c.course_id, quiz_board.c.student_id)
+    )
+    if course_ids is not None:
+        clear = clear.where(course_board.c.course_id.in_(course_ids))
+        source = source.where(quizzes.c.course_id.in_(course_ids))
+    conn.execute(clear)
+    conn.execute(insert(course_board).from_select(
+        ['course_id', 'student_id', 'score', 'reached_at', 'quiz_count'], source
+    ))
+    rebuild_score_counts(conn, 'course', course_ids)
+
+
+def rebuild_leaderboards(conn, quiz_ids=None):
+    # Recompute the boards from the attempts table, optionally for some
+    # quizzes (and the courses they belong to) only.
+    quiz_board = QuizLeaderboardEntry.__table__
+    attempts = StudentQuizAttempt.__table__
+    best = (
+        select(
+            attempts.c.quiz_id,
+            attempts.c.student_id,
+            func.max(attempts.c.score).label('score'),
+            func.count().label('attempt_count'),
+        )
+        .where(attempts.c.attempt_date.is_not(None))
+        .group_by(attempts.c.quiz_id, attempts.c.student_id)
+    )
+    clear = delete(quiz_board)
+    if quiz_ids is not None:
+        best = best.where(attempts.c.quiz_id.in_(quiz_ids))
+        clear = clear.where(quiz_board.c.quiz_id.in_(quiz_ids))
+    best = best.subquery()
+    # The earliest attempt with the best score
+    source = (
+        select(best.c.quiz_id, best.c.student_id, best.c.score, func.min(attempts.c.attempt_date),
+               best.c.attempt_count)
+        .join_from(best, attempts, and_(attempts.c.quiz_id == best.c.quiz_id,
+                                        attempts.c.student_id == best.c.student_id,
+                                        attempts.c.score == best.c.score))
+        .group_by(best.c.quiz_id, best.c.student_id, best.c.score, best.c.attempt_count)
+    )
+    conn.execute(clear)
+    conn.execute(insert(quiz_board).from_select(
+        ['quiz_id', 'student_id', 'score', 'reached_at', 'attempt_count'], source
+    ))
+    rebuild_score_counts(conn, 'quiz', quiz_ids)
+    course_ids = None
+    if quiz_ids is not None:
+        course_ids = conn.execute(
+            select(Quiz.course_id).where(Quiz.id.in_(quiz_ids)).distinct()
+        ).scalars().all()
+    rebuild_course_boards(conn, course_ids)
+
+
+def register_commands(app):
+    @app.cli.command('rebuild-leaderboards')
+    @click.option('--quiz', 'quiz_ids', type=int, multiple=True, help='Only rebuild these quizzes.')
+    def rebuild_leaderboards_command(quiz_ids):
+        """Recompute the quiz and course leaderboards from the attempts table."""
+        with db.engine.begin() as conn:
+            rebuild_leaderboards(conn, list(quiz_ids) or None)
+        click.echo('Leaderboards rebuilt.')
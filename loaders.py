@@ -0,0 +1,91 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from models import db, Chapter, Course, Quiz, StudentQuizAttempt
+
+# Query helpers for the student-facing pages. The *_statement functions are
+# also used by benchmarks/query_plans.py so the plan check sees the real SQL.
+
+
+def course_chapters_statement(course_id, chapter_ids=None):
+    # Chapters of a course with their quizzes joined in, in one round-trip,
+    # optionally restricted to the given chapters (search results)
+    statement = (
+        select(Chapter)
+        .where(Chapter.course_id == course_id)
+        .options(joinedload(Chapter.quizzes))
+        .order_by(Chapter.id)
+    )
+    if chapter_ids is not None:
+        statement = statement.where(Chapter.id.in_(chapter_ids))
+    return statement
+
+
+def course_chapters(course_id):
+    return db.session.execute(course_chapters_statement(course_id)).unique().scalars().all()
+
+
+def latest_attempts_statement(student_id, course_id):
+    # Latest attempt per quiz of one course for one student. Only the columns
+    # the page needs are read; the answers JSON stays on disk.
+    attempt = StudentQuizAttempt
+    ranked = (
+        select(
+            attempt.id,
+            attempt.quiz_id,
+            attempt.score,
+            attempt.total_questions,
+            func.row_number().over(
+                partition_by=attempt.quiz_id,
+                order_by=(attempt.attempt_date.desc(), attempt.id.desc())
+            ).label('position'),
+        )
+        .join(Quiz, Quiz.id == attempt.quiz_id)
+        .where(attempt.student_id == student_id, Quiz.course_id == course_id)
+        .subquery()
+    )
+    return (
+        select(ranked.c.id, ranked.c.quiz_id, ranked.c.score, ranked.c.total_questions)
+        .where(ranked.c.position == 1)
+    )
+
+
+def latest_attempts(student_id, course_id):
+    rows = db.session.execute(latest_attempts_statement(student_id, course_id)).all()
+    return {row.quiz_id: row for row in rows}
+
+
+def score_series_statement(student_id, points):
+    # The student's score (percent) over time per course, downsampled in the
+    # database: each course's submitted attempts, in date order, are split
+    # into at most `points` runs of equal size (ntile) and each run is
+    # averaged. The page gets the same number of rows for ten attempts or
+    # ten thousand, and the attempt rows never leave the database.
+    attempt = StudentQuizAttempt
+    ranked = (
+        select(
+            Quiz.course_id,
+            attempt.attempt_date,
+            (attempt.score * 100.0 / attempt.total_questions).label('percent'),
+            func.ntile(points).over(partition_by=Quiz.course_id,
+                                    order_by=(attempt.attempt_date, attempt.id)).label('run'),
+        )
+        .join(Quiz, Quiz.id == attempt.quiz_id)
+        .where(attempt.student_id == student_id, attempt.attempt_date.is_not(None),
+               attempt.total_questions > 0)
+        .subquery()
+    )
+    return (
+        select(ranked.c.course_id, Course.name, func.max(ranked.c.attempt_date).label('until'),
+               func.avg(ranked.c.percent).label('percent'))
+        .join(Course, Course.id == ranked.c.course_id)
+        .group_by(ranked.c.course_id, Course.name, ranked.c.run)
+        .order_by(Course.name, ranked.c.course_id, ranked.c.run)
+    )
+
+
+def score_series(student_id, points):
+    # [(course name, [(date of the run's last attempt, average percent), ...]), ...]
+    series = {}
+    for row in db.session.execute(score_series_statement(student_id, points)):
+        series.setdefault(row.course_id, (row.name, []))[1].append((row.until, row.percent))
+    return list(series.values())
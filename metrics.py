@@ -0,0 +1,294 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request, request_started, request_finished
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request instrumentation and a Prometheus /metrics endpoint.
+#
+# Engine events count every statement a request runs and time it; Flask
+# signals time the request and its template rendering. Each response gets a
+# Server-Timing header (db, tpl, app), and a request slower than
+# SLOW_REQUEST_MS, or running more than SLOW_REQUEST_QUERIES statements, is
+# logged with its statements, repeated ones first: a statement repeated
+# once per row is an N+1 query.
+#
+# Totals per endpoint are kept in this process and written at most every
+# METRICS_FLUSH_INTERVAL seconds to its own file in METRICS_DIR. /metrics
+# adds up the files of all processes, so every gunicorn worker is counted
+# whichever one serves the scrape. Files of exited workers stay, so their
+# counters do not go backwards, but their gauges (cache entries, pool
+# checkouts, queued submissions) are no longer counted. The gunicorn master
+# clears the directory on start.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_STATEMENTS = 200  # kept per request for the slow request log
+
+FILE_PATTERN = 'metrics-*.json'
+
+# name: (type, help)
+METRICS = {
+    'quizmaster_http_requests_total': ('counter', 'Requests served, by endpoint, method and status.'),
+    'quizmaster_http_request_duration_seconds': ('histogram', 'Request duration, by endpoint.'),
+    'quizmaster_db_queries_total': ('counter', 'SQL statements run by requests, by endpoint.'),
+    'quizmaster_db_query_seconds_total': ('counter', 'Time spent in SQL statements, by endpoint.'),
+    'quizmaster_template_render_seconds_total': ('counter', 'Time spent rendering templates, by endpoint.'),
+    'quizmaster_slow_requests_total': ('counter', 'Requests logged as slow, by endpoint.'),
+    'quizmaster_cache_hits_total': ('counter', 'Cache hits, by cache.'),
+    'quizmaster_cache_misses_total': ('counter', 'Cache misses, by cache.'),
+    'quizmaster_cache_entries': ('gauge', 'Entries held, by cache, over all processes.'),
+    'quizmaster_db_pool_checkouts_total': ('counter', 'Connections checked out of the pool.'),
+    'quizmaster_db_pool_timeouts_total': ('counter', 'Pool checkouts that timed out.'),
+    'quizmaster_db_pool_wait_seconds_total': ('counter', 'Time spent waiting for pool checkouts.'),
+    'quizmaster_db_pool_checked_out': ('gauge', 'Connections checked out now, over all processes.'),
+    'quizmaster_submission_queue_pending': ('gauge', 'Submissions waiting for the writer thread.'),
+    'quizmaster_password_hashes_total': ('counter', 'Password hashes and verifications completed.'),
+    'quizmaster_password_hashes_rejected_total': ('counter', 'Password hashes refused by admission control.'),
+}
+
+
+class Registry:
+    # This process's request totals.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()  # (name, labels) -> value
+        self.histograms = {}       # (name, labels) -> [bucket counts..., +Inf count, sum]
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[len(DURATION_BUCKETS)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)]
+                               for (name, labels), values in self.histograms.items()],
+            }
+
+
+registry = Registry()
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def metrics_directory(app):
+    return app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+
+
+def _process_metrics():
+    # Counters and gauges read from this process's caches, pool and queue.
+    import analytics
+    import engines
+    import page_cache
+    import passwords
+    import quiz_cache
+    import submissions
+    import users
+    from models import db
+    counters, gauges = [], []
+    for cache, info in (('quiz', quiz_cache.cache_info()), ('page', page_cache.cache_info()),
+                        ('user', users.cache_info()), ('analytics', analytics.cache_info())):
+        counters.append(['quizmaster_cache_hits_total', [['cache', cache]], info['hits']])
+        counters.append(['quizmaster_cache_misses_total', [['cache', cache]], info['misses']])
+        gauges.append(['quizmaster_cache_entries', [['cache', cache]], info['size']])
+    pool = engines.pool_info(db.engine)
+    counters.append(['quizmaster_db_pool_checkouts_total', [], pool['checkouts']])
+    counters.append(['quizmaster_db_pool_timeouts_total', [], pool['timeouts']])
+    counters.append(['quizmaster_db_pool_wait_seconds_total', [], engines.pool_stats.wait_total])
+    gauges.append(['quizmaster_db_pool_checked_out', [], pool.get('checked_out', 0)])
+    hashes = passwords.executor_info()
+    counters.append(['quizmaster_password_hashes_total', [], hashes['completed']])
+    counters.append(['quizmaster_password_hashes_rejected_total', [], hashes['rejected']])
+    queue = submissions._queue
+    gauges.append(['quizmaster_submission_queue_pending', [], queue.pending() if queue is not None else 0])
+    return counters, gauges
+
+
+def flush(app, force=False):
+    # Write this process's metrics file, at most every METRICS_FLUSH_INTERVAL.
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < app.config.get('METRICS_FLUSH_INTERVAL', 1.0):
+        return
+    with _flush_lock:
+        _last_flush = now
+        data = registry.snapshot()
+        counters, gauges = _process_metrics()
+        data['counters'].extend(counters)
+        data['gauges'] = gauges
+        directory = metrics_directory(app)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+
+def clear(app):
+    # Remove the files of earlier runs; call before any worker starts.
+    for path in glob.glob(os.path.join(metrics_directory(app), FILE_PATTERN)):
+        os.unlink(path)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _alive(path):
+    # Whether the process that wrote metrics-<pid>.json is still running.
+    try:
+        pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+        os.kill(pid, 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True  # running, as another user
+    return True
+
+
+def render(app):
+    # All processes' metrics in the Prometheus text format.
+    flush(app, force=True)
+    counters, gauges, histograms = Counter(), Counter(), {}
+    for path in glob.glob(os.path.join(metrics_directory(app), FILE_PATTERN)):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # replaced or removed meanwhile
+        for name, labels, value in data['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        if _alive(path):
+            for name, labels, value in data.get('gauges', ()):
+                gauges[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, values):
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {values[-2]}')
+                lines.append(f'{name}_sum{_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{_labels(labels)} {values[-2]}')
+        else:
+            source = counters if kind == 'counter' else gauges
+            for (metric, labels), value in sorted(source.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_timing' in g:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started or not has_request_context() or 'request_timing' not in g:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    timing = g.request_timing
+    timing['queries'] += 1
+    timing['sql'] += elapsed
+    if len(timing['statements']) < MAX_STATEMENTS:
+        timing['statements'].append((statement, elapsed))
+
+
+def _request_started(sender, **extra):
+    g.request_timing = {'started': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'statements': [],
+                        'template': 0.0, 'template_depth': 0, 'template_started': 0.0}
+
+
+def _before_render_template(sender, template, context, **extra):
+    timing = g.get('request_timing')
+    if timing is not None:
+        if timing['template_depth'] == 0:
+            timing['template_started'] = time.perf_counter()
+        timing['template_depth'] += 1
+
+
+def _template_rendered(sender, template, context, **extra):
+    timing = g.get('request_timing')
+    if timing is not None and timing['template_depth']:
+        timing['template_depth'] -= 1
+        if timing['template_depth'] == 0:
+            timing['template'] += time.perf_counter() - timing['template_started']
+
+
+def _log_slow_request(app, endpoint, total, timing):
+    repeated = Counter(statement for statement, _ in timing['statements'])
+    lines = [f'{count}x {statement}' for statement, count in repeated.most_common() if count > 1]
+    lines += [f'{elapsed * 1000:.1f}ms {statement}' for statement, elapsed in timing['statements']]
+    app.logger.warning('Slow request %s %s (%s): %.0fms, %d queries in %.0fms, templates %.0fms\n%s',
+                       request.method, request.full_path, endpoint, total * 1000, timing['queries'],
+                       timing['sql'] * 1000, timing['template'] * 1000, '\n'.join(lines))
+
+
+def _request_finished(sender, response, **extra):
+    timing = g.pop('request_timing', None)
+    if timing is None:
+        return
+    app = current_app._get_current_object()
+    total = time.perf_counter() - timing['started']
+    endpoint = request.endpoint or 'unmatched'
+    labels = (('endpoint', endpoint),)
+    registry.inc('quizmaster_http_requests_total',
+                 labels + (('method', request.method), ('status', str(response.status_code))))
+    registry.observe('quizmaster_http_request_duration_seconds', labels, total)
+    registry.inc('quizmaster_db_queries_total', labels, timing['queries'])
+    registry.inc('quizmaster_db_query_seconds_total', labels, timing['sql'])
+    registry.inc('quizmaster_template_render_seconds_total', labels, timing['template'])
+
+    if app.config.get('SERVER_TIMING', True):
+        response.headers['Server-Timing'] = (
+            f'db;dur={timing["sql"] * 1000:.1f};desc="{timing["queries"]} queries", '
+            f'tpl;dur={timing["template"] * 1000:.1f}, app;dur={total * 1000:.1f}'
+        )
+    if total * 1000 >= app.config.get('SLOW_REQUEST_MS', 500) or \
+            timing['queries'] > app.config.get('SLOW_REQUEST_QUERIES', 50):
+        registry.inc('quizmaster_slow_requests_total', labels)
+        _log_slow_request(app, endpoint, total, timing)
+    flush(app)
+
+
+def init_app(app):
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
@@ -1,7 +1,7 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import passwords
 
 db = SQLAlchemy()
 
@@ -11,30 +11,38 @@ class User(db.Model):
     username = db.Column(db.String(120), unique=True, nullable=False) 
     password_hash = db.Column(db.String(128), nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
-    qualification = db.Column(db.String(100), nullable=False)
+    qualification = db.Column(db.String(100), nullable=False, index=True)
     dob = db.Column(db.Date, nullable=False)
     is_admin = db.Column(db.Boolean, default=False) 
+    session_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped to sign out all sessions
 
 
+    # Both hash on the password executor and may raise passwords.Busy
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
 
 class Course(db.Model):
     __tablename__ = "courses"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(80))
+    category = db.Column(db.String(80), index=True)
     chapters = db.relationship('Chapter', back_populates='related_course')
     quizzes = db.relationship('Quiz', back_populates='related_course')
 
+# Category as the admin dashboard pages by it. The column is nullable and a
+# keyset comparison with NULL is never true, so courses without a category
+# sort as '' (first). The literal is inlined so the query matches the index.
+course_sort_category = db.func.coalesce(Course.category, db.literal_column("''"))
+db.Index('ix_courses_category_sort', course_sort_category, Course.id)
+
 class Chapter(db.Model):
     __tablename__ = "chapters"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
 
     related_course = db.relationship('Course', back_populates='chapters')
     questions = db.relationship('Question', back_populates='chapter')
@@ -44,11 +52,12 @@ class Quiz(db.Model):
     __tablename__ = "quizzes"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
     date_of_quiz = db.Column(db.Date, nullable=False)
     time_duration = db.Column(db.String(10))  # Format: hh:mm
     remarks = db.Column(db.String(255))
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped on every content change
 
     related_course = db.relationship('Course', back_populates='quizzes')
     chapter = db.relationship('Chapter', back_populates='quizzes')
@@ -58,8 +67,8 @@ class Question(db.Model):
     __tablename__ = "questions"
     id = db.Column(db.Integer, primary_key=True)
     question_statement = db.Column(db.String(255), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False, index=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False, index=True)
     option1 = db.Column(db.String(100), nullable=False)
     option2 = db.Column(db.String(100), nullable=False)
     option3 = db.Column(db.String(100))
@@ -71,30 +80,119 @@ class Question(db.Model):
 
 class StudentQuizAttempt(db.Model):
     __tablename__ = 'student_quiz_attempts'
+    __table_args__ = (
+        # Covers per-student lookups and "latest attempt per quiz" for a student
+        db.Index('ix_attempts_student_quiz_date', 'student_id', 'quiz_id', 'attempt_date'),
+        # Keyset pages of a student's attempts, newest first
+        db.Index('ix_attempts_student_id', 'student_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False, index=True)
     score = db.Column(db.Integer, default=0)
     total_questions = db.Column(db.Integer, default=0)
     attempt_date = db.Column(db.DateTime, default=datetime.utcnow)
     
-    student_answers = db.Column(db.JSON)  
+    student_answers = db.Column(db.JSON)  # Legacy full answer copies; new attempts use the two columns below
+    snapshot_hash = db.Column(db.String(64), db.ForeignKey('quiz_snapshots.content_hash'))
+    selections = db.Column(db.JSON)  # Selected option number (1-4 or null) per snapshot question
+    submission_token = db.Column(db.String(32), unique=True, index=True)  # Set by the write-behind submission queue
     
     student = db.relationship('User', backref=db.backref('quiz_attempts', lazy=True))
     quiz = db.relationship('Quiz', backref=db.backref('student_attempts', lazy=True))
 
-def init_db(app):
-    with app.app_context():
-        db.create_all()
-        if User.query.filter_by(username='admin@example.com').first() is None:
-            admin = User(
-                username='admin@example.com',  
-                full_name='Quiz Master',       
-                qualification='Admin',          
-                dob=datetime.strptime('2000-01-01', '%Y-%m-%d').date(),
-                is_admin=True                   
-            )
-            admin.set_password('20210')  
-            db.session.add(admin)
-            db.session.commit()
\ No newline at end of file
+class AttemptStatsRollup(db.Model):
+    # Running attempt count and score total per qualification/quiz/day,
+    # maintained by submit_test and rebuilt with `flask rebuild-stats`.
+    __tablename__ = 'attempt_stats_rollups'
+
+    qualification = db.Column(db.String(100), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True, index=True)
+    day = db.Column(db.Date, primary_key=True)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+
+class QuizLeaderboardEntry(db.Model):
+    # A student's best score on a quiz and when it was first reached,
+    # maintained by submit_test and rebuilt with `flask rebuild-leaderboards`.
+    __tablename__ = 'quiz_leaderboard'
+
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+    reached_at = db.Column(db.DateTime, nullable=False)
+    attempt_count = db.Column(db.Integer, nullable=False, default=1)
+
+class CourseLeaderboardEntry(db.Model):
+    # The sum of a student's best quiz scores in a course and when it last
+    # grew, maintained alongside the quiz leaderboard.
+    __tablename__ = 'course_leaderboard'
+
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+    reached_at = db.Column(db.DateTime, nullable=False)
+    quiz_count = db.Column(db.Integer, nullable=False, default=1)
+
+# Leaderboard order: best score first, ties to whoever reached it earliest.
+# The rank of one student and the top of a board are both ranges of these.
+db.Index('ix_quiz_leaderboard_rank', QuizLeaderboardEntry.quiz_id, QuizLeaderboardEntry.score.desc(),
+         QuizLeaderboardEntry.reached_at, QuizLeaderboardEntry.student_id)
+db.Index('ix_course_leaderboard_rank', CourseLeaderboardEntry.course_id, CourseLeaderboardEntry.score.desc(),
+         CourseLeaderboardEntry.reached_at, CourseLeaderboardEntry.student_id)
+
+class QuizScoreCount(db.Model):
+    # How many students have each best score on a quiz, so a rank sums the
+    # counts of the scores above instead of counting the students ahead.
+    __tablename__ = 'quiz_score_counts'
+
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
+    score = db.Column(db.Integer, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+class CourseScoreCount(db.Model):
+    # How many students have each course total, as QuizScoreCount.
+    __tablename__ = 'course_score_counts'
+
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    score = db.Column(db.Integer, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+class QuizSnapshot(db.Model):
+    # Immutable copy of a quiz's questions, options and answer key, addressed
+    # by the sha256 of its canonical JSON and shared by all attempts taken
+    # against that content.
+    __tablename__ = 'quiz_snapshots'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    quiz_id = db.Column(db.Integer, nullable=False, index=True)
+    content = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AppCounter(db.Model):
+    # Named integer counters shared by all workers, e.g. the catalogue
+    # version that keys the rendered course list cache.
+    __tablename__ = 'app_counters'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class RegradeRun(db.Model):
+    # Audit record and progress of one regrade of a quiz's attempts after
+    # its answer key changed. Not tied to the quiz by a foreign key, so the
+    # record outlives it.
+    __tablename__ = 'regrade_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, nullable=False, index=True)
+    requested_by = db.Column(db.Integer)  # user id; None from the command line
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, done or failed
+    changes = db.Column(db.JSON)  # [{"question_id", "old_answer", "new_answer"}], option numbers
+    attempts_total = db.Column(db.Integer, nullable=False, default=0)
+    attempts_done = db.Column(db.Integer, nullable=False, default=0)
+    attempts_changed = db.Column(db.Integer, nullable=False, default=0)
+    score_delta = db.Column(db.Integer, nullable=False, default=0)  # net change in points awarded
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import current_app, request, session
+from markupsafe import Markup
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, AppCounter
+
+# Rendered course list cache for the home and course catalogue pages.
+#
+# The course list of a page only depends on the catalogue and on the page's
+# query arguments (plus the qualification on the home page), so its rendered
+# HTML is cached per process under those and the catalogue version, a
+# counter row bumped in the same transaction as every course add, edit or
+# delete. All workers read the same counter, so a bump retires every stale
+# entry everywhere.
+#
+# Responses also carry a strong ETag over the same key and the user, and a
+# matching If-None-Match is answered with 304 after reading just the
+# counter: no course query and no rendering. The key includes the RELEASE
+# setting so a deploy that changes the templates invalidates old ETags.
+
+DEFAULT_SIZE = 512
+
+CATALOGUE = 'catalogue'
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class FragmentCache:
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key, fragment):
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                    'maxsize': self.maxsize}
+
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = FragmentCache(current_app.config.get('PAGE_CACHE_SIZE', DEFAULT_SIZE))
+    return _cache
+
+
+def catalogue_version():
+    version = db.session.execute(
+        select(AppCounter.value).where(AppCounter.name == CATALOGUE)
+    ).scalar()
+    return version or 0
+
+
+def bump_catalogue(conn):
+    # Bump the catalogue version; takes effect when conn's transaction commits.
+    counters = AppCounter.__table__
+    dialect_insert = _UPSERT_DIALECTS.get(conn.dialect.name)
+    if dialect_insert is not None:
+        conn.execute(
+            dialect_insert(counters).values(name=CATALOGUE, value=1)
+            .on_conflict_do_update(index_elements=['name'], set_={'value': counters.c.value + 1})
+        )
+        return
+    result = conn.execute(
+        update(counters).where(counters.c.name == CATALOGUE).values(value=counters.c.value + 1)
+    )
+    if result.rowcount == 0:
+        conn.execute(insert(counters).values(name=CATALOGUE, value=1))
+
+
+class CachedPage:
+    # Cache key, ETag and conditional-request handling for one request to a
+    # cached page. `variant` holds whatever besides the query arguments picks
+    # the course list (e.g. the qualification); `viewer` whatever else in the
+    # page differs per user.
+    def __init__(self, variant=(), viewer=None):
+        self.key = (current_app.config.get('RELEASE', ''), request.endpoint, tuple(variant), tuple(sorted(request.args.items(multi=True))),
+                    catalogue_version())
+        digest = hashlib.sha256(repr((self.key, viewer)).encode('utf-8')).hexdigest()
+        self.etag = digest[:32]
+        # Pending flash messages are rendered into the page once, so such a
+        # response must be neither validated nor reused.
+        self.conditional = request.method == 'GET' and '_flashes' not in session
+
+    def not_modified(self):
+        # A 304 response if the client already has this page, else None.
+        if not (self.conditional and request.if_none_match.contains_weak(self.etag)):
+            return None
+        return self.finish(current_app.response_class(status=304))
+
+    def fragment(self, render):
+        cache = _get_cache()
+        fragment = cache.get(self.key)
+        if fragment is None:
+            fragment = Markup(render())
+            cache.put(self.key, fragment)
+        return fragment
+
+    def finish(self, response):
+        if self.conditional:
+            response.set_etag(self.etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def cache_info():
+    return _get_cache().info()
@@ -0,0 +1,91 @@
+import base64
+import json
+from sqlalchemy import tuple_
+from models import db
+
+# Keyset (cursor) pagination for the list views.
+#
+# A page is fetched with WHERE (sort key) > (last key seen) ORDER BY sort key
+# LIMIT per_page + 1, so its cost does not depend on how deep into the list it
+# is. The sort key must be unique, so it always ends with the primary key.
+# Cursors are opaque URL-safe strings holding the boundary key and direction;
+# key values must be JSON types (ints, strings, floats).
+
+DEFAULT_PER_PAGE = 20
+
+
+class Page:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.has_next = next_cursor is not None
+        self.has_prev = prev_cursor is not None
+
+
+def encode_cursor(key, backwards=False):
+    payload = json.dumps([int(backwards)] + list(key), separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size=None):
+    # (key, backwards), or (None, False) for a missing or malformed cursor,
+    # which simply shows the first page.
+    if not cursor:
+        return None, False
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        backwards, key = bool(payload[0]), tuple(payload[1:])
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None, False
+    if not key or (size is not None and len(key) != size):
+        return None, False
+    return key, backwards
+
+
+def keyset_statement(statement, columns, key=None, backwards=False, descending=False,
+                     per_page=DEFAULT_PER_PAGE):
+    # Restrict statement to the rows after (or, walking backwards, before)
+    # key in the order given by columns, fetching one extra row to tell
+    # whether another page follows.
+    reverse = backwards != descending
+    if key is not None:
+        row, bound = tuple_(*columns), tuple_(*key)
+        statement = statement.where(row < bound if reverse else row > bound)
+    order = [column.desc() if reverse else column.asc() for column in columns]
+    return statement.order_by(None).order_by(*order).limit(per_page + 1)
+
+
+def make_page(items, key_of, per_page, key=None, backwards=False):
+    # Build a Page from up to per_page + 1 rows fetched by keyset_statement.
+    more = len(items) > per_page
+    items = list(items[:per_page])
+    if backwards:
+        items.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, key is not None
+    next_cursor = prev_cursor = None
+    if items and has_next:
+        next_cursor = encode_cursor(key_of(items[-1]))
+    if items and has_prev:
+        prev_cursor = encode_cursor(key_of(items[0]), backwards=True)
+    return Page(items, per_page, next_cursor, prev_cursor)
+
+
+def paginate(statement, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False,
+             key_of=None):
+    # One page of the entities selected by statement, ordered by columns
+    # (mapped attributes of the selected entity, primary key last). Ordering
+    # by SQL expressions needs key_of, giving an entity's values for them.
+    key, backwards = decode_cursor(cursor, len(columns))
+    rows = db.session.execute(
+        keyset_statement(statement, columns, key, backwards, descending, per_page)
+    ).unique().scalars().all()
+    if key_of is None:
+        names = [column.key for column in columns]
+
+        def key_of(item):
+            return tuple(getattr(item, name) for name in names)
+    return make_page(rows, key_of, per_page, key, backwards)
@@ -0,0 +1,125 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing off the request thread, with admission control.
+#
+# Hashing is memory-hard and deliberately slow, and a class signing in at
+# the start of an exam used to pin every request thread on it. Hashes now
+# run on a small per-process thread pool (PASSWORD_HASH_WORKERS; hashlib
+# releases the GIL while hashing, so other requests keep being served), and
+# at most PASSWORD_HASH_MAX_PENDING may be running or queued. Past that,
+# Busy is raised at once and the login is answered with 503 and Retry-After
+# instead of queueing without bound. PASSWORD_HASH_WORKERS=0 hashes on the
+# calling thread, still within the admission limit.
+#
+# PASSWORD_HASH_METHOD is any werkzeug method string, e.g. "scrypt" or
+# "pbkdf2:sha256:600000". A stored hash made with other parameters is
+# replaced on the user's next successful login.
+
+DEFAULT_METHOD = 'scrypt'
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 16
+DEFAULT_TIMEOUT = 10  # seconds
+
+
+class Busy(Exception):
+    pass
+
+
+class HashExecutor:
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='password-hash') if workers else None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Busy()
+        if self._pool is None:
+            try:
+                return fn(*args)
+            finally:
+                self._release()
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise Busy() from None
+
+    def _release(self):
+        self._slots.release()
+        with self._lock:
+            self.completed += 1
+
+    def info(self):
+        with self._lock:
+            return {'completed': self.completed, 'rejected': self.rejected}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _forget_executor():
+    # A forked child has none of the parent's pool threads, e.g. after the
+    # gunicorn master hashed the seeded admin's password
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_executor)
+
+
+def _get_executor():
+    # Created on first use, so each forked worker gets its own threads.
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = current_app.config
+                _executor = HashExecutor(
+                    config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS),
+                    config.get('PASSWORD_HASH_MAX_PENDING', DEFAULT_MAX_PENDING),
+                    config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT),
+                )
+    return _executor
+
+
+def hash_method():
+    return current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD
+
+
+@lru_cache(maxsize=None)
+def _stored_method(method):
+    # The parameters werkzeug records in a hash made with method, with its
+    # defaults filled in ("scrypt" -> "scrypt:32768:8:1").
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def hash_password(password):
+    return _get_executor().run(generate_password_hash, password, hash_method())
+
+
+def verify(password_hash, password):
+    return _get_executor().run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _stored_method(hash_method())
+
+
+def executor_info():
+    return _get_executor().info()
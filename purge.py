@@ -0,0 +1,142 @@
+import threading
+from flask import current_app
+from sqlalchemy import delete, func, select
+from models import (db, Course, Chapter, Quiz, Question, StudentQuizAttempt, AttemptStatsRollup,
+                    QuizSnapshot, QuizLeaderboardEntry, QuizScoreCount)
+import leaderboard
+import page_cache
+import quiz_cache
+
+# Set-based deletion of a course, chapter or quiz and everything under it.
+#
+# Each table is cleared with one DELETE ... WHERE quiz_id IN (subquery)
+# rather than a Python loop per quiz. Small scopes are deleted in the
+# request's transaction. Scopes holding more than PURGE_SYNC_LIMIT attempt
+# and question rows are purged by a background thread in bounded batches,
+# one short transaction each, so the admin request returns immediately and
+# writers are never blocked for long. A purge can be rerun safely: if it
+# stops half way, deleting the same course again finishes the job.
+
+DEFAULT_SYNC_LIMIT = 5000
+DEFAULT_BATCH_SIZE = 1000
+
+SCOPES = ('course', 'chapter', 'quiz')
+
+# Large tables keyed by quiz, purged in batches by primary key
+BATCHED_TABLES = [StudentQuizAttempt.__table__, Question.__table__]
+
+# Every table with rows that belong to a quiz, children first
+QUIZ_DEPENDENT_TABLES = [
+    StudentQuizAttempt.__table__,
+    AttemptStatsRollup.__table__,
+    QuizLeaderboardEntry.__table__,
+    QuizScoreCount.__table__,
+    QuizSnapshot.__table__,
+    Question.__table__,
+]
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _quiz_ids(scope, scope_id):
+    column = {'course': Quiz.course_id, 'chapter': Quiz.chapter_id, 'quiz': Quiz.id}[scope]
+    return select(Quiz.id).where(column == scope_id)
+
+
+def _chapter_ids(scope, scope_id):
+    if scope == 'course':
+        return select(Chapter.id).where(Chapter.course_id == scope_id)
+    if scope == 'chapter':
+        return select(Chapter.id).where(Chapter.id == scope_id)
+    return None
+
+
+def delete_scope(conn, scope, scope_id):
+    # Delete the scope and everything under it with a few set-based statements.
+    quiz_ids = _quiz_ids(scope, scope_id)
+    chapter_ids = _chapter_ids(scope, scope_id)
+    course_ids = conn.execute(select(Quiz.course_id).where(Quiz.id.in_(quiz_ids)).distinct()).scalars().all()
+    for table in QUIZ_DEPENDENT_TABLES:
+        conn.execute(delete(table).where(table.c.quiz_id.in_(quiz_ids)))
+    # Course totals no longer include the deleted quizzes
+    leaderboard.rebuild_course_boards(conn, course_ids)
+    if chapter_ids is not None:
+        # Questions also reference their chapter directly
+        conn.execute(delete(Question.__table__).where(Question.chapter_id.in_(chapter_ids)))
+    conn.execute(delete(Quiz.__table__).where(Quiz.id.in_(quiz_ids)))
+    if chapter_ids is not None:
+        conn.execute(delete(Chapter.__table__).where(Chapter.id.in_(chapter_ids)))
+    if scope == 'course':
+        conn.execute(delete(Course.__table__).where(Course.id == scope_id))
+        page_cache.bump_catalogue(conn)
+
+
+def row_estimate(conn, scope, scope_id):
+    quiz_ids = _quiz_ids(scope, scope_id)
+    return sum(
+        conn.execute(select(func.count()).select_from(table).where(table.c.quiz_id.in_(quiz_ids))).scalar()
+        for table in BATCHED_TABLES
+    )
+
+
+def purge_in_batches(engine, scope, scope_id, batch_size=DEFAULT_BATCH_SIZE):
+    # Trim the big tables batch by batch, then delete what is left at once.
+    quiz_ids = _quiz_ids(scope, scope_id)
+    for table in BATCHED_TABLES:
+        while True:
+            with engine.begin() as conn:
+                batch = select(table.c.id).where(table.c.quiz_id.in_(quiz_ids)).limit(batch_size)
+                deleted = conn.execute(delete(table).where(table.c.id.in_(batch))).rowcount
+            if deleted < batch_size:
+                break
+    with engine.begin() as conn:
+        deleted_quiz_ids = conn.execute(quiz_ids).scalars().all()
+        delete_scope(conn, scope, scope_id)
+    quiz_cache.forget(deleted_quiz_ids)
+
+
+def _run_in_background(app, scope, scope_id, batch_size):
+    try:
+        with app.app_context():
+            purge_in_batches(db.engine, scope, scope_id, batch_size)
+            app.logger.info('Purged %s %s', scope, scope_id)
+    except Exception:
+        app.logger.exception('Purging %s %s failed; deleting it again will resume', scope, scope_id)
+    finally:
+        with _running_lock:
+            _running.discard((scope, scope_id))
+
+
+def remove(scope, scope_id):
+    # Delete a course, chapter or quiz with everything under it. Returns
+    # 'deleted' when done in this transaction (already committed), or
+    # 'scheduled' when a background purge was started or is running.
+    key = (scope, scope_id)
+    with _running_lock:
+        if key in _running:
+            return 'scheduled'
+
+    config = current_app.config
+    conn = db.session.connection()
+    if row_estimate(conn, scope, scope_id) <= config.get('PURGE_SYNC_LIMIT', DEFAULT_SYNC_LIMIT):
+        deleted_quiz_ids = conn.execute(_quiz_ids(scope, scope_id)).scalars().all()
+        delete_scope(conn, scope, scope_id)
+        db.session.commit()
+        quiz_cache.forget(deleted_quiz_ids)
+        return 'deleted'
+
+    db.session.rollback()
+    with _running_lock:
+        if key in _running:
+            return 'scheduled'
+        _running.add(key)
+    thread = threading.Thread(
+        target=_run_in_background,
+        args=(current_app._get_current_object(), scope, scope_id,
+              config.get('PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        name=f'purge-{scope}-{scope_id}',
+        daemon=True,
+    )
+    thread.start()
+    return 'scheduled'
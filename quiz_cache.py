@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from sqlalchemy import select, update
+from models import db, Quiz, Question
+import snapshots
+
+# In-process LRU cache of compiled (immutable) quiz definitions shared by
+# take_test, submit_test and view_attempt.
+#
+# Entries are keyed by (quiz id, quizzes.version). Every edit to a quiz or its
+# questions bumps the version column in the same transaction, so each gunicorn
+# worker sees the change on its next lookup: a hit costs one primary-key read
+# of the version instead of loading the quiz and all of its questions.
+
+DEFAULT_SIZE = 256
+
+CompiledQuestion = namedtuple('CompiledQuestion', [
+    'id', 'question_statement', 'option1', 'option2', 'option3', 'option4', 'correct_answer',
+])
+
+CompiledQuiz = namedtuple('CompiledQuiz', [
+    'id', 'version', 'name', 'course_id', 'chapter_id', 'date_of_quiz', 'time_duration',
+    'remarks', 'questions', 'answer_key', 'snapshot', 'snapshot_hash',
+])
+
+
+class QuizCache:
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+    def put(self, key, compiled):
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, quiz_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == quiz_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = QuizCache(current_app.config.get('QUIZ_CACHE_SIZE', DEFAULT_SIZE))
+    return _cache
+
+
+def compile_quiz(quiz, questions):
+    compiled_questions = tuple(
+        CompiledQuestion(q.id, q.question_statement, q.option1, q.option2, q.option3, q.option4,
+                         q.correct_answer)
+        for q in questions
+    )
+    snapshot = snapshots.build_content(compiled_questions)
+    return CompiledQuiz(
+        id=quiz.id,
+        version=quiz.version,
+        name=quiz.name,
+        course_id=quiz.course_id,
+        chapter_id=quiz.chapter_id,
+        date_of_quiz=quiz.date_of_quiz,
+        time_duration=quiz.time_duration,
+        remarks=quiz.remarks,
+        questions=compiled_questions,
+        answer_key={q.id: q.correct_answer for q in compiled_questions},
+        snapshot=snapshot,
+        snapshot_hash=snapshots.content_hash(snapshot),
+    )
+
+
+def get_quiz(quiz_id):
+    # Compiled quiz for quiz_id, or None if the quiz does not exist.
+    version = db.session.execute(select(Quiz.version).where(Quiz.id == quiz_id)).scalar()
+    if version is None:
+        return None
+    cache = _get_cache()
+    compiled = cache.get((quiz_id, version))
+    if compiled is not None:
+        return compiled
+
+    quiz = db.session.get(Quiz, quiz_id)
+    questions = Question.query.filter_by(quiz_id=quiz_id).order_by(Question.id).all()
+    compiled = compile_quiz(quiz, questions)
+    cache.put((quiz_id, compiled.version), compiled)
+    return compiled
+
+
+def invalidate(quiz_id):
+    # Bump the quiz's content version; takes effect when the caller commits.
+    db.session.execute(update(Quiz).where(Quiz.id == quiz_id).values(version=Quiz.version + 1))
+    _get_cache().discard(int(quiz_id))
+
+
+def cache_info():
+    return _get_cache().info()
+
+
+def forget(quiz_ids):
+    # Drop the local entries of deleted quizzes; they no longer have a version.
+    cache = _get_cache()
+    for quiz_id in quiz_ids:
+        cache.discard(int(quiz_id))
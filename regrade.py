@@ -0,0 +1,267 @@
+import threading
+import traceback
+from collections import namedtuple
+from datetime import datetime
+import click
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, func, insert, select, update
+from models import db, Quiz, Question, StudentQuizAttempt, QuizSnapshot, RegradeRun
+from analytics import selection_matrix
+from leaderboard import rebuild_leaderboards
+from stats import rebuild_rollups
+import snapshots
+
+# Bulk regrading after a quiz's answer key changes.
+#
+# Attempts are graded against the snapshot of the quiz they were taken on.
+# A regrade plans, for each snapshot of the quiz that still has attempts,
+# the same content with the current answer key, stored as a new snapshot.
+# Attempts are then moved over in batches. Each batch reads the attempts'
+# selections into an int8 matrix, scores them all at once against the key
+# vector, and in one short transaction:
+# - writes the scores that changed (executemany)
+# - repoints the whole batch to the corrected snapshot
+# - adds its counts to the run's progress
+# A batch only touches attempts still on the old snapshot, so a regrade
+# interrupted half way, or started twice, can simply be run again. Finally
+# the quiz's statistics rollups and leaderboards are rebuilt, and its version
+# is bumped so cached analytics start over.
+#
+# Each run is recorded in regrade_runs: who asked, which answers changed,
+# progress, the net score change and the outcome. Runs over more than
+# REGRADE_SYNC_LIMIT attempts continue in a background thread after the
+# request returns. `flask regrade` resumes the quiz's last failed run.
+
+DEFAULT_SYNC_LIMIT = 5000
+DEFAULT_BATCH_SIZE = 5000
+
+SnapshotFix = namedtuple('SnapshotFix', ['old_hash', 'new_hash', 'content', 'key'])
+
+
+def answer_key(conn, quiz_id):
+    # {question id: correct option number} of the quiz as it is now.
+    rows = conn.execute(
+        select(Question.id, Question.option1, Question.option2, Question.option3, Question.option4,
+               Question.correct_answer)
+        .where(Question.quiz_id == quiz_id)
+    ).all()
+    return {
+        row.id: snapshots.option_number(row.correct_answer, (row.option1, row.option2, row.option3, row.option4))
+        for row in rows
+    }
+
+
+def plan(conn, quiz_id):
+    # (fixes, changes, attempts affected): a SnapshotFix per snapshot with
+    # attempts whose answers differ from the current key, and
+    # {question id: (old answer, new answer)}. Questions since deleted, or
+    # whose answer no longer matches an option, keep their old answer.
+    key = answer_key(conn, quiz_id)
+    attempts = StudentQuizAttempt.__table__
+    counts = dict(conn.execute(
+        select(attempts.c.snapshot_hash, func.count())
+        .where(attempts.c.quiz_id == quiz_id, attempts.c.snapshot_hash.is_not(None))
+        .group_by(attempts.c.snapshot_hash)
+    ).all())
+    if not counts:
+        return [], {}, 0
+    fixes, changes, affected = [], {}, 0
+    rows = conn.execute(
+        select(QuizSnapshot.content_hash, QuizSnapshot.content).where(QuizSnapshot.content_hash.in_(list(counts)))
+    ).all()
+    for snapshot_hash, content in rows:
+        corrected = []
+        for item in content['questions']:
+            answer = key.get(item['id']) or item['answer']
+            if answer != item['answer']:
+                changes.setdefault(item['id'], (item['answer'], answer))
+            corrected.append(dict(item, answer=answer))
+        if corrected == content['questions']:
+            continue
+        fixed = {'questions': corrected}
+        vector = np.array([item['answer'] or 0 for item in corrected], dtype=np.int8)
+        fixes.append(SnapshotFix(snapshot_hash, snapshots.content_hash(fixed), fixed, vector))
+        affected += counts[snapshot_hash]
+    return fixes, changes, affected
+
+
+def score(key, selections):
+    # Scores of a batch of attempts' selections against an answer key vector.
+    matrix = selection_matrix(selections, len(key))
+    return ((matrix == key) & (key > 0)).sum(axis=1)
+
+
+def _regrade_batch(conn, run_id, quiz_id, fix, batch_size):
+    # Move the next batch of attempts on fix.old_hash over; returns
+    # (attempts, scores changed), or (0, 0) when none are left.
+    attempts = StudentQuizAttempt.__table__
+    rows = conn.execute(
+        select(attempts.c.id, attempts.c.selections, attempts.c.score)
+        .where(attempts.c.quiz_id == quiz_id, attempts.c.snapshot_hash == fix.old_hash)
+        .order_by(attempts.c.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, 0
+    new_scores = score(fix.key, [row.selections or [] for row in rows])
+    old_scores = np.array([row.score or 0 for row in rows], dtype=np.int64)
+    changed = np.flatnonzero(new_scores != old_scores)
+    if len(changed):
+        conn.execute(
+            update(attempts)
+            .where(attempts.c.id == bindparam('attempt_id'), attempts.c.snapshot_hash == fix.old_hash)
+            .values(score=bindparam('new_score')),
+            [{'attempt_id': rows[i].id, 'new_score': int(new_scores[i])} for i in changed]
+        )
+    conn.execute(
+        update(attempts)
+        .where(attempts.c.quiz_id == quiz_id, attempts.c.snapshot_hash == fix.old_hash,
+               attempts.c.id.between(rows[0].id, rows[-1].id))
+        .values(snapshot_hash=fix.new_hash)
+    )
+    runs = RegradeRun.__table__
+    conn.execute(update(runs).where(runs.c.id == run_id).values(
+        attempts_done=runs.c.attempts_done + len(rows),
+        attempts_changed=runs.c.attempts_changed + len(changed),
+        score_delta=runs.c.score_delta + int((new_scores - old_scores).sum()),
+    ))
+    return len(rows), len(changed)
+
+
+def create_run(conn, quiz_id, requested_by=None):
+    # Plan a regrade and record it; returns the run id, or None when no
+    # attempt is affected.
+    fixes, changes, affected = plan(conn, quiz_id)
+    if not fixes:
+        return None
+    return conn.execute(insert(RegradeRun.__table__).values(
+        quiz_id=quiz_id,
+        requested_by=requested_by,
+        status='running',
+        changes=[{'question_id': question_id, 'old_answer': old, 'new_answer': new}
+                 for question_id, (old, new) in sorted(changes.items())],
+        attempts_total=affected,
+        started_at=datetime.utcnow(),
+    )).inserted_primary_key[0]
+
+
+def resume_run(conn, quiz_id):
+    # Mark the quiz's latest failed run as running again; returns its id, or
+    # None. Its attempts already moved are not planned again.
+    runs = RegradeRun.__table__
+    run_id = conn.execute(
+        select(runs.c.id).where(runs.c.quiz_id == quiz_id, runs.c.status == 'failed')
+        .order_by(runs.c.id.desc()).limit(1)
+    ).scalar()
+    if run_id is not None:
+        conn.execute(update(runs).where(runs.c.id == run_id)
+                     .values(status='running', finished_at=None, error=None))
+    return run_id
+
+
+def run(engine, run_id, quiz_id, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    # Carry out a recorded regrade. progress(attempts, changed) is called
+    # after every batch.
+    runs = RegradeRun.__table__
+    try:
+        with engine.begin() as conn:
+            fixes, _, _ = plan(conn, quiz_id)
+        for fix in fixes:
+            with engine.begin() as conn:
+                snapshots.store_snapshot(conn, fix.new_hash, quiz_id, fix.content)
+            while True:
+                with engine.begin() as conn:
+                    done, changed = _regrade_batch(conn, run_id, quiz_id, fix, batch_size)
+                if not done:
+                    break
+                if progress is not None:
+                    progress(done, changed)
+        with engine.begin() as conn:
+            rebuild_rollups(conn, [quiz_id])
+            rebuild_leaderboards(conn, [quiz_id])
+            conn.execute(update(Quiz.__table__).where(Quiz.id == quiz_id).values(version=Quiz.version + 1))
+            conn.execute(update(runs).where(runs.c.id == run_id)
+                         .values(status='done', finished_at=datetime.utcnow()))
+    except Exception:
+        with engine.begin() as conn:
+            conn.execute(update(runs).where(runs.c.id == run_id).values(
+                status='failed', finished_at=datetime.utcnow(), error=traceback.format_exc()))
+        raise
+
+
+def _run_in_background(app, run_id, quiz_id, batch_size):
+    try:
+        with app.app_context():
+            run(db.engine, run_id, quiz_id, batch_size)
+            app.logger.info('Regraded quiz %s (run %s)', quiz_id, run_id)
+    except Exception:
+        app.logger.exception('Regrading quiz %s failed (run %s); `flask regrade %s` resumes it',
+                             quiz_id, run_id, quiz_id)
+
+
+def start(quiz_id, requested_by=None):
+    # Regrade the quiz's attempts against its current answer key; call after
+    # committing the change. Returns the RegradeRun, or None when no attempt
+    # is affected. Small regrades finish in this request, larger ones in a
+    # background thread.
+    config = current_app.config
+    with db.engine.begin() as conn:
+        run_id = create_run(conn, quiz_id, requested_by)
+    if run_id is None:
+        return None
+    batch_size = config.get('REGRADE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    regrade = db.session.get(RegradeRun, run_id)
+    if regrade.attempts_total <= config.get('REGRADE_SYNC_LIMIT', DEFAULT_SYNC_LIMIT):
+        run(db.engine, run_id, quiz_id, batch_size)
+        db.session.refresh(regrade)
+        return regrade
+    threading.Thread(
+        target=_run_in_background,
+        args=(current_app._get_current_object(), run_id, quiz_id, batch_size),
+        name=f'regrade-{quiz_id}',
+        daemon=True,
+    ).start()
+    return regrade
+
+
+def run_info(regrade):
+    return {
+        'id': regrade.id,
+        'quiz_id': regrade.quiz_id,
+        'requested_by': regrade.requested_by,
+        'status': regrade.status,
+        'changes': regrade.changes,
+        'attempts_total': regrade.attempts_total,
+        'attempts_done': regrade.attempts_done,
+        'attempts_changed': regrade.attempts_changed,
+        'score_delta': regrade.score_delta,
+        'started_at': regrade.started_at.isoformat() if regrade.started_at else None,
+        'finished_at': regrade.finished_at.isoformat() if regrade.finished_at else None,
+        'error': regrade.error,
+    }
+
+
+def register_commands(app):
+    @app.cli.command('regrade')
+    @click.argument('quiz_id', type=int)
+    @click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+    def regrade_command(quiz_id, batch_size):
+        """Regrade a quiz's attempts against its current answer key, resuming a failed run."""
+        with db.engine.begin() as conn:
+            run_id = resume_run(conn, quiz_id)
+            if run_id is not None:
+                click.echo(f'Resuming run {run_id}.')
+            else:
+                run_id = create_run(conn, quiz_id)
+        if run_id is None:
+            click.echo('No attempts need regrading.')
+            return
+        regrade = db.session.get(RegradeRun, run_id)
+        total = regrade.attempts_total - regrade.attempts_done
+        with click.progressbar(length=total, label=f'Regrading {total} attempts') as bar:
+            run(db.engine, run_id, quiz_id, batch_size, progress=lambda done, changed: bar.update(done))
+        db.session.expire_all()
+        regrade = db.session.get(RegradeRun, run_id)
+        click.echo(f'Run {run_id}: {regrade.attempts_changed} scores changed, '
+                   f'net {regrade.score_delta:+d} points.')
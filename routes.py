@@ -1,29 +1,55 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import render_template, request, redirect, url_for, flash, abort, jsonify, make_response, Response, stream_with_context, current_app
 from datetime import datetime, date
-from models import db, User, Course, Chapter, Question, Quiz, StudentQuizAttempt
+from models import db, User, Course, Chapter, Question, Quiz, StudentQuizAttempt, RegradeRun, course_sort_category
+import stats
+import loaders
+import search
+import quiz_cache
+import snapshots
+import importer
+import exporter
+import submissions
+import purge
+import pagination
+import page_cache
+import engines
+import metrics
+import passwords
+import users
+import leaderboard
+import analytics
+import regrade
 from flask import Blueprint
+from markupsafe import Markup
 
 app = Blueprint('routes', __name__)
 
 @app.route('/')
 def home():
-    user_id = session.get('user_id')  # Get user ID from session
-    user = User.query.get(user_id) if user_id else None  # Fetch user if logged in
-    search_query = request.args.get('query', '').strip()  # Get search query from URL
-    courses = []
-
-    if user:
+    user = users.current_user()  # Claims from the session; no user query
+    if not user:
+        return render_template('HomePage.html', user=user, course_list='')
+
+    # The course list is shared by everyone with the same qualification
+    page = page_cache.CachedPage(variant=(user.qualification,), viewer=(user.id, user.full_name))
+    not_modified = page.not_modified()
+    if not_modified:
+        return not_modified
+
+    def render_course_list():
+        search_query = request.args.get('query', '').strip()  # Get search query from URL
+        cursor = request.args.get('cursor')
         if search_query:
             # Search courses within user's qualification category
-            courses = Course.query.filter(
-                Course.category == user.qualification,
-                Course.name.ilike(f"%{search_query}%")
-            ).all()
+            results = search.search_courses(search_query, category=user.qualification, cursor=cursor)
         else:
-            # Show all courses based on user qualification
-            courses = Course.query.filter_by(category=user.qualification).all()
+            # Show courses based on user qualification, a page at a time
+            results = pagination.paginate(db.select(Course).where(Course.category == user.qualification),
+                                          [Course.id], cursor)
+        return render_template('_home_course_list.html', courses=results.items, results=results)
 
-    return render_template('HomePage.html', user=user, courses=courses)  # Pass user and courses to template
+    response = make_response(render_template('HomePage.html', user=user, course_list=page.fragment(render_course_list)))
+    return page.finish(response)
 
 
 # @app.route('/')
@@ -58,7 +84,10 @@ def register():
             qualification=qualification,
             dob=datetime.strptime(dob, '%Y-%m-%d').date()  # Convert to date object
         )
-        new_user.set_password(password)  # Hash the password
+        try:
+            new_user.set_password(password)  # Hash the password
+        except passwords.Busy:
+            return _password_executor_busy('register.html')
         db.session.add(new_user)
         db.session.commit()
         flash('Registration successful! You can now log in.', 'success')
@@ -69,12 +98,13 @@ def register():
 @app.route('/search_courses', methods=['GET'])
 def search_courses():
     query = request.args.get('query', '').strip()
+    cursor = request.args.get('cursor')
     if query:
-        courses = Course.query.filter(Course.name.ilike(f"%{query}%")).all()
+        results = search.search_courses(query, cursor=cursor)
     else:
-        courses = Course.query.all()
-    
-    return render_template("HomePage.html", courses=courses)
+        results = pagination.paginate(db.select(Course), [Course.id], cursor)
+    course_list = Markup(render_template('_home_course_list.html', courses=results.items, results=results))
+    return render_template("HomePage.html", user=users.current_user(), course_list=course_list)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -83,9 +113,13 @@ def login():
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
 
-        if user and user.check_password(password):
-            session['user_id'] = user.id  # Store user ID in session
-            session['is_admin'] = user.is_admin  # Store admin status in session
+        try:
+            valid = user is not None and user.check_password(password)
+        except passwords.Busy:
+            return _password_executor_busy('login.html')
+        if valid:
+            _rehash_if_outdated(user, password)
+            users.sign_in(user)  # Store the user's claims in the session
             flash('Login successful!', 'success')
             if user.is_admin:
                 return redirect(url_for('routes.admin_dashboard'))  # Redirect to admin dashboard
@@ -95,9 +129,26 @@ def login():
 
     return render_template('login.html')  # Render login template
 
+def _password_executor_busy(template):
+    # Every password hashing slot is taken: ask the client to retry shortly
+    flash('Too many people are signing in right now. Please try again in a moment.', 'warning')
+    response = make_response(render_template(template), 503)
+    response.headers['Retry-After'] = '2'
+    return response
+
+def _rehash_if_outdated(user, password):
+    # Move the stored hash to the configured method and cost; best effort
+    if not passwords.needs_rehash(user.password_hash):
+        return
+    try:
+        user.set_password(password)
+    except passwords.Busy:
+        return
+    db.session.commit()
+
 @app.route('/logout')
 def logout():
-    session.pop('user_id', None)  # Remove user ID from session
+    users.sign_out()  # Remove the user from the session
     flash('You have been logged out.', 'success')  # Flash message
     return redirect(url_for('routes.home'))  # Redirect to home
 
@@ -106,15 +157,25 @@ def courses():
     search_query = request.args.get('search', '')
     category_filter = request.args.get('category', '')
 
-    # Fetch courses based on search query and category
-    query = Course.query
-    if search_query:
-        query = query.filter(Course.name.ilike(f'%{search_query}%'))
-    if category_filter:
-        query = query.filter(Course.category == category_filter)
+    page = page_cache.CachedPage()
+    not_modified = page.not_modified()
+    if not_modified:
+        return not_modified
+
+    def render_course_list():
+        # Fetch a page of courses based on search query and category
+        cursor = request.args.get('cursor')
+        if search_query:
+            results = search.search_courses(search_query, category=category_filter or None, cursor=cursor)
+        else:
+            query = db.select(Course)
+            if category_filter:
+                query = query.where(Course.category == category_filter)
+            results = pagination.paginate(query, [Course.id], cursor)
+        return render_template('_course_list.html', courses=results.items, results=results)
 
-    courses = query.all()
-    return render_template('courses.html', courses=courses, search_query=search_query, category_filter=category_filter)
+    response = make_response(render_template('courses.html', course_list=page.fragment(render_course_list), search_query=search_query, category_filter=category_filter))
+    return page.finish(response)
 
 @app.route('/add_course', methods=['POST'])
 def add_course():
@@ -122,6 +183,7 @@ def add_course():
     category = request.form['category']
     new_course = Course(name=course_name, category=category)
     db.session.add(new_course)
+    page_cache.bump_catalogue(db.session.connection())
     db.session.commit()
     flash('Course added successfully!', 'success')
     return redirect(url_for('routes.admin_dashboard')) 
@@ -129,7 +191,7 @@ def add_course():
 
 @app.route('/admin/dashboard', methods=['POST', 'GET'])
 def admin_dashboard():
-    search_query = request.form.get('search', '')
+    search_query = request.values.get('search', '')
 
     # Initialize categorized_courses
     categorized_courses = {
@@ -138,11 +200,15 @@ def admin_dashboard():
         'Degree': []
     }
 
-    # Fetch courses from the database and filter based on search query
+    # Fetch a page of courses from the database and filter based on search query
+    cursor = request.args.get('cursor')
     if search_query:
-        courses = Course.query.filter(Course.name.ilike(f"%{search_query}%")).all()
+        results = search.search_courses(search_query, cursor=cursor)
     else:
-        courses = Course.query.all()
+        # Ordered by category so each category's courses stay together across pages
+        results = pagination.paginate(db.select(Course), [course_sort_category, Course.id], cursor,
+                                      key_of=lambda course: (course.category or '', course.id))
+    courses = results.items
 
     # Categorize courses safely
     for course in courses:
@@ -151,34 +217,27 @@ def admin_dashboard():
         else:
             categorized_courses.setdefault(course.category, []).append(course)
 
-    return render_template('admin_dashboard.html', categorized_courses=categorized_courses, search_query=search_query)
+    return render_template('admin_dashboard.html', categorized_courses=categorized_courses, results=results, search_query=search_query)
 
 @app.route('/chapters/<int:course_id>', methods=['GET', 'POST'])
 def chapters(course_id):
     course = Course.query.get(course_id)  # Fetch the course by ID
-    all_chapters = Chapter.query.filter_by(course_id=course_id).all()  
+    search_query = request.values.get('search', '').strip()
 
-    search_query = request.form.get('search', '').strip().lower()
+    chapters, quizzes_by_chapter, results = _chapters_page(course_id, search_query)
 
-    if not search_query:
-        return render_template('chapters.html', course=course, chapters=all_chapters)
+    return render_template('chapters.html', course=course, chapters=chapters, quizzes_by_chapter=quizzes_by_chapter, search_query=search_query, results=results)
 
-    filtered_chapters = []
-    
-    for chapter in all_chapters:
-        # Check if the chapter name matches the search
-        if search_query in chapter.name.lower():
-            filtered_chapters.append(chapter)  # Add the full chapter with all its quizzes
-        else:
-            # If the chapter name doesn't match, check for quizzes in this chapter
-            matching_quizzes = [quiz for quiz in chapter.quizzes if search_query in quiz.name.lower()]
-            if matching_quizzes:
-                # Create a copy of the chapter with only the matched quizzes
-                chapter_copy = Chapter(id=chapter.id, name=chapter.name, course_id=chapter.course_id)
-                chapter_copy.quizzes = matching_quizzes
-                filtered_chapters.append(chapter_copy)
-
-    return render_template('chapters.html', course=course, chapters=filtered_chapters, search_query=search_query)
+def _chapters_page(course_id, search_query=''):
+    # One page of a course's chapters; while searching, only chapters that
+    # match or hold a matching quiz are paged through. A matching chapter
+    # keeps all its quizzes, otherwise only matching quizzes are shown.
+    matches = search.course_matches(course_id, search_query) if search_query else None
+    chapter_ids = search.matching_chapter_ids(matches) if matches else None
+    results = pagination.paginate(loaders.course_chapters_statement(course_id, chapter_ids),
+                                  [Chapter.id], request.args.get('cursor'))
+    chapters, quizzes_by_chapter = search.filter_chapters(results.items, course_id, search_query, matches)
+    return chapters, quizzes_by_chapter, results
 
 # @app.route('/chapters/<int:course_id>')
 # def chapters(course_id):
@@ -219,36 +278,24 @@ def edit_chapter(chapter_id):
             flash('Error updating chapter. Please try again.', 'danger')
             print(f"Error: {str(e)}")
     
-    return render_template('chapters.html', edit_chapter=chapter, course=course, chapters=course.chapters)
+    chapters, quizzes_by_chapter, results = _chapters_page(course.id)
+    return render_template('chapters.html', edit_chapter=chapter, course=course, chapters=chapters, quizzes_by_chapter=quizzes_by_chapter, results=results)
 
 @app.route('/chapters/<int:chapter_id>/delete', methods=['POST'])
 def delete_chapter(chapter_id):
     chapter = Chapter.query.get_or_404(chapter_id)
+    course_id = chapter.course_id
     try:
-        # Get all quizzes for this chapter
-        quizzes = Quiz.query.filter_by(chapter_id=chapter_id).all()
-        
-        for quiz in quizzes:
-            # Delete all student attempts for this quiz
-            StudentQuizAttempt.query.filter_by(quiz_id=quiz.id).delete()
-            
-            # Delete all questions for this quiz
-            Question.query.filter_by(quiz_id=quiz.id).delete()
-            
-            # Delete the quiz
-            db.session.delete(quiz)
-        
-        # Delete the chapter
-        db.session.delete(chapter)
-        db.session.commit()
-        flash('Chapter and all associated content deleted successfully!', 'success')
-        
+        if purge.remove('chapter', chapter_id) == 'deleted':
+            flash('Chapter and all associated content deleted successfully!', 'success')
+        else:
+            flash('Chapter is being deleted in the background. It will disappear shortly.', 'info')
     except Exception as e:
         db.session.rollback()
         flash('Error deleting chapter. Please try again.', 'danger')
         print(f"Error: {str(e)}")
     
-    return redirect(url_for('routes.chapters', course_id=chapter.course_id))
+    return redirect(url_for('routes.chapters', course_id=course_id))
     
 @app.route('/add_question', methods=['POST'])
 def add_question():
@@ -278,6 +325,7 @@ def add_question():
         )
         
         db.session.add(new_question)
+        quiz_cache.invalidate(quiz_id)
         db.session.commit()
         flash('Question added successfully!', 'success')
         
@@ -288,11 +336,72 @@ def add_question():
         
     return redirect(url_for('routes.view_questions', quiz_id=quiz_id))
 
+def _import_questions_from_request(**target):
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a CSV or JSONL file to import.', 'danger')
+        return
+    fmt = request.form.get('format') or importer.guess_format(upload.filename)
+    try:
+        result = importer.import_questions(upload.stream, fmt, strict=bool(request.form.get('strict')), **target)
+    except importer.QuestionImportError as e:
+        flash(str(e), 'danger')
+        return
+    if result.committed:
+        flash(f'Imported {result.inserted} questions.', 'success')
+    if result.error_count:
+        details = '; '.join(f'line {line}: {message}' for line, message in result.errors[:10])
+        more = result.error_count - min(len(result.errors), 10)
+        if more:
+            details += f'; ... and {more} more'
+        flash(f'{result.error_count} rows rejected: {details}', 'danger')
+
+@app.route('/quizzes/<int:quiz_id>/questions/import', methods=['POST'])
+def import_quiz_questions(quiz_id):
+    _import_questions_from_request(quiz_id=quiz_id)
+    return redirect(url_for('routes.view_questions', quiz_id=quiz_id))
+
+@app.route('/chapters/<int:chapter_id>/questions/import', methods=['POST'])
+def import_chapter_questions(chapter_id):
+    chapter = Chapter.query.get_or_404(chapter_id)
+    _import_questions_from_request(chapter_id=chapter_id)
+    return redirect(url_for('routes.chapters', course_id=chapter.course_id))
+
+def _export_response(scope, scope_id, kind):
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = exporter.export(kind, scope, scope_id, fmt)
+    except exporter.ExportError:
+        abort(404)
+    # Rows are streamed as they are read; nothing is built up in memory
+    response = Response(stream_with_context(chunks), mimetype=exporter.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={exporter.filename(kind, scope, scope_id, fmt)}'
+    return response
+
+@app.route('/quizzes/<int:quiz_id>/export/<kind>', methods=['GET'])
+def export_quiz(quiz_id, kind):
+    return _export_response('quiz', quiz_id, kind)
+
+@app.route('/chapters/<int:chapter_id>/export/<kind>', methods=['GET'])
+def export_chapter(chapter_id, kind):
+    return _export_response('chapter', chapter_id, kind)
+
+@app.route('/courses/<int:course_id>/export/<kind>', methods=['GET'])
+def export_course(course_id, kind):
+    return _export_response('course', course_id, kind)
+
 @app.route('/delete_question/<int:question_id>', methods=['POST'])
 def delete_question(question_id):
     question = Question.query.get(question_id)
     if question:
         db.session.delete(question)
+        quiz_cache.invalidate(question.quiz_id)
         db.session.commit()
         flash('Question deleted successfully!', 'success')
     else:
@@ -304,6 +413,7 @@ def edit_course(course_id):
     course = Course.query.get(course_id)
     if request.method == 'POST':
         course.name = request.form['course_name']
+        page_cache.bump_catalogue(db.session.connection())
         db.session.commit()
         flash('Course updated successfully!', 'success')
         return redirect(url_for('routes.admin_dashboard'))
@@ -311,32 +421,12 @@ def edit_course(course_id):
 
 @app.route('/delete_course/<int:course_id>', methods=['POST'])
 def delete_course(course_id):
-    course = Course.query.get_or_404(course_id)
+    Course.query.get_or_404(course_id)
     try:
-        # Get all chapters for this course
-        chapters = Chapter.query.filter_by(course_id=course_id).all()
-        
-        for chapter in chapters:
-            # Get all quizzes for this chapter
-            quizzes = Quiz.query.filter_by(chapter_id=chapter.id).all()
-            
-            for quiz in quizzes:
-                # Delete all student attempts for this quiz
-                StudentQuizAttempt.query.filter_by(quiz_id=quiz.id).delete()
-                
-                # Delete all questions for this quiz
-                Question.query.filter_by(quiz_id=quiz.id).delete()
-                
-                # Delete the quiz
-                db.session.delete(quiz)
-            
-            # Delete the chapter
-            db.session.delete(chapter)
-        
-        # Finally delete the course
-        db.session.delete(course)
-        db.session.commit()
-        flash('Course and all associated content deleted successfully!', 'success')
+        if purge.remove('course', course_id) == 'deleted':
+            flash('Course and all associated content deleted successfully!', 'success')
+        else:
+            flash('Course is being deleted in the background. It will disappear shortly.', 'info')
         
     except Exception as e:
         db.session.rollback()
@@ -352,10 +442,14 @@ def view_questions(quiz_id):
         flash('Quiz not found!', 'danger')
         return redirect(url_for('routes.chapters', course_id=quiz.chapter.course_id))
     
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()  # Fetch questions for the quiz
+    results = _questions_page(quiz_id)  # Fetch a page of questions for the quiz
     chapter_id = quiz.chapter.id if quiz.chapter else None  # Get chapter_id from the quiz
 
-    return render_template('view_questions.html', quiz=quiz, questions=questions, chapter_id = chapter_id)
+    return render_template('view_questions.html', quiz=quiz, questions=results.items, chapter_id = chapter_id, results=results)
+
+def _questions_page(quiz_id):
+    return pagination.paginate(db.select(Question).where(Question.quiz_id == quiz_id),
+                               [Question.id], request.args.get('cursor'))
 
 
 
@@ -423,6 +517,7 @@ def edit_quiz(quiz_id):
             quiz.date_of_quiz = date_of_quiz
             quiz.time_duration = int(time_duration) if time_duration else None
             quiz.remarks = remarks
+            quiz_cache.invalidate(quiz.id)
             
             db.session.commit()
             flash('Quiz updated successfully!', 'success')
@@ -438,9 +533,11 @@ def delete_quiz(quiz_id):
         # Store the course_id before deleting the quiz
         course_id = quiz.chapter.course_id
         
-        # Delete the quiz
-        db.session.delete(quiz)
-        db.session.commit()
+        # Delete the quiz with its questions and attempts
+        if purge.remove('quiz', quiz_id) == 'deleted':
+            flash('Quiz deleted successfully!', 'success')
+        else:
+            flash('Quiz is being deleted in the background. It will disappear shortly.', 'info')
         
         # Redirect to the chapters page
         return redirect(url_for('routes.chapters', course_id=course_id))
@@ -460,12 +557,12 @@ def view_chapter(chapter_id):
 
 @app.route('/quizzes/<int:quiz_id>/take_test', methods=['GET'])
 def take_test(quiz_id):
-    quiz = Quiz.query.get(quiz_id)
+    quiz = quiz_cache.get_quiz(quiz_id)  # Compiled quiz with its questions, usually from cache
     if not quiz:
         flash('Quiz not found!', 'danger')
         return redirect(url_for('routes.home'))
 
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()  # Fetch questions for the quiz
+    questions = quiz.questions
     due_date = quiz.date_of_quiz  # Assuming you have a due_date field in your Quiz model
     return render_template('take_test.html', quiz=quiz, questions=questions, due_date=due_date)
 
@@ -487,6 +584,10 @@ def edit_question(question_id):
             if not all([question_statement, option1, option2, option3, option4, correct_answer]):
                 flash('All fields are required!', 'danger')
             else:
+                options = (option1, option2, option3, option4)
+                key_changed = snapshots.option_number(correct_answer, options) != snapshots.option_number(
+                    question.correct_answer, (question.option1, question.option2, question.option3, question.option4))
+
                 # Update question
                 question.question_statement = question_statement
                 question.option1 = option1
@@ -494,65 +595,122 @@ def edit_question(question_id):
                 question.option3 = option3
                 question.option4 = option4
                 question.correct_answer = correct_answer
+                quiz_cache.invalidate(quiz.id)
 
                 db.session.commit()
                 flash('Question updated successfully!', 'success')
+                if key_changed:
+                    _regrade_after_key_change(quiz.id)
                 return redirect(url_for('routes.view_questions', quiz_id=quiz.id))
         except Exception as e:
             db.session.rollback()
             flash('Error updating question. Please try again.', 'danger')
             print(f"Error: {str(e)}")
 
-    return render_template('view_questions.html', edit_question=question, quiz=quiz, questions=quiz.questions)
+    results = _questions_page(quiz.id)
+    return render_template('view_questions.html', edit_question=question, quiz=quiz, questions=results.items, results=results)
+
+def _regrade_after_key_change(quiz_id):
+    # Rescore the attempts graded against the old answer; logged as a run
+    user = users.current_user()
+    try:
+        run = regrade.start(quiz_id, requested_by=user.id if user else None)
+    except Exception:
+        current_app.logger.exception('Regrading quiz %s failed', quiz_id)
+        flash(f'Regrading the attempts failed; run `flask regrade {quiz_id}` to retry.', 'danger')
+        return
+    if run is None:
+        return
+    if run.status == 'done':
+        flash(f'Regraded {run.attempts_total} attempts: {run.attempts_changed} scores changed.', 'info')
+    else:
+        flash(f'Regrading {run.attempts_total} attempts in the background; progress: '
+              f'{url_for("routes.regrade_status", run_id=run.id)}', 'info')
+
+@app.route('/admin/regrades/<int:run_id>')
+def regrade_status(run_id):
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    run = db.get_or_404(RegradeRun, run_id)
+    return jsonify(regrade.run_info(run))
 
 @app.route('/submit_test/<int:quiz_id>', methods=['POST'])
 def submit_test(quiz_id):
-    user_id = session.get('user_id')
-    if not user_id:
+    student = users.current_user()
+    if not student:
         flash('Please log in to submit the test', 'warning')
         return redirect(url_for('routes.login'))
     
-    quiz = Quiz.query.get_or_404(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
-    
-    # Calculate score and store responses
-    score = 0
-    responses = {}
-    
-    for question in questions:
-        selected_answer = request.form.get(f'question_{question.id}')
-        # Store both the selected answer and correct answer
-        responses[str(question.id)] = {
-            'question_text': question.question_statement,
-            'selected_option': selected_answer,
-            'correct_option': question.correct_answer,
-            'options': {
-                '1': question.option1,
-                '2': question.option2,
-                '3': question.option3,
-                '4': question.option4
-            }
-        }
-        if selected_answer == question.correct_answer:
-            score += 1
-    
-    # Record attempt with detailed responses
+    quiz = quiz_cache.get_quiz(quiz_id)
+    if not quiz:
+        abort(404)
+    questions = quiz.questions
+    
+    # Store the selected option numbers against a shared snapshot of the quiz content
+    selections = snapshots.encode_selections(questions, request.form)
+    score = snapshots.grade(quiz.snapshot, selections)
+    # The snapshot is written on a connection of its own; hand the session's
+    # back first so a burst of submissions cannot exhaust the pool
+    db.session.close()
+    snapshots.ensure_snapshot(quiz.snapshot_hash, quiz.id, quiz.snapshot)
+    user_id = student.id
+    attempt_date = datetime.utcnow()
+
+    if submissions.enabled():
+        # Log the graded attempt durably and let the writer thread insert it
+        token = submissions.submit({
+            'student_id': user_id,
+            'qualification': student.qualification,
+            'quiz_id': quiz_id,
+            'course_id': quiz.course_id,
+            'score': score,
+            'total_questions': len(questions),
+            'snapshot_hash': quiz.snapshot_hash,
+            'selections': selections,
+            'attempt_date': attempt_date.isoformat(),
+        })
+        flash(f'Quiz submitted! Your score: {score}/{len(questions)}', 'success')
+        return redirect(url_for('routes.submission_status', token=token))
+
+    # Record attempt
     attempt = StudentQuizAttempt(
         student_id=user_id,
         quiz_id=quiz_id,
         score=score,
         total_questions=len(questions),
-        student_answers=responses,
-        attempt_date=datetime.utcnow()
+        snapshot_hash=quiz.snapshot_hash,
+        selections=selections,
+        attempt_date=attempt_date
     )
     
     db.session.add(attempt)
 
+    # Update the admin statistics rollup and the leaderboards in the same transaction
+    stats.record_attempt(student.qualification, quiz_id, attempt.attempt_date, score)
+    leaderboard.record_attempt(user_id, quiz_id, quiz.course_id, score, attempt.attempt_date)
+
     db.session.commit()
     
     flash(f'Quiz submitted! Your score: {score}/{len(questions)}', 'success')
     return redirect(url_for('routes.view_attempt', attempt_id=attempt.id))
 
+@app.route('/submissions/<token>')
+def submission_status(token):
+    user = users.current_user()
+    if not user:
+        return redirect(url_for('routes.login'))
+    attempt = db.session.execute(
+        db.select(StudentQuizAttempt.id, StudentQuizAttempt.student_id)
+        .where(StudentQuizAttempt.submission_token == token)
+    ).first()
+    if attempt is None:
+        # Still queued; check again shortly
+        return render_template('submission_status.html', token=token, refresh=1), 202
+    if attempt.student_id != user.id:
+        abort(404)
+    return redirect(url_for('routes.view_attempt', attempt_id=attempt.id))
+
 
 @app.route('/view_attempt/<int:attempt_id>')
 def view_attempt(attempt_id):
@@ -561,48 +719,48 @@ def view_attempt(attempt_id):
     if not attempt:
         return "Attempt not found", 404
 
-    quiz = Quiz.query.get(attempt.quiz_id)
-    questions = Question.query.filter_by(quiz_id=attempt.quiz_id).all()
+    quiz = quiz_cache.get_quiz(attempt.quiz_id)
+    answers = snapshots.answer_sheet(attempt)  # As the quiz was when attempted
+    # Top of the quiz's leaderboard and where this attempt's student stands
+    leaders, standing = leaderboard.summary('quiz', attempt.quiz_id, attempt.student_id)
 
-    return render_template('view_attempt.html', attempt=attempt, quiz=quiz, questions=questions)
+    return render_template('view_attempt.html', attempt=attempt, quiz=quiz, answers=answers,
+                           leaders=leaders, standing=standing)
 
 @app.route('/student/chapters/<int:course_id>')
 def student_chapters(course_id):
-    user_id = session.get('user_id')
-    if not user_id:
+    user = users.current_user()
+    if not user:
         flash('Please log in to view chapters', 'warning')
         return redirect(url_for('routes.login'))
+    user_id = user.id
     
-    user = User.query.get(user_id)
     course = Course.query.get_or_404(course_id)
     
-    search_query = request.args.get('query', '').strip().lower()
+    search_query = request.args.get('query', '').strip()
     
-    # Get all chapters related to the course
-    chapters = Chapter.query.filter_by(course_id=course_id).all()
+    # Chapters of the course with their quizzes, loaded together
+    chapters = loaders.course_chapters(course_id)
 
     # Get current time for date comparison
     current_time = datetime.utcnow()
 
-    # Get all quiz attempts by the student
-    student_attempts = StudentQuizAttempt.query.filter_by(student_id=user_id).all()
-    attempted_quiz_ids = {attempt.quiz_id for attempt in student_attempts}
-
-    # Create a dictionary of last attempts for each quiz
-    last_attempts = {}
-    for attempt in student_attempts:
-        if attempt.quiz_id not in last_attempts or attempt.attempt_date > last_attempts[attempt.quiz_id].attempt_date:
-            last_attempts[attempt.quiz_id] = attempt
-
-    # Process quiz information for each chapter
-    filtered_chapters = []
-    for chapter in chapters:
-        matching_quizzes = []
-        for quiz in chapter.quizzes:
+    # Latest attempt per quiz of this course only
+    last_attempts = loaders.latest_attempts(user_id, course_id)
+
+    # Top of the course leaderboard and the student's place on it
+    leaders, standing = leaderboard.summary('course', course_id, user_id)
+
+    # A matching chapter keeps all its quizzes, otherwise only matching quizzes are shown
+    chapters_to_display, quizzes_by_chapter = search.filter_chapters(chapters, course_id, search_query)
+
+    # Process quiz information for each displayed quiz
+    for quizzes in quizzes_by_chapter.values():
+        for quiz in quizzes:
             # Check if quiz has been attempted
-            quiz.attempted = quiz.id in attempted_quiz_ids
+            last_attempt = last_attempts.get(quiz.id)
+            quiz.attempted = last_attempt is not None
             if quiz.attempted:
-                last_attempt = last_attempts[quiz.id]
                 quiz.score = last_attempt.score
                 quiz.total_questions = last_attempt.total_questions
                 quiz.last_attempt_id = last_attempt.id
@@ -619,24 +777,13 @@ def student_chapters(course_id):
                 quiz.is_available = True
                 quiz.is_deadline_close = False
 
-            # Filter quizzes based on search query
-            if search_query and search_query in quiz.name.lower():
-                matching_quizzes.append(quiz)
-
-        # If searching for a quiz, show only relevant chapters
-        if search_query and search_query in chapter.name.lower():
-            filtered_chapters.append(chapter)
-        elif matching_quizzes:
-            chapter.quizzes = matching_quizzes
-            filtered_chapters.append(chapter)
-
-    # If no search query, show all chapters
-    chapters_to_display = filtered_chapters if search_query else chapters
-
     return render_template('student_chapters.html', 
                            course=course,
                            chapters=chapters_to_display,
+                           quizzes_by_chapter=quizzes_by_chapter,
                            user=user,
+                           leaders=leaders,
+                           standing=standing,
                            search_query=search_query)
 
 
@@ -695,83 +842,116 @@ def student_chapters(course_id):
     
 
 
+@app.route('/admin/quiz_cache')
+def quiz_cache_stats():
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    return jsonify(quiz_cache.cache_info())
+
+@app.route('/admin/page_cache')
+def page_cache_stats():
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    return jsonify(page_cache.cache_info())
+
+@app.route('/admin/db_pool')
+def db_pool_stats():
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    return jsonify(engines.pool_info(db.engine))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(current_app._get_current_object()), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/admin/stats')
 def admin_stats():
-    # Fetch user counts by qualification
-    foundation_count = User.query.filter_by(qualification='Foundation').count()
-    diploma_count = User.query.filter_by(qualification='Diploma').count()
-    degree_count = User.query.filter_by(qualification='Degree').count()
-
-    # Fetch scores for analysis from StudentQuizAttempt
-    attempts = StudentQuizAttempt.query.all()
-    score_data = {
-        'foundations': [],
-        'diplomas': [],
-        'degrees': []
-    }
+    # User counts and average scores by qualification, both read from
+    # aggregates rather than individual rows
+    user_counts = stats.qualification_counts()
+    averages = stats.qualification_averages()
 
-    for attempt in attempts:
-        if attempt.student.qualification == 'Foundation':
-            score_data['foundations'].append(attempt.score)
-        elif attempt.student.qualification == 'Diploma':
-            score_data['diplomas'].append(attempt.score)
-        elif attempt.student.qualification == 'Degree':
-            score_data['degrees'].append(attempt.score)
-
-    # Calculate average scores
     avg_scores = {
-        'foundation': (sum(score_data['foundations']) / len(score_data['foundations'])) if score_data['foundations'] else 0,
-        'diploma': (sum(score_data['diplomas']) / len(score_data['diplomas'])) if score_data['diplomas'] else 0,
-        'degree': (sum(score_data['degrees']) / len(score_data['degrees'])) if score_data['degrees'] else 0
+        'foundation': averages['Foundation'],
+        'diploma': averages['Diploma'],
+        'degree': averages['Degree']
     }
 
     return render_template('admin_stats.html', 
-                           foundation_count=foundation_count, 
-                           diploma_count=diploma_count, 
-                           degree_count=degree_count,
+                           foundation_count=user_counts['Foundation'], 
+                           diploma_count=user_counts['Diploma'], 
+                           degree_count=user_counts['Degree'],
                            avg_scores=avg_scores)
 
 
+@app.route('/admin/quizzes/<int:quiz_id>/analytics')
+def quiz_analytics(quiz_id):
+    user = users.current_user()
+    if not user or not user.is_admin:
+        abort(403)
+    # Item statistics of the quiz's current questions, including new attempts
+    results = analytics.quiz_analytics(quiz_id)
+    if results is None:
+        abort(404)
+    return render_template('quiz_analytics.html', analytics=results)
+
+
 @app.route('/student/stats')
 def user_stats():
-    user_id = session.get('user_id')
-    if not user_id:
+    user = users.current_user()
+    if not user:
         flash('Please log in to view your stats', 'warning')
         return redirect(url_for('routes.login'))
-    
-    # Fetch the user object
-    user = User.query.get(user_id)  # Assuming you have a User model
-    
-    # Fetch all attempts for the logged-in user
-    attempts = StudentQuizAttempt.query.filter_by(student_id=user_id).all()
-
-    total_quizzes_taken = len(attempts)
+    user_id = user.id
+    
+    # Totals over all of the user's attempts, counted by the database
+    attempt = StudentQuizAttempt
+    totals = db.session.execute(
+        db.select(
+            db.func.count(attempt.id),
+            db.func.coalesce(db.func.sum(attempt.score), 0),
+            db.func.count(attempt.attempt_date),
+            db.func.count(attempt.id).filter(attempt.attempt_date.is_(None), attempt.score < attempt.total_questions),
+        ).where(attempt.student_id == user_id)
+    ).one()
+    total_quizzes_taken, total_score, submitted_count, in_progress_count = totals
 
     # Calculate average score
-    total_score = sum(attempt.score for attempt in attempts)
     average_score = total_score / total_quizzes_taken if total_quizzes_taken > 0 else 0
 
-    # Calculate submission status
-    submitted_count = sum(1 for attempt in attempts if attempt.attempt_date is not None)
-    in_progress_count = sum(1 for attempt in attempts if attempt.attempt_date is None and attempt.score < attempt.total_questions)
+    # Newest attempts first, a page at a time, without the answer columns
+    results = pagination.paginate(
+        db.select(attempt)
+        .where(attempt.student_id == user_id)
+        .options(db.joinedload(attempt.quiz), db.defer(attempt.student_answers), db.defer(attempt.selections)),
+        [attempt.id], request.args.get('cursor'), descending=True
+    )
+
+    # Score over time per course, at most SCORE_SERIES_POINTS points each
+    series = loaders.score_series(user_id, current_app.config.get('SCORE_SERIES_POINTS', 30))
+    score_chart = [
+        {'label': name, 'data': [{'x': until.strftime('%Y-%m-%d %H:%M'), 'y': round(percent, 1)}
+                                 for until, percent in points]}
+        for name, points in series
+    ]
 
     return render_template('student_stats.html', 
                            user=user,  # Pass the user object to the template
                            total_quizzes_taken=total_quizzes_taken,
                            average_score=average_score,
                            submitted_count=submitted_count,
-                           in_progress_count=in_progress_count)
+                           in_progress_count=in_progress_count,
+                           attempts=results.items,
+                           results=results,
+                           score_chart=score_chart)
 
 
 
 
 @app.route('/contact')
 def contact():
-    user_id = session.get('user_id')
-    user = None
-    
-    # If user is logged in, get their user object
-    if user_id:
-        user = User.query.get(user_id)  # Assuming you have a User model
-    
-    return render_template('contact.html', user=user)
\ No newline at end of file
+    return render_template('contact.html', user=users.current_user())
\ No newline at end of file
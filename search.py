@@ -0,0 +1,200 @@
+import re
+import click
+from sqlalchemy import select, text
+from models import db, Course, Chapter, Quiz
+import pagination
+
+# Catalogue search over course, chapter and quiz names.
+#
+# On SQLite each searchable table has an FTS5 shadow table keyed by the row id
+# and kept in sync by triggers, so edits, bulk deletes and cascades can never
+# leave the index stale. Queries are prefix matches on every word, ranked by
+# bm25. Other backends fall back to ILIKE, which PostgreSQL serves from the
+# pg_trgm indexes created in the same migration. Result pages are keyset
+# paginated on (rank, rowid), or (name, id) for the fallback.
+
+DEFAULT_PER_PAGE = pagination.DEFAULT_PER_PAGE
+
+# kind -> (model, FTS table, extra UNINDEXED columns copied from the row)
+INDEXES = {
+    'course': (Course, 'courses_fts', ('category',)),
+    'chapter': (Chapter, 'chapters_fts', ('course_id',)),
+    'quiz': (Quiz, 'quizzes_fts', ('course_id',)),
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _fts_statements(kind):
+    model, fts, extra = INDEXES[kind]
+    table = model.__tablename__
+    columns = ', '.join(('rowid', 'name') + extra)
+    values = ', '.join(f'new.{c}' for c in ('id', 'name') + extra)
+    assignments = ', '.join(f'{c} = new.{c}' for c in ('name',) + extra)
+    unindexed = ''.join(f', {c} UNINDEXED' for c in extra)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(name{unindexed}, prefix='2 3')",
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+        f'INSERT INTO {fts} ({columns}) VALUES ({values}); END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {", ".join(("name",) + extra)} ON {table} BEGIN '
+        f'UPDATE {fts} SET {assignments} WHERE rowid = new.id; END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+        f'DELETE FROM {fts} WHERE rowid = old.id; END',
+        f'DELETE FROM {fts}',
+        f'INSERT INTO {fts} ({columns}) SELECT {", ".join(("id", "name") + extra)} FROM {table}',
+    ]
+
+
+def create_index(conn):
+    # Build (or rebuild) the search index for the connection's backend.
+    if conn.dialect.name == 'sqlite':
+        for kind in INDEXES:
+            for statement in _fts_statements(kind):
+                conn.execute(text(statement))
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for model, _, _ in INDEXES.values():
+            table = model.__tablename__
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)'
+            ))
+
+
+def fts_query(query):
+    # Every word must match as a prefix: 'alg lin' -> "alg"* "lin"*
+    words = _WORD.findall(query or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _uses_fts():
+    return db.session.get_bind().dialect.name == 'sqlite'
+
+
+def _fts_conditions(filters):
+    return ''.join(f' AND {column} = :{column}' for column in filters)
+
+
+def _fallback_statement(kind, words, filters):
+    model = INDEXES[kind][0]
+    return select(model).where(
+        *(model.name.ilike(f'%{word}%') for word in words),
+        *(getattr(model, column) == value for column, value in filters.items())
+    )
+
+
+def _all_ids(kind, query, filters):
+    # Ids of every row matching query, best match first.
+    model, fts, _ = INDEXES[kind]
+    if _uses_fts():
+        match = fts_query(query)
+        if not match:
+            return []
+        rows = db.session.execute(
+            text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :match{_fts_conditions(filters)} '
+                 'ORDER BY rank, rowid'),
+            dict(filters, match=match)
+        )
+        return [row[0] for row in rows]
+
+    words = _WORD.findall(query or '')
+    if not words:
+        return []
+    statement = _fallback_statement(kind, words, filters).with_only_columns(model.id)
+    return list(db.session.execute(statement.order_by(model.name, model.id)).scalars())
+
+
+def _load_in_order(model, ids):
+    if not ids:
+        return []
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+    return [rows[i] for i in ids if i in rows]
+
+
+def _fts_page(kind, match, filters, cursor, per_page):
+    model, fts, _ = INDEXES[kind]
+    key, backwards = pagination.decode_cursor(cursor, 2)
+    direction = 'DESC' if backwards else 'ASC'
+    bound = ''
+    params = dict(filters, match=match, limit=per_page + 1)
+    if key is not None:
+        bound = f' AND (rank, rowid) {"<" if backwards else ">"} (:rank, :rowid)'
+        params.update(rank=key[0], rowid=key[1])
+    rows = db.session.execute(
+        text(f'SELECT rowid, rank FROM {fts} WHERE {fts} MATCH :match{_fts_conditions(filters)}{bound} '
+             f'ORDER BY rank {direction}, rowid {direction} LIMIT :limit'),
+        params
+    ).all()
+    ranks = {row[0]: row[1] for row in rows}
+    items = _load_in_order(model, [row[0] for row in rows])
+    return pagination.make_page(items, lambda item: (ranks[item.id], item.id), per_page, key, backwards)
+
+
+def search(kind, query, cursor=None, per_page=DEFAULT_PER_PAGE, **filters):
+    # Ranked page of model instances whose name matches every word of query
+    # as a prefix. filters are equality checks on the index's extra columns.
+    if _uses_fts():
+        match = fts_query(query)
+        if not match:
+            return pagination.Page([], per_page)
+        return _fts_page(kind, match, filters, cursor, per_page)
+
+    words = _WORD.findall(query or '')
+    if not words:
+        return pagination.Page([], per_page)
+    model = INDEXES[kind][0]
+    return pagination.paginate(_fallback_statement(kind, words, filters), [model.name, model.id],
+                               cursor, per_page)
+
+
+def search_courses(query, category=None, cursor=None, per_page=DEFAULT_PER_PAGE):
+    filters = {'category': category} if category else {}
+    return search('course', query, cursor, per_page, **filters)
+
+
+def course_matches(course_id, query):
+    # Ids of the chapters and quizzes of one course whose names match query.
+    # A course has few enough of these that all matches are returned.
+    chapter_ids = set(_all_ids('chapter', query, {'course_id': course_id}))
+    quiz_ids = set(_all_ids('quiz', query, {'course_id': course_id}))
+    return chapter_ids, quiz_ids
+
+
+def matching_chapter_ids(matches):
+    # Chapters to show for course_matches() results: those that match, plus
+    # those holding a matching quiz.
+    chapter_ids, quiz_ids = matches
+    shown = set(chapter_ids)
+    if quiz_ids:
+        shown.update(db.session.execute(
+            select(Quiz.chapter_id).where(Quiz.id.in_(quiz_ids))
+        ).scalars())
+    return shown
+
+
+def filter_chapters(chapters, course_id, query, matches=None):
+    # Apply a course-scoped search to loaded chapters: a matching chapter
+    # keeps all its quizzes, otherwise only its matching quizzes are kept.
+    # Returns (chapters to show, {chapter id: quizzes to show}).
+    if not query:
+        return chapters, {chapter.id: chapter.quizzes for chapter in chapters}
+    chapter_ids, quiz_ids = matches or course_matches(course_id, query)
+    shown, quizzes_by_chapter = [], {}
+    for chapter in chapters:
+        if chapter.id in chapter_ids:
+            quizzes = chapter.quizzes
+        else:
+            quizzes = [quiz for quiz in chapter.quizzes if quiz.id in quiz_ids]
+            if not quizzes:
+                continue
+        shown.append(chapter)
+        quizzes_by_chapter[chapter.id] = quizzes
+    return shown, quizzes_by_chapter
+
+
+def register_commands(app):
+    @app.cli.command('rebuild-search')
+    def rebuild_search_command():
+        """Rebuild the catalogue search index from the course tables."""
+        with db.engine.begin() as conn:
+            create_index(conn)
+        click.echo('Search index rebuilt.')
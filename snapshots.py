@@ -0,0 +1,208 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from sqlalchemy import null, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, QuizSnapshot, StudentQuizAttempt
+
+# Compact attempt storage.
+#
+# An attempt stores `selections`, the chosen option number (1-4, or None) per
+# question, plus the hash of an immutable snapshot of the quiz content it was
+# taken against. Snapshots are content-addressed (sha256 of canonical JSON),
+# so every attempt of the same quiz version shares one row.
+#
+# Snapshot content: {"questions": [{"id", "text", "options": [4 strings],
+# "answer": option number or None}, ...]} in the order the quiz was shown.
+
+OPTION_KEYS = ('option1', 'option2', 'option3', 'option4')
+
+AnsweredQuestion = namedtuple('AnsweredQuestion', [
+    'question_text', 'options', 'selected_option', 'correct_option',
+])
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+CONTENT_CACHE_SIZE = 512
+
+_known_hashes = set()
+_content_cache = OrderedDict()
+_content_lock = threading.Lock()
+
+
+def option_number(value, options):
+    # 'option3' (the form value) -> 3; an option's text -> its number.
+    if not value:
+        return None
+    if value in OPTION_KEYS:
+        return OPTION_KEYS.index(value) + 1
+    if value in options:
+        return list(options).index(value) + 1
+    return None
+
+
+def build_content(questions):
+    items = []
+    for question in questions:
+        options = [question.option1, question.option2, question.option3, question.option4]
+        items.append({
+            'id': question.id,
+            'text': question.question_statement,
+            'options': options,
+            'answer': option_number(question.correct_answer, options),
+        })
+    return {'questions': items}
+
+
+def content_hash(content):
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def store_snapshot(conn, snapshot_hash, quiz_id, content):
+    # Insert the snapshot on conn unless it already exists.
+    table = QuizSnapshot.__table__
+    values = {'content_hash': snapshot_hash, 'quiz_id': quiz_id, 'content': content,
+              'created_at': datetime.utcnow()}
+    dialect_insert = _UPSERT_DIALECTS.get(conn.dialect.name)
+    if dialect_insert is not None:
+        conn.execute(dialect_insert(table).values(**values).on_conflict_do_nothing())
+        return
+    exists = conn.execute(
+        select(table.c.content_hash).where(table.c.content_hash == snapshot_hash)
+    ).first()
+    if exists is None:
+        conn.execute(table.insert().values(**values))
+
+
+def ensure_snapshot(snapshot_hash, quiz_id, content):
+    # Make sure the snapshot row exists before an attempt references it. It is
+    # committed on its own connection so a rolled-back request can never leave
+    # a hash marked as stored; after that the process skips the write.
+    if snapshot_hash in _known_hashes:
+        return
+    with db.engine.begin() as conn:
+        store_snapshot(conn, snapshot_hash, quiz_id, content)
+    _known_hashes.add(snapshot_hash)
+
+
+def encode_selections(questions, form):
+    # Selected option numbers in question order, from the take_test form.
+    selections = []
+    for question in questions:
+        value = form.get(f'question_{question.id}')
+        options = (question.option1, question.option2, question.option3, question.option4)
+        selections.append(option_number(value, options))
+    return selections
+
+
+def grade(content, selections):
+    return sum(
+        1 for item, selected in zip(content['questions'], selections)
+        if selected is not None and selected == item['answer']
+    )
+
+
+def get_content(snapshot_hash):
+    # Snapshots never change, so their decoded content is cached per process.
+    with _content_lock:
+        content = _content_cache.get(snapshot_hash)
+        if content is not None:
+            _content_cache.move_to_end(snapshot_hash)
+            return content
+    content = db.session.execute(
+        select(QuizSnapshot.content).where(QuizSnapshot.content_hash == snapshot_hash)
+    ).scalar()
+    if content is not None:
+        with _content_lock:
+            _content_cache[snapshot_hash] = content
+            while len(_content_cache) > CONTENT_CACHE_SIZE:
+                _content_cache.popitem(last=False)
+    return content
+
+
+def answer_sheet(attempt):
+    # Questions as answered in this attempt, exactly as they were shown.
+    if attempt.snapshot_hash is not None:
+        content = get_content(attempt.snapshot_hash)
+        sheet = []
+        for item, selected in zip(content['questions'], attempt.selections or []):
+            options = list(zip(OPTION_KEYS, item['options']))
+            sheet.append(AnsweredQuestion(
+                item['text'],
+                options,
+                OPTION_KEYS[selected - 1] if selected else None,
+                OPTION_KEYS[item['answer'] - 1] if item['answer'] else None,
+            ))
+        return sheet
+
+    # Attempts recorded before snapshots existed and not convertible
+    sheet = []
+    answers = attempt.student_answers or {}
+    for question_id in sorted(answers, key=int):
+        answer = answers[question_id]
+        stored = answer.get('options', {})
+        options = [(key, stored.get(str(n))) for n, key in enumerate(OPTION_KEYS, 1)]
+        sheet.append(AnsweredQuestion(
+            answer.get('question_text'),
+            options,
+            answer.get('selected_option'),
+            answer.get('correct_option'),
+        ))
+    return sheet
+
+
+def _legacy_to_compact(answers):
+    # (content, selections) for a legacy student_answers blob, or None if the
+    # blob holds values the compact form cannot reproduce exactly.
+    items, selections = [], []
+    for question_id in sorted(answers, key=int):
+        answer = answers[question_id]
+        stored = answer.get('options', {})
+        options = [stored.get(str(n)) for n in range(1, 5)]
+        correct = option_number(answer.get('correct_option'), options)
+        selected = option_number(answer.get('selected_option'), options)
+        if correct is None or (answer.get('selected_option') and selected is None):
+            return None
+        items.append({'id': int(question_id), 'text': answer.get('question_text'),
+                      'options': options, 'answer': correct})
+        selections.append(selected)
+    return {'questions': items}, selections
+
+
+def convert_legacy_attempts(conn, batch_size=500):
+    # Move attempts that still carry the full student_answers JSON onto
+    # snapshots + selections, in batches. Returns the number converted.
+    attempts = StudentQuizAttempt.__table__
+    converted, last_id = 0, 0
+    while True:
+        rows = conn.execute(
+            select(attempts.c.id, attempts.c.quiz_id, attempts.c.student_answers)
+            .where(attempts.c.id > last_id, attempts.c.snapshot_hash.is_(None))
+            .order_by(attempts.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return converted
+        updates = []
+        for attempt_id, quiz_id, answers in rows:
+            compact = _legacy_to_compact(answers) if answers else None
+            if compact is None:
+                continue
+            content, selections = compact
+            snapshot_hash = content_hash(content)
+            store_snapshot(conn, snapshot_hash, quiz_id, content)
+            updates.append({'attempt_id': attempt_id, 'snapshot_hash': snapshot_hash,
+                            'selections': selections})
+        if updates:
+            conn.execute(
+                update(attempts)
+                .where(attempts.c.id == db.bindparam('attempt_id'))
+                .values(snapshot_hash=db.bindparam('snapshot_hash'),
+                        selections=db.bindparam('selections'), student_answers=null()),
+                updates
+            )
+        converted += len(updates)
+        last_id = rows[-1][0]
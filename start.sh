@@ -1,3 +1,29 @@
 #!/bin/bash
-gunicorn app:app
-chmod +x start.sh
+# Serve the app with gunicorn (settings in gunicorn_config.py).
+#
+# `./start.sh reload` deploys new code without dropping requests: USR2 makes
+# the running master start a new master from the current code next to it,
+# and once the new one has workers the old one is stopped gracefully (QUIT
+# lets in-flight requests finish).
+set -e
+PIDFILE=${GUNICORN_PIDFILE:-/tmp/quizmaster-gunicorn.pid}
+
+if [ "$1" = "reload" ]; then
+    old=$(cat "$PIDFILE")
+    kill -USR2 "$old"
+    # The new master writes $PIDFILE.2 and takes over $PIDFILE once the old
+    # one has exited
+    for _ in $(seq 120); do
+        sleep 1
+        new=$(cat "$PIDFILE.2" 2>/dev/null || true)
+        if [ -n "$new" ] && pgrep -P "$new" > /dev/null; then
+            kill -QUIT "$old"
+            echo "Reloaded: master $old replaced by $new"
+            exit 0
+        fi
+    done
+    echo "The new master did not come up; $old keeps serving" >&2
+    exit 1
+fi
+
+exec gunicorn -c gunicorn_config.py app:app
@@ -0,0 +1,105 @@
+import click
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, StudentQuizAttempt, AttemptStatsRollup
+
+# Attempt statistics rollups. submit_test adds each attempt to its
+# (qualification, quiz, day) row inside the same transaction, so /admin/stats
+# reads a few aggregated rows instead of every attempt.
+
+QUALIFICATIONS = ('Foundation', 'Diploma', 'Degree')
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def record_attempt(qualification, quiz_id, attempt_date, score):
+    rollup = AttemptStatsRollup.__table__
+    key = {'qualification': qualification, 'quiz_id': quiz_id, 'day': attempt_date.date()}
+    dialect_insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(rollup).values(attempt_count=1, score_sum=score, **key)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                'attempt_count': rollup.c.attempt_count + 1,
+                'score_sum': rollup.c.score_sum + score,
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(rollup)
+        .where(*(rollup.c[name] == value for name, value in key.items()))
+        .values(attempt_count=rollup.c.attempt_count + 1, score_sum=rollup.c.score_sum + score)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(rollup).values(attempt_count=1, score_sum=score, **key))
+
+
+def rebuild_rollups(conn, quiz_ids=None):
+    # Recompute rollups from the attempts table, optionally for some quizzes only.
+    rollup = AttemptStatsRollup.__table__
+    attempts = StudentQuizAttempt.__table__
+    users = User.__table__
+    day = func.date(attempts.c.attempt_date)
+
+    clear = delete(rollup)
+    source = (
+        select(
+            users.c.qualification,
+            attempts.c.quiz_id,
+            day,
+            func.count(),
+            func.coalesce(func.sum(attempts.c.score), 0),
+        )
+        .select_from(attempts.join(users, users.c.id == attempts.c.student_id))
+        .where(attempts.c.attempt_date.is_not(None))
+        .group_by(users.c.qualification, attempts.c.quiz_id, day)
+    )
+    if quiz_ids is not None:
+        clear = clear.where(rollup.c.quiz_id.in_(quiz_ids))
+        source = source.where(attempts.c.quiz_id.in_(quiz_ids))
+
+    conn.execute(clear)
+    conn.execute(insert(rollup).from_select(
+        ['qualification', 'quiz_id', 'day', 'attempt_count', 'score_sum'], source
+    ))
+
+
+def qualification_counts():
+    rows = db.session.execute(
+        select(User.qualification, func.count(User.id))
+        .where(User.qualification.in_(QUALIFICATIONS))
+        .group_by(User.qualification)
+    ).all()
+    counts = dict.fromkeys(QUALIFICATIONS, 0)
+    counts.update(rows)
+    return counts
+
+
+def qualification_averages():
+    rows = db.session.execute(
+        select(
+            AttemptStatsRollup.qualification,
+            func.sum(AttemptStatsRollup.attempt_count),
+            func.sum(AttemptStatsRollup.score_sum),
+        )
+        .where(AttemptStatsRollup.qualification.in_(QUALIFICATIONS))
+        .group_by(AttemptStatsRollup.qualification)
+    ).all()
+    averages = dict.fromkeys(QUALIFICATIONS, 0)
+    for qualification, attempt_count, score_sum in rows:
+        if attempt_count:
+            averages[qualification] = score_sum / attempt_count
+    return averages
+
+
+def register_commands(app):
+    @app.cli.command('rebuild-stats')
+    @click.option('--quiz', 'quiz_ids', type=int, multiple=True, help='Only rebuild these quizzes.')
+    def rebuild_stats_command(quiz_ids):
+        """Recompute attempt statistics rollups from the attempts table."""
+        with db.engine.begin() as conn:
+            rebuild_rollups(conn, list(quiz_ids) or None)
+        click.echo('Statistics rollups rebuilt.')
@@ -0,0 +1,345 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import insert, select
+from models import db, StudentQuizAttempt
+import leaderboard
+import stats
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev server, no other workers to recover
+    fcntl = None
+
+# Write-behind submission pipeline for exam bursts.
+#
+# submit_test grades the attempt, appends it to this process's submission
+# log and returns as soon as the line is on disk; concurrent submitters
+# share one fsync. A background thread then inserts queued attempts in
+# batches, one transaction per batch, instead of one transaction (and one
+# SQLite write lock) per request. The student is redirected to
+# /submissions/<token>, which forwards to view_attempt once the row exists.
+#
+# Every attempt carries its submission token (unique), so replaying a log is
+# idempotent. Each process holds an exclusive lock on its own log; logs left
+# behind by a process that died are replayed by the next one to start, or by
+# `flask replay-submissions`. A log is truncated whenever everything written
+# to it has been committed.
+#
+# A record that still cannot be committed after retries goes to the
+# dead-letter file, failed-submissions.jsonl in the same directory, which
+# `flask replay-submissions` retries. It is not counted as committed, so the
+# log keeps it until the process exits and the log is replayed.
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_MAX_DELAY = 0.05  # seconds to wait for a batch to fill
+MAX_RETRIES = 5
+
+LOG_PATTERN = 'submissions-*.jsonl'
+DEAD_LETTER = 'failed-submissions.jsonl'
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def log_directory(app):
+    return app.config.get('SUBMISSION_LOG_DIR') or os.path.join(app.instance_path, 'submissions')
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+def _lock(log_file, blocking=True):
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(log_file.fileno(), flags)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _attempt_values(record):
+    return {
+        'submission_token': record['token'],
+        'student_id': record['student_id'],
+        'quiz_id': record['quiz_id'],
+        'score': record['score'],
+        'total_questions': record['total_questions'],
+        'snapshot_hash': record['snapshot_hash'],
+        'selections': record['selections'],
+        'attempt_date': datetime.fromisoformat(record['attempt_date']),
+    }
+
+
+def commit_records(records):
+    # Insert the attempts of records not stored yet, with their rollups and
+    # leaderboard rows, in one transaction. Returns the number inserted.
+    attempts = StudentQuizAttempt.__table__
+    tokens = [record['token'] for record in records]
+    stored = set(db.session.execute(
+        select(attempts.c.submission_token).where(attempts.c.submission_token.in_(tokens))
+    ).scalars())
+    fresh = [record for record in records if record['token'] not in stored]
+    if fresh:
+        values = [_attempt_values(record) for record in fresh]
+        db.session.execute(insert(attempts), values)
+        for record, row in zip(fresh, values):
+            stats.record_attempt(record['qualification'], row['quiz_id'], row['attempt_date'], row['score'])
+            leaderboard.record_attempt(row['student_id'], row['quiz_id'], record.get('course_id'), row['score'],
+                                       row['attempt_date'])
+    db.session.commit()
+    return len(fresh)
+
+
+def _commit_with_retries(app, records):
+    # Commit a batch, retrying transient failures (e.g. SQLite busy). If it
+    # keeps failing, commit the records one by one so a single bad record
+    # cannot hold up the rest. Returns (attempts inserted, records that
+    # still failed).
+    for attempt in range(MAX_RETRIES):
+        try:
+            return commit_records(records), []
+        except Exception:
+            db.session.rollback()
+            app.logger.warning('Committing %d submissions failed (try %d)', len(records), attempt + 1,
+                               exc_info=True)
+            time.sleep(0.05 * 2 ** attempt)
+    inserted, failed = 0, []
+    for record in records:
+        try:
+            inserted += commit_records([record])
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Could not commit submission %s', record['token'])
+            failed.append(record)
+    return inserted, failed
+
+
+def _read_records(log_file):
+    records = []
+    for line in log_file:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            pass  # a torn last line was never acknowledged
+    return records
+
+
+def _write_records(log_file, records):
+    for record in records:
+        log_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+    log_file.flush()
+    os.fsync(log_file.fileno())
+
+
+def dead_letter(app, records, directory=None):
+    # Keep records that could not be committed for `flask replay-submissions`.
+    path = os.path.join(directory or log_directory(app), DEAD_LETTER)
+    with open(path, 'a', encoding='utf-8') as log_file:
+        _lock(log_file)
+        _write_records(log_file, records)
+    app.logger.error('%d submissions could not be committed; kept in %s', len(records), path)
+
+
+def _commit_batches(app, records, directory=None):
+    # Commit records, moving those that keep failing to the dead-letter
+    # file; returns (attempts inserted, records that failed).
+    inserted, failed = 0, []
+    for start in range(0, len(records), DEFAULT_BATCH_SIZE):
+        count, still_failing = _commit_with_retries(app, records[start:start + DEFAULT_BATCH_SIZE])
+        inserted += count
+        failed += still_failing
+    if failed:
+        dead_letter(app, failed, directory)
+    return inserted, failed
+
+
+class SubmissionQueue:
+    def __init__(self, app, directory, batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY,
+                 fsync=True):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'submissions-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl')
+        self._file = open(self.path, 'a', encoding='utf-8')
+        _lock(self._file)
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._written = 0    # records appended to the log
+        self._synced = 0     # records known to be on disk
+        self._committed = 0  # records inserted (or found) in the database
+        self._syncing = False
+        self._worker = None
+        self._start_worker()
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+        self._worker.start()
+
+    def submit(self, record):
+        # Append record to the log and return once it is durable; the
+        # attempt is inserted later by the writer thread.
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._cond:
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            position = self._written
+            # Group fsync: one thread syncs everything written so far while
+            # the others wait for it instead of issuing their own.
+            while self.fsync and self._synced < position:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                self._cond.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+            if not self._worker.is_alive():
+                self.app.logger.error('The submission writer thread had stopped; restarting it')
+                self._start_worker()
+        self._queue.put(record)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch()
+                try:
+                    _, failed = _commit_batches(self.app, batch, os.path.dirname(self.path))
+                    committed = len(batch) - len(failed)
+                except Exception:
+                    # The records stay in the log, which is replayed when
+                    # this process exits
+                    self.app.logger.exception('The submission writer failed on %d submissions; they stay in %s',
+                                              len(batch), self.path)
+                    committed = 0
+                finally:
+                    db.session.remove()
+                with self._cond:
+                    self._committed += committed
+                    if self._committed == self._written:
+                        # Everything in the log is in the database
+                        self._file.truncate(0)
+                        self._written = self._synced = self._committed = 0
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+def get_queue():
+    # This process's queue, started (and orphaned logs replayed) on first use
+    # so each forked worker gets its own log and writer thread.
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                app = current_app._get_current_object()
+                directory = log_directory(app)
+                replay_orphaned_logs(app, directory)
+                _queue = SubmissionQueue(
+                    app, directory,
+                    batch_size=app.config.get('SUBMISSION_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    max_delay=app.config.get('SUBMISSION_MAX_DELAY', DEFAULT_MAX_DELAY),
+                    fsync=app.config.get('SUBMISSION_FSYNC', True),
+                )
+    return _queue
+
+
+def enabled():
+    return current_app.config.get('SUBMISSION_QUEUE', False)
+
+
+def submit(record):
+    record = dict(record, token=new_token())
+    get_queue().submit(record)
+    return record['token']
+
+
+def replay_orphaned_logs(app, directory=None):
+    # Commit the records of logs whose process has exited, then delete the
+    # logs. Returns the number of attempts inserted.
+    directory = directory or log_directory(app)
+    inserted = 0
+    own = _queue.path if _queue is not None else None
+    for path in sorted(glob.glob(os.path.join(directory, LOG_PATTERN))):
+        if path == own:
+            continue
+        try:
+            log_file = open(path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            continue  # replayed by another process meanwhile
+        with log_file:
+            if not _lock(log_file, blocking=False):
+                continue  # still owned by a live process
+            records = _read_records(log_file)
+            with app.app_context():
+                count, _ = _commit_batches(app, records, directory)
+            inserted += count
+            # Whatever failed is in the dead-letter file by now
+            os.unlink(path)
+    return inserted
+
+
+def replay_dead_letters(app, directory=None):
+    # Retry the records of the dead-letter file, keeping those that fail
+    # again. Returns (attempts inserted, records still failing).
+    path = os.path.join(directory or log_directory(app), DEAD_LETTER)
+    try:
+        log_file = open(path, 'r+', encoding='utf-8')
+    except FileNotFoundError:
+        return 0, 0
+    with log_file:
+        # Writers append under the same lock, so nothing is lost in between
+        _lock(log_file)
+        records = _read_records(log_file)
+        inserted, failed = 0, []
+        with app.app_context():
+            for start in range(0, len(records), DEFAULT_BATCH_SIZE):
+                count, still_failing = _commit_with_retries(app, records[start:start + DEFAULT_BATCH_SIZE])
+                inserted += count
+                failed += still_failing
+        log_file.seek(0)
+        log_file.truncate()
+        _write_records(log_file, failed)
+    return inserted, len(failed)
+
+
+def register_commands(app):
+    @app.cli.command('replay-submissions')
+    def replay_submissions_command():
+        """Commit submissions left in the logs of exited processes or in the dead-letter file."""
+        inserted = replay_orphaned_logs(app)
+        retried, failing = replay_dead_letters(app)
+        click.echo(f'Replayed {inserted + retried} submissions.')
+        if failing:
+            path = os.path.join(log_directory(app), DEAD_LETTER)
+            raise click.ClickException(f'{failing} submissions still fail to commit; they stay in {path}.')
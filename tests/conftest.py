@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its settings from the environment on import, so the test
+# database and directories are set up before anything imports it.
+WORKDIR = tempfile.mkdtemp(prefix='quizmaster-tests-')
+os.environ.update(
+    SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(WORKDIR, 'tests.db'),
+    SECRET_KEY='tests',
+    SUBMISSION_LOG_DIR=os.path.join(WORKDIR, 'submissions'),
+    METRICS_DIR=os.path.join(WORKDIR, 'metrics'),
+    TEMPLATE_CACHE_DIR=os.path.join(WORKDIR, 'jinja'),
+    PASSWORD_HASH_WORKERS='0',
+)
+
+ADMIN = ('admin@example.com', '20210')
+STUDENT = ('foundation0@example.com', 'password')
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from bootstrap import bootstrap
+    from benchmarks import datagen
+    from models import db
+
+    app.config['TESTING'] = True
+    bootstrap(app)
+    with app.app_context():
+        datagen.generate(users_per_qualification=20, courses_per_category=4, chapters_per_course=2,
+                         quizzes_per_chapter=2, questions_per_quiz=4, attempts_per_user=5)
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+    return app
+
+
+def login(client, credentials):
+    username, password = credentials
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def student(app):
+    return login(app.test_client(), STUDENT)
+
+
+@pytest.fixture
+def admin(app):
+    return login(app.test_client(), ADMIN)
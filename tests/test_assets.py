@@ -0,0 +1,38 @@
+import io
+import os
+
+import pytest
+
+import assets
+
+
+def serve(monkeypatch, data):
+    monkeypatch.setattr(assets.urllib.request, 'urlopen', lambda url, timeout: io.BytesIO(data))
+
+
+def test_fetch_vendor_writes_a_file_matching_its_pin(app, tmp_path, monkeypatch):
+    data = b'/* vendored */'
+    monkeypatch.setattr(assets, 'VENDOR', {'vendor/lib.js': ('https://cdn.example/lib.js', assets.integrity(data))})
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path))
+    serve(monkeypatch, data)
+    assert assets.fetch_vendor(app) == ['vendor/lib.js']
+    assert (tmp_path / 'vendor' / 'lib.js').read_bytes() == data
+
+
+def test_fetch_vendor_refuses_a_digest_mismatch(app, tmp_path, monkeypatch):
+    pinned = assets.integrity(b'/* vendored */', 'sha256')
+    monkeypatch.setattr(assets, 'VENDOR', {'vendor/lib.js': ('https://cdn.example/lib.js', pinned)})
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path))
+    serve(monkeypatch, b'/* tampered */')
+    with pytest.raises(assets.IntegrityError):
+        assets.fetch_vendor(app)
+    assert not os.path.exists(tmp_path / 'vendor')
+
+
+
+def test_committed_vendor_files_match_their_pins(app):
+    for name, (url, pinned) in assets.VENDOR.items():
+        path = os.path.join(app.static_folder, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                assets.verify(name, f.read(), pinned)
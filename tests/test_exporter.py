@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+
+import exporter
+from models import db, StudentQuizAttempt, User
+
+FORMULA_NAME = '=HYPERLINK("http://example.com","x")'
+
+
+def exported_student(app):
+    # (quiz_id, student_id) of the first attempt
+    with app.app_context():
+        attempt = db.session.execute(db.select(StudentQuizAttempt).order_by(StudentQuizAttempt.id)).scalar()
+        return attempt.quiz_id, attempt.student_id
+
+
+def test_streamed_exports_of_a_quiz(app, admin):
+    quiz_id, student_id = exported_student(app)
+    with app.app_context():
+        student = db.session.get(User, student_id)
+        saved = student.full_name
+        student.full_name = FORMULA_NAME
+        db.session.commit()
+        expected = db.session.execute(
+            db.select(db.func.count()).where(StudentQuizAttempt.quiz_id == quiz_id)
+        ).scalar()
+    try:
+        response = admin.get(f'/quizzes/{quiz_id}/export/attempts', query_string={'format': 'csv'})
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert len(rows) == expected
+        names = {row['full_name'] for row in rows if row['student_id'] == str(student_id)}
+        assert names == {"'" + FORMULA_NAME}
+
+        response = admin.get(f'/quizzes/{quiz_id}/export/attempts', query_string={'format': 'jsonl'})
+        assert response.mimetype == 'application/x-ndjson'
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(records) == expected
+        # Only CSV cells are quoted; JSON Lines keeps the data as it is
+        names = {record['full_name'] for record in records if record['student_id'] == student_id}
+        assert names == {FORMULA_NAME}
+    finally:
+        with app.app_context():
+            db.session.get(User, student_id).full_name = saved
+            db.session.commit()
+
+
+def test_csv_cells_that_would_run_as_formulas_are_quoted():
+    batches = iter([('name', 'score'), [('=1+1', 3), ('+1', -2), ('-1', 0), ('@SUM(A1)', 1),
+                                        ('\tx', 1), ('\rx', 1), ('Ada', 1), ('a=b', 1)]])
+    rows = list(csv.reader(io.StringIO(''.join(exporter.iter_chunks(batches, 'csv')))))
+    assert [row[0] for row in rows[1:]] == ["'=1+1", "'+1", "'-1", "'@SUM(A1)", "'\tx", "'\rx", 'Ada', 'a=b']
+    assert [row[1] for row in rows[1:]] == ['3', '-2', '0', '1', '1', '1', '1', '1']
@@ -0,0 +1,111 @@
+import io
+
+import pytest
+
+import importer
+from models import db, Question, Quiz
+
+CSV_HEADER = 'question_statement,option1,option2,option3,option4,correct_answer\n'
+
+
+def first_quiz_id(app):
+    with app.app_context():
+        return db.session.execute(db.select(Quiz.id).order_by(Quiz.id)).scalar()
+
+
+def question_ids(quiz_id):
+    return set(db.session.execute(db.select(Question.id).where(Question.quiz_id == quiz_id)).scalars())
+
+
+@pytest.fixture
+def quiz_id(app):
+    # A quiz whose imported questions are removed again afterwards
+    quiz_id = first_quiz_id(app)
+    with app.app_context():
+        existing = question_ids(quiz_id)
+    yield quiz_id
+    with app.app_context():
+        db.session.execute(db.delete(Question).where(Question.id.in_(question_ids(quiz_id) - existing)))
+        db.session.commit()
+
+
+def run_import(text, quiz_id, fmt='csv', **kwargs):
+    return importer.import_questions(io.BytesIO(text.encode()), fmt, quiz_id=quiz_id, **kwargs)
+
+
+@pytest.mark.parametrize('answer, stored', [
+    ('option2', 'option2'), ('3', 'option3'), ('Paris', 'option1'),
+])
+def test_correct_answer_forms(answer, stored):
+    row = {'question_statement': 'Capital of France?', 'option1': 'Paris', 'option2': 'Rome',
+           'option3': 'Oslo', 'option4': '', 'correct_answer': answer}
+    values, error = importer.validate_row(row, {1: 7}, 1)
+    assert error is None
+    assert (values['correct_answer'], values['quiz_id'], values['chapter_id']) == (stored, 1, 7)
+
+
+@pytest.mark.parametrize('answer', ['option4', '4', 'Berlin', '', '5'])
+def test_correct_answer_must_name_a_filled_option(answer):
+    row = {'question_statement': 'Capital of France?', 'option1': 'Paris', 'option2': 'Rome',
+           'option3': 'Oslo', 'option4': '', 'correct_answer': answer}
+    assert importer.validate_row(row, {1: 7}, 1) == (None, 'correct_answer does not match any option')
+
+
+def test_invalid_rows_are_reported_by_line(app, quiz_id):
+    text = (CSV_HEADER
+            + 'Two plus two?,3,4,,,option2\n'
+            + 'No answer?,a,b,,,option3\n'
+            + ',a,b,,,option1\n'
+            + 'Fine too?,yes,no,,,yes\n')
+    with app.app_context():
+        before = question_ids(quiz_id)
+        result = run_import(text, quiz_id)
+        assert result.committed
+        assert result.inserted == 2
+        assert result.errors == [(3, 'correct_answer does not match any option'),
+                                 (4, 'question_statement is required')]
+        assert len(question_ids(quiz_id) - before) == 2
+
+
+def test_jsonl_errors_keep_their_line_numbers(app, quiz_id):
+    text = ('{"question_statement": "Ok?", "option1": "a", "option2": "b", "correct_answer": 1}\n'
+            '\n'
+            '{not json\n'
+            '["a list"]\n')
+    with app.app_context():
+        result = run_import(text, quiz_id, fmt='jsonl')
+    assert result.inserted == 1
+    assert [line for line, _ in result.errors] == [3, 4]
+    assert result.errors[1] == (4, 'row is not an object')
+
+
+def test_strict_import_rolls_back_on_any_invalid_row(app, quiz_id):
+    text = CSV_HEADER + 'Good?,a,b,,,option1\n' * 3 + 'Bad?,a,b,,,option4\n'
+    with app.app_context():
+        before = question_ids(quiz_id)
+        result = run_import(text, quiz_id, strict=True, batch_size=2)
+        assert not result.committed
+        assert result.inserted == 0
+        assert result.error_count == 1
+        assert question_ids(quiz_id) == before
+
+
+def test_only_the_first_errors_are_kept(app, quiz_id, monkeypatch):
+    monkeypatch.setattr(importer, 'MAX_REPORTED_ERRORS', 2)
+    with app.app_context():
+        result = run_import(CSV_HEADER + 'Bad?,a,b,,,option4\n' * 5, quiz_id)
+    assert (result.error_count, len(result.errors)) == (5, 2)
+
+
+def test_import_needs_an_admin(app, student, admin, quiz_id):
+    path = f'/quizzes/{quiz_id}/questions/import'
+    upload = CSV_HEADER + 'Good?,a,b,,,option1\n'
+    with app.app_context():
+        before = question_ids(quiz_id)
+    for client in (app.test_client(), student):
+        response = client.post(path, data={'file': (io.BytesIO(upload.encode()), 'questions.csv')})
+        assert response.status_code == 403
+    response = admin.post(path, data={'file': (io.BytesIO(upload.encode()), 'questions.csv')})
+    assert response.status_code == 302
+    with app.app_context():
+        assert len(question_ids(quiz_id) - before) == 1
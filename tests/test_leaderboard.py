@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+import leaderboard
+from models import QuizLeaderboardEntry, QuizScoreCount, CourseScoreCount, Quiz, User, db
+
+
+def largest_board(app):
+    # (quiz_id, entries) of the quiz board with the most students
+    with app.app_context():
+        return tuple(db.session.execute(
+            select(QuizLeaderboardEntry.quiz_id, db.func.count())
+            .group_by(QuizLeaderboardEntry.quiz_id).order_by(db.func.count().desc()).limit(1)
+        ).one())
+
+
+def score_counts(model):
+    return sorted(tuple(row) for row in db.session.execute(select(*model.__table__.c)).all())
+
+
+def test_rank_matches_the_board_order(app):
+    quiz_id, entries = largest_board(app)
+    with app.app_context():
+        for standing in leaderboard.top('quiz', quiz_id, limit=entries):
+            assert leaderboard.rank('quiz', quiz_id, standing.student_id) == standing
+
+
+def test_recorded_attempts_keep_the_score_counts(app):
+    quiz_id, _ = largest_board(app)
+    with app.app_context():
+        course_id = db.session.get(Quiz, quiz_id).course_id
+        students = db.session.execute(select(User.id).where(User.is_admin.is_(False)).limit(3)).scalars().all()
+        try:
+            for score in (0, 3, 100, 2):
+                for student_id in students:
+                    leaderboard.record_attempt(student_id, quiz_id, course_id, score, datetime(2030, 1, 1))
+            db.session.flush()
+            maintained = score_counts(QuizScoreCount), score_counts(CourseScoreCount)
+            # The same counts as recounted from the boards
+            conn = db.session.connection()
+            leaderboard.rebuild_score_counts(conn, 'quiz')
+            leaderboard.rebuild_score_counts(conn, 'course')
+            assert (score_counts(QuizScoreCount), score_counts(CourseScoreCount)) == maintained
+            top = leaderboard.top('quiz', quiz_id, limit=1)[0]
+            assert top.score == 100
+            assert leaderboard.rank('quiz', quiz_id, top.student_id) == top
+        finally:
+            db.session.rollback()
@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_exited_workers_keep_counters_but_not_gauges(app):
+    directory = metrics.metrics_directory(app)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics-{_dead_pid()}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'counters': [['quizmaster_password_hashes_total', [], 1000]],
+            'gauges': [['quizmaster_submission_queue_pending', [], 1000]],
+            'histograms': [],
+        }, f)
+    try:
+        with app.app_context():
+            lines = metrics.render(app).splitlines()
+    finally:
+        os.unlink(path)
+    hashes = next(line for line in lines if line.startswith('quizmaster_password_hashes_total '))
+    pending = next(line for line in lines if line.startswith('quizmaster_submission_queue_pending '))
+    assert float(hashes.split()[1]) >= 1000
+    assert float(pending.split()[1]) < 1000
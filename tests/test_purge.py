@@ -0,0 +1,119 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import purge
+import snapshots
+from leaderboard import rebuild_leaderboards
+from models import db, Chapter, Course, Question, Quiz, StudentQuizAttempt, User
+from stats import rebuild_rollups
+
+SCOPE_TABLES = {'course': 'courses', 'chapter': 'chapters', 'quiz': 'quizzes'}
+FTS_TABLES = ('courses_fts', 'chapters_fts', 'quizzes_fts')
+
+
+def create_course(app, name):
+    # A course with 2 chapters of 2 quizzes, 3 questions each, and attempts by
+    # a few students; returns {'course': id, 'chapter': ids, 'quiz': ids}.
+    with app.app_context():
+        course = Course(name=name, category='Diploma')
+        db.session.add(course)
+        db.session.flush()
+        students = db.session.execute(
+            db.select(User.id).where(User.qualification == 'Diploma').limit(4)
+        ).scalars().all()
+        quiz_ids, chapter_ids = [], []
+        for c in range(2):
+            chapter = Chapter(name=f'{name} chapter {c}', course_id=course.id)
+            db.session.add(chapter)
+            db.session.flush()
+            chapter_ids.append(chapter.id)
+            for q in range(2):
+                quiz = Quiz(name=f'{name} quiz {c}.{q}', course_id=course.id, chapter_id=chapter.id,
+                            date_of_quiz=datetime(2030, 1, 1).date())
+                db.session.add(quiz)
+                db.session.flush()
+                quiz_ids.append(quiz.id)
+                questions = [Question(quiz_id=quiz.id, chapter_id=chapter.id, question_statement=f'Q{n}?',
+                                      option1='a', option2='b', option3='c', option4='d',
+                                      correct_answer='option1') for n in range(3)]
+                db.session.add_all(questions)
+                db.session.flush()
+                content = snapshots.build_content(questions)
+                snapshot_hash = snapshots.content_hash(content)
+                snapshots.store_snapshot(db.session.connection(), snapshot_hash, quiz.id, content)
+                for i, student_id in enumerate(students):
+                    selections = [1, 1 + i % 4, 2]
+                    db.session.add(StudentQuizAttempt(
+                        student_id=student_id, quiz_id=quiz.id, snapshot_hash=snapshot_hash,
+                        selections=selections, score=snapshots.grade(content, selections),
+                        total_questions=3, attempt_date=datetime(2030, 1, 1) + timedelta(minutes=i),
+                    ))
+        db.session.flush()
+        rebuild_rollups(db.session.connection(), quiz_ids)
+        rebuild_leaderboards(db.session.connection(), quiz_ids)
+        db.session.commit()
+        return {'course': [course.id], 'chapter': chapter_ids, 'quiz': quiz_ids}
+
+
+def leftovers(ids):
+    # {table: rows} still referring to the course, its chapters or quizzes
+    found = {}
+    for table in db.metadata.sorted_tables:
+        for scope, scope_table in SCOPE_TABLES.items():
+            column = table.c.id if table.name == scope_table else table.c.get(f'{scope}_id')
+            if column is None:
+                continue
+            count = db.session.execute(
+                db.select(db.func.count()).select_from(table).where(column.in_(ids[scope]))
+            ).scalar()
+            if count:
+                found[f'{table.name}.{column.name}'] = count
+    for fts, scope in zip(FTS_TABLES, SCOPE_TABLES):
+        count = db.session.execute(
+            text(f'SELECT count(*) FROM {fts} WHERE rowid IN ({", ".join(map(str, ids[scope]))})')
+        ).scalar()
+        if count:
+            found[fts] = count
+    return found
+
+
+def test_fixture_course_fills_every_dependent_table(app):
+    ids = create_course(app, 'Purge fixture')
+    with app.app_context():
+        found = leftovers(ids)
+        assert {'courses.id', 'chapters.id', 'quizzes.id', 'questions.quiz_id', 'student_quiz_attempts.quiz_id',
+                'attempt_stats_rollups.quiz_id', 'quiz_leaderboard.quiz_id', 'course_leaderboard.course_id',
+                'quiz_score_counts.quiz_id', 'course_score_counts.course_id', 'quiz_snapshots.quiz_id',
+                *FTS_TABLES} <= set(found)
+        purge.delete_scope(db.session.connection(), 'course', ids['course'][0])
+        db.session.commit()
+
+
+def test_delete_course_in_the_request(app, admin):
+    ids = create_course(app, 'Purge in request')
+    response = admin.post(f'/delete_course/{ids["course"][0]}')
+    assert response.status_code == 302
+    with app.app_context():
+        assert leftovers(ids) == {}
+
+
+def test_delete_course_in_background_batches(app, admin, monkeypatch):
+    ids = create_course(app, 'Purge in background')
+    monkeypatch.setitem(app.config, 'PURGE_SYNC_LIMIT', 0)
+    monkeypatch.setitem(app.config, 'PURGE_BATCH_SIZE', 5)
+    deleted = []
+    delete_scope = purge.delete_scope
+    monkeypatch.setattr(purge, 'delete_scope', lambda conn, *scope: deleted.append(scope) or delete_scope(conn, *scope))
+    response = admin.post(f'/delete_course/{ids["course"][0]}')
+    assert response.status_code == 302
+
+    deadline = time.monotonic() + 10
+    while ('course', ids['course'][0]) in purge._running:
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    assert deleted == [('course', ids['course'][0])]
+    with app.app_context():
+        assert leftovers(ids) == {}
@@ -0,0 +1,5 @@
+from benchmarks.query_plans import check
+
+
+def test_hot_queries_use_an_index(app):
+    assert check(app) == []
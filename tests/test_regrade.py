@@ -0,0 +1,132 @@
+import pytest
+
+import regrade
+import snapshots
+from models import db, AttemptStatsRollup, QuizLeaderboardEntry, QuizSnapshot, RegradeRun, StudentQuizAttempt
+
+
+def busiest_quiz(app):
+    # (quiz_id, snapshot hash) of the quiz with the most attempts
+    with app.app_context():
+        return tuple(db.session.execute(
+            db.select(StudentQuizAttempt.quiz_id, StudentQuizAttempt.snapshot_hash)
+            .group_by(StudentQuizAttempt.quiz_id, StudentQuizAttempt.snapshot_hash)
+            .order_by(db.func.count().desc()).limit(1)
+        ).one())
+
+
+def attempts_of(quiz_id):
+    return db.session.execute(
+        db.select(StudentQuizAttempt).where(StudentQuizAttempt.quiz_id == quiz_id).order_by(StudentQuizAttempt.id)
+    ).scalars().all()
+
+
+def runs_of(quiz_id):
+    return db.session.execute(
+        db.select(RegradeRun).where(RegradeRun.quiz_id == quiz_id).order_by(RegradeRun.id)
+    ).scalars().all()
+
+
+def edit_answer(client, question, answer):
+    form = {'question_statement': question['text'], 'correct_answer': f'option{answer}'}
+    form.update({f'option{n}': text for n, text in enumerate(question['options'], 1)})
+    response = client.post(f'/edit_question/{question["id"]}', data=form)
+    assert response.status_code == 302
+
+
+@pytest.fixture
+def answer_change(app, admin):
+    # Moves the first question's answer of the busiest quiz to the next option,
+    # regrading in batches of 7; yields the expected outcome, then moves it back.
+    quiz_id, old_hash = busiest_quiz(app)
+    app.config['REGRADE_BATCH_SIZE'] = 7
+    with app.app_context():
+        content = db.session.get(QuizSnapshot, old_hash).content
+        before = {attempt.id: (attempt.score, attempt.selections, attempt.student_id) for attempt in attempts_of(quiz_id)}
+    question = content['questions'][0]
+    new_answer = question['answer'] % 4 + 1
+    corrected = {'questions': [dict(question, answer=new_answer)] + content['questions'][1:]}
+    expected = {attempt_id: snapshots.grade(corrected, selections)
+                for attempt_id, (_, selections, _) in before.items()}
+    try:
+        yield quiz_id, question, new_answer, before, expected, snapshots.content_hash(corrected)
+    finally:
+        edit_answer(admin, question, question['answer'])
+        app.config.pop('REGRADE_BATCH_SIZE')
+        with app.app_context():
+            assert {attempt.id: attempt.score for attempt in attempts_of(quiz_id)} == \
+                {attempt_id: score for attempt_id, (score, _, _) in before.items()}
+
+
+def test_answer_key_change_regrades_attempts(app, admin, answer_change):
+    quiz_id, question, new_answer, before, expected, new_hash = answer_change
+    with app.app_context():
+        runs = len(runs_of(quiz_id))
+    edit_answer(admin, question, new_answer)
+
+    with app.app_context():
+        attempts = attempts_of(quiz_id)
+        assert {attempt.id: attempt.score for attempt in attempts} == expected
+        assert {attempt.snapshot_hash for attempt in attempts} == {new_hash}
+        assert db.session.get(QuizSnapshot, new_hash).content['questions'][0]['answer'] == new_answer
+
+        run = runs_of(quiz_id)[-1]
+        assert len(runs_of(quiz_id)) == runs + 1
+        assert run.status == 'done'
+        assert run.changes == [{'question_id': question['id'], 'old_answer': question['answer'],
+                                'new_answer': new_answer}]
+        assert run.attempts_total == run.attempts_done == len(before)
+        assert run.attempts_changed == sum(expected[i] != score for i, (score, _, _) in before.items())
+        assert run.attempts_changed > 0
+        assert run.score_delta == sum(expected[i] - score for i, (score, _, _) in before.items())
+
+        rollups = db.session.execute(
+            db.select(db.func.sum(AttemptStatsRollup.attempt_count), db.func.sum(AttemptStatsRollup.score_sum))
+            .where(AttemptStatsRollup.quiz_id == quiz_id)
+        ).one()
+        assert tuple(rollups) == (len(expected), sum(expected.values()))
+
+        best = {}
+        for attempt in attempts:
+            best[attempt.student_id] = max(best.get(attempt.student_id, 0), attempt.score)
+        board = dict(db.session.execute(
+            db.select(QuizLeaderboardEntry.student_id, QuizLeaderboardEntry.score)
+            .where(QuizLeaderboardEntry.quiz_id == quiz_id)
+        ).all())
+        assert board == best
+
+        # Nothing is left to regrade: a second run is a no-op
+        assert regrade.start(quiz_id) is None
+        assert len(runs_of(quiz_id)) == runs + 1
+    result = app.test_cli_runner().invoke(args=['regrade', str(quiz_id)])
+    assert 'No attempts need regrading.' in result.output
+
+
+def test_regrade_command_resumes_a_failed_run(app, admin, answer_change, monkeypatch):
+    quiz_id, question, new_answer, before, expected, new_hash = answer_change
+    regrade_batch = regrade._regrade_batch
+    batches = []
+
+    def fail_after_one_batch(*args):
+        if batches:
+            raise RuntimeError('connection lost')
+        batches.append(args)
+        return regrade_batch(*args)
+
+    monkeypatch.setattr(regrade, '_regrade_batch', fail_after_one_batch)
+    edit_answer(admin, question, new_answer)
+    with app.app_context():
+        failed = runs_of(quiz_id)[-1]
+        assert (failed.status, failed.attempts_done) == ('failed', 7)
+        assert 'connection lost' in failed.error
+        runs = len(runs_of(quiz_id))
+
+    monkeypatch.setattr(regrade, '_regrade_batch', regrade_batch)
+    result = app.test_cli_runner().invoke(args=['regrade', str(quiz_id)])
+    assert f'Resuming run {failed.id}.' in result.output, result.output
+    with app.app_context():
+        assert len(runs_of(quiz_id)) == runs
+        run = db.session.get(RegradeRun, failed.id)
+        assert (run.status, run.error) == ('done', None)
+        assert run.attempts_done == run.attempts_total == len(before)
+        assert {attempt.id: attempt.score for attempt in attempts_of(quiz_id)} == expected
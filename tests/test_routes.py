@@ -0,0 +1,49 @@
+import functools
+import re
+
+import pytest
+
+from models import db, Course
+import pagination
+
+
+def test_search_courses_lists_matches(app, student):
+    with app.app_context():
+        name = db.session.execute(db.select(Course.name).order_by(Course.id)).scalar()
+    response = student.get('/search_courses', query_string={'query': name})
+    assert response.status_code == 200
+    assert name in response.get_data(as_text=True)
+
+
+ADMIN_ENDPOINTS = ['/admin/quiz_cache', '/admin/page_cache', '/admin/db_pool']
+
+
+@pytest.mark.parametrize('path', ADMIN_ENDPOINTS)
+def test_admin_endpoints_need_an_admin(app, student, admin, path):
+    assert app.test_client().get(path).status_code == 403
+    assert student.get(path).status_code == 403
+    assert admin.get(path).status_code == 200
+
+
+def test_admin_dashboard_pages_reach_courses_without_a_category(app, admin, monkeypatch):
+    monkeypatch.setattr(pagination, 'paginate', functools.partial(pagination.paginate, per_page=5))
+    with app.app_context():
+        # More than a page of them, so a page ends on a NULL category
+        electives = [Course(name=f'Uncategorised elective {n}', category=None) for n in range(6)]
+        db.session.add_all(electives)
+        db.session.commit()
+        names = db.session.execute(db.select(Course.name)).scalars().all()
+        elective_ids = [course.id for course in electives]
+    try:
+        pages, path = [], '/admin/dashboard'
+        while path:
+            html = admin.get(path).get_data(as_text=True)
+            pages.append(html)
+            match = re.search(r'href="([^"]*cursor=[^"]*)">Next<', html)
+            path = match and match.group(1).replace('&amp;', '&')
+        for name in names:
+            assert sum(f'>{name}</a>' in html for html in pages) == 1
+    finally:
+        with app.app_context():
+            db.session.execute(db.delete(Course).where(Course.id.in_(elective_ids)))
+            db.session.commit()
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+import bootstrap
+import snapshots
+from models import db, Question, QuizSnapshot, StudentQuizAttempt, User
+
+
+def legacy_answers(questions, selected, correct=None):
+    # student_answers as submit_test stored it before snapshots existed
+    return {
+        str(question.id): {
+            'question_text': question.question_statement,
+            'selected_option': choice,
+            'correct_option': correct or question.correct_answer,
+            'options': {'1': question.option1, '2': question.option2,
+                        '3': question.option3, '4': question.option4},
+        }
+        for question, choice in zip(questions, selected)
+    }
+
+
+@pytest.fixture
+def legacy_attempts(app):
+    # Two attempts of a quiz as stored before migration 6: one convertible,
+    # one whose correct_option matches none of its options.
+    with app.app_context():
+        student = db.session.execute(db.select(User).where(User.username == 'foundation2@example.com')).scalar_one()
+        quiz_id = db.session.execute(db.select(Question.quiz_id).order_by(Question.quiz_id)).scalar()
+        questions = db.session.execute(
+            db.select(Question).where(Question.quiz_id == quiz_id).order_by(Question.id)
+        ).scalars().all()
+        blobs = [
+            legacy_answers(questions, ['option1', None, 'option3', 'option2']),
+            legacy_answers(questions, ['option2', 'option2', None, 'option4'], correct='a retired answer'),
+        ]
+        attempts = [StudentQuizAttempt(student_id=student.id, quiz_id=quiz_id, score=1,
+                                       total_questions=len(questions), attempt_date=datetime(2020, 1, 1),
+                                       student_answers=blob) for blob in blobs]
+        db.session.add_all(attempts)
+        db.session.commit()
+        ids = [attempt.id for attempt in attempts]
+    yield ids, blobs
+    with app.app_context():
+        hashes = db.session.execute(
+            db.select(StudentQuizAttempt.snapshot_hash).where(StudentQuizAttempt.id.in_(ids))
+        ).scalars().all()
+        db.session.execute(db.delete(StudentQuizAttempt).where(StudentQuizAttempt.id.in_(ids)))
+        shared = db.session.execute(
+            db.select(StudentQuizAttempt.snapshot_hash).where(StudentQuizAttempt.snapshot_hash.in_(hashes))
+        ).scalars().all()
+        db.session.execute(db.delete(QuizSnapshot).where(QuizSnapshot.content_hash.in_(set(hashes) - set(shared))))
+        db.session.commit()
+
+
+def test_migration_6_converts_legacy_attempts_without_changing_them(app, student, legacy_attempts):
+    (converted_id, kept_id), blobs = legacy_attempts
+    before = {attempt_id: student.get(f'/view_attempt/{attempt_id}').get_data(as_text=True)
+              for attempt_id in (converted_id, kept_id)}
+    assert 'No Answer' in before[converted_id] and 'a retired answer' in before[kept_id]
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            bootstrap._0006_attempt_snapshots(conn)
+
+    with app.app_context():
+        converted = db.session.get(StudentQuizAttempt, converted_id)
+        assert converted.student_answers is None
+        assert converted.selections == [1, None, 3, 2]
+        content = db.session.get(QuizSnapshot, converted.snapshot_hash).content
+        assert [item['id'] for item in content['questions']] == sorted(int(key) for key in blobs[0])
+        # The compact form cannot hold an answer that is not one of the
+        # options, so that attempt keeps its blob
+        kept = db.session.get(StudentQuizAttempt, kept_id)
+        assert (kept.snapshot_hash, kept.selections, kept.student_answers) == (None, None, blobs[1])
+
+    for attempt_id, html in before.items():
+        assert student.get(f'/view_attempt/{attempt_id}').get_data(as_text=True) == html
+
+
+def test_answer_sheets_of_both_forms_agree(app, legacy_attempts):
+    (attempt_id, _), blobs = legacy_attempts
+    with app.app_context():
+        attempt = db.session.get(StudentQuizAttempt, attempt_id)
+        legacy = snapshots.answer_sheet(attempt)
+        content, selections = snapshots._legacy_to_compact(blobs[0])
+        attempt.snapshot_hash = snapshots.content_hash(content)
+        snapshots.store_snapshot(db.session.connection(), attempt.snapshot_hash, attempt.quiz_id, content)
+        attempt.selections = selections
+        assert snapshots.answer_sheet(attempt) == legacy
+        db.session.rollback()
@@ -0,0 +1,80 @@
+import os
+import time
+from datetime import datetime
+
+import submissions
+from models import db, StudentQuizAttempt, Quiz, User
+
+
+def _records(app, count):
+    with app.app_context():
+        student = db.session.execute(db.select(User).where(User.username == 'foundation1@example.com')).scalar_one()
+        quiz = db.session.execute(db.select(Quiz).order_by(Quiz.id)).scalars().first()
+        return [{
+            'token': submissions.new_token(), 'student_id': student.id, 'quiz_id': quiz.id,
+            'qualification': student.qualification, 'course_id': quiz.course_id, 'score': 1,
+            'total_questions': 4, 'snapshot_hash': None, 'selections': [1, 2, 3, 4],
+            'attempt_date': datetime(2025, 1, 1, 12, i).isoformat(),
+        } for i in range(count)]
+
+
+def _stored(app, records):
+    tokens = [record['token'] for record in records]
+    with app.app_context():
+        return set(db.session.execute(
+            db.select(StudentQuizAttempt.submission_token).where(StudentQuizAttempt.submission_token.in_(tokens))
+        ).scalars())
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_failed_submissions_are_kept_and_replayed(app, tmp_path, monkeypatch):
+    records = _records(app, 3)
+    bad = records[1]['token']
+    commit_records = submissions.commit_records
+
+    def failing(batch):
+        if any(record['token'] == bad for record in batch):
+            raise RuntimeError('constraint failed')
+        return commit_records(batch)
+
+    monkeypatch.setattr(submissions, 'MAX_RETRIES', 1)
+    monkeypatch.setattr(submissions, 'commit_records', failing)
+    writer = submissions.SubmissionQueue(app, str(tmp_path), max_delay=0.01, fsync=False)
+    for record in records:
+        writer.submit(record)
+    dead_letter = tmp_path / submissions.DEAD_LETTER
+    _wait_for(lambda: dead_letter.exists() and writer.pending() == 0 and len(_stored(app, records)) == 2)
+    assert bad in dead_letter.read_text()
+    # The failed record is not committed, so the log keeps it
+    assert os.path.getsize(writer.path) > 0
+
+    monkeypatch.setattr(submissions, 'commit_records', commit_records)
+    assert submissions.replay_dead_letters(app, str(tmp_path)) == (1, 0)
+    assert _stored(app, records) == {record['token'] for record in records}
+    assert dead_letter.read_text() == ''
+
+
+def test_writer_survives_errors(app, tmp_path, monkeypatch):
+    records = _records(app, 2)
+    commit_batches = submissions._commit_batches
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError('disk full')
+        return commit_batches(*args)
+
+    monkeypatch.setattr(submissions, '_commit_batches', flaky)
+    writer = submissions.SubmissionQueue(app, str(tmp_path), max_delay=0.01, fsync=False)
+    writer.submit(records[0])
+    _wait_for(lambda: calls)
+    writer.submit(records[1])
+    _wait_for(lambda: records[1]['token'] in _stored(app, records))
+    assert writer._worker.is_alive()
@@ -0,0 +1,34 @@
+from conftest import login
+from models import db, User
+
+STUDENT = ('foundation3@example.com', 'password')
+
+
+def session_version(app, username):
+    with app.app_context():
+        return db.session.execute(db.select(User.session_version).where(User.username == username)).scalar()
+
+
+def test_bumping_session_version_signs_out_existing_sessions(app, monkeypatch):
+    username = STUDENT[0]
+    client = login(app.test_client(), STUDENT)
+    assert client.get('/student/stats').status_code == 200
+
+    # Claims are re-checked on every request; an unchanged version keeps the session
+    monkeypatch.setitem(app.config, 'USER_CLAIMS_TTL', 0)
+    assert client.get('/student/stats').status_code == 200
+
+    version = session_version(app, username)
+    result = app.test_cli_runner().invoke(args=['revoke-sessions', username])
+    assert result.exit_code == 0, result.output
+    assert session_version(app, username) == version + 1
+
+    response = client.get('/student/stats')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+    with client.session_transaction() as stored:
+        assert 'user_id' not in stored
+
+    # Signing in again picks up the new version
+    client = login(app.test_client(), STUDENT)
+    assert client.get('/student/stats').status_code == 200
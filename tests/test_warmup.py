@@ -0,0 +1,26 @@
+from datetime import date, timedelta
+
+from models import db, Quiz
+import warmup
+
+
+def test_hot_quizzes_are_nearest_first(app):
+    today = date.today()
+    with app.app_context():
+        quizzes = db.session.execute(db.select(Quiz).order_by(Quiz.id).limit(3)).scalars().all()
+        saved = [quiz.date_of_quiz for quiz in quizzes]
+        offsets = [30, 0, -2]
+        try:
+            db.session.execute(db.update(Quiz).values(date_of_quiz=today - timedelta(days=3650)))
+            for quiz, offset in zip(quizzes, offsets):
+                quiz.date_of_quiz = today + timedelta(days=offset)
+            db.session.flush()
+            assert warmup.hot_quiz_ids(days=60, limit=2) == [quizzes[1].id, quizzes[2].id]
+            assert warmup.hot_quiz_ids(days=60, limit=5) == [quizzes[1].id, quizzes[2].id, quizzes[0].id]
+        finally:
+            db.session.rollback()
+        assert [quiz.date_of_quiz for quiz in quizzes] == saved
+
+
+def test_warm_up_compiles_every_template(app):
+    assert warmup.compile_templates(app) == len(warmup.template_names(app)) > 0
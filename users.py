@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import click
+from flask import current_app, g, session
+from sqlalchemy import select, update
+from models import db, User
+
+# The signed-in user of the current request.
+#
+# Most views only need to know who the user is: id, qualification, admin
+# flag and name. These claims are written into the signed session cookie at
+# login, together with the time they were read from the database, and are
+# trusted for USER_CLAIMS_TTL seconds. Once they are older, they are renewed
+# from this process's cache of claims read within the TTL, or from one
+# primary-key read of the users row, and written back to the session. Most
+# page views therefore run no user query at all.
+#
+# users.session_version is one of the claims. revoke() bumps it, which signs
+# out every session of the user within USER_CLAIMS_TTL; a password change
+# should do this. Other changes to the claims show within the TTL too.
+
+DEFAULT_TTL = 60  # seconds
+DEFAULT_SIZE = 4096
+
+Claims = namedtuple('Claims', ['id', 'qualification', 'is_admin', 'full_name', 'session_version'])
+
+
+class ClaimsCache:
+    # user id -> (claims, time they were read), least recently used evicted.
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, newer_than):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= newer_than:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def put(self, claims, checked):
+        with self._lock:
+            self._entries[claims.id] = (claims, checked)
+            self._entries.move_to_end(claims.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                    'maxsize': self.maxsize}
+
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ClaimsCache(current_app.config.get('USER_CACHE_SIZE', DEFAULT_SIZE))
+    return _cache
+
+
+def _claims_of(user):
+    return Claims(user.id, user.qualification, bool(user.is_admin), user.full_name, user.session_version)
+
+
+def _read_claims(user_id):
+    row = db.session.execute(
+        select(User.id, User.qualification, User.is_admin, User.full_name, User.session_version)
+        .where(User.id == user_id)
+    ).first()
+    return _claims_of(row) if row is not None else None
+
+
+def _store(claims, checked):
+    session['user_id'] = claims.id
+    session['is_admin'] = claims.is_admin
+    session['claims'] = {
+        'qualification': claims.qualification,
+        'full_name': claims.full_name,
+        'session_version': claims.session_version,
+        'checked': checked,
+    }
+
+
+def _resolve():
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    now = time.time()
+    stale = now - current_app.config.get('USER_CLAIMS_TTL', DEFAULT_TTL)
+    stored = session.get('claims')
+    if stored and stored['checked'] > stale:
+        return Claims(user_id, stored['qualification'], bool(session.get('is_admin')), stored['full_name'],
+                      stored['session_version'])
+
+    cache = _get_cache()
+    entry = cache.get(user_id, stale)
+    if entry is None:
+        claims = _read_claims(user_id)
+        if claims is None:  # deleted
+            sign_out()
+            return None
+        entry = (claims, now)
+        cache.put(claims, now)
+    claims, checked = entry
+    if stored and stored['session_version'] != claims.session_version:
+        sign_out()  # revoked
+        return None
+    # Sessions from before claims were stored are taken as they are
+    _store(claims, checked)
+    return claims
+
+
+def current_user():
+    # Claims of the signed-in user, or None; resolved once per request.
+    if 'current_user' not in g:
+        g.current_user = _resolve()
+    return g.current_user
+
+
+def sign_in(user):
+    claims = _claims_of(user)
+    now = time.time()
+    _get_cache().put(claims, now)
+    _store(claims, now)
+    g.current_user = claims
+
+
+def sign_out():
+    for key in ('user_id', 'is_admin', 'claims'):
+        session.pop(key, None)
+    g.current_user = None
+
+
+def revoke(user_id):
+    # Sign out every session of the user; takes effect when the caller commits.
+    db.session.execute(update(User).where(User.id == user_id)
+                       .values(session_version=User.session_version + 1))
+    _get_cache().discard(user_id)
+
+
+def cache_info():
+    return _get_cache().info()
+
+
+def register_commands(app):
+    @app.cli.command('revoke-sessions')
+    @click.argument('username')
+    def revoke_sessions_command(username):
+        """Sign out every session of a user."""
+        user_id = db.session.execute(select(User.id).where(User.username == username)).scalar()
+        if user_id is None:
+            raise click.ClickException(f'No user {username}.')
+        revoke(user_id)
+        db.session.commit()
+        ttl = app.config.get('USER_CLAIMS_TTL', DEFAULT_TTL)
+        click.echo(f'Sessions of {username} end within {ttl:g} seconds.')
@@ -0,0 +1,106 @@
+import os
+import time
+from datetime import date, timedelta
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import select
+from models import db, Quiz
+import quiz_cache
+import snapshots
+
+# Work done before a process serves its first request.
+#
+# Under gunicorn with preload_app the master runs warm_up once after loading
+# the app, so every forked worker starts with compiled templates and the
+# quizzes around today already in its quiz cache, instead of paying for both
+# on the first requests of an exam. The master then closes its connections,
+# and each worker drops the pool it inherited right after the fork, so no
+# connection is ever shared between processes.
+#
+# Compiled templates also go to a bytecode cache on disk (TEMPLATE_CACHE_DIR),
+# which the workers share and which outlives restarts: a worker that does
+# compile, without preload or after a reload, loads the code instead of
+# parsing the template again. Entries are keyed by a hash of the template
+# source, so an edited template is compiled afresh. Without
+# TEMPLATES_AUTO_RELOAD a loaded template is never checked against its file.
+
+DEFAULT_QUIZ_DAYS = 7
+
+
+def template_cache_directory(app):
+    return app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja')
+
+
+def configure_templates(app):
+    # Call before the first use of app.jinja_env.
+    if not app.config.get('TEMPLATE_BYTECODE_CACHE', True):
+        return
+    directory = template_cache_directory(app)
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(directory))
+
+
+def template_names(app):
+    # The templates sit flat in the template folder, the repository root.
+    folder = os.path.join(app.root_path, app.template_folder)
+    return sorted(name for name in os.listdir(folder) if name.endswith('.html'))
+
+
+def compile_templates(app):
+    names = template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def hot_quiz_ids(days, limit):
+    # Quizzes scheduled within `days` of today, nearest first: the nearest
+    # `limit` from today on and before today, merged by distance.
+    today = date.today()
+    upcoming = db.session.execute(
+        select(Quiz.id, Quiz.date_of_quiz)
+        .where(Quiz.date_of_quiz.between(today, today + timedelta(days=days)))
+        .order_by(Quiz.date_of_quiz, Quiz.id)
+        .limit(limit)
+    ).all()
+    past = db.session.execute(
+        select(Quiz.id, Quiz.date_of_quiz)
+        .where(Quiz.date_of_quiz.between(today - timedelta(days=days), today - timedelta(days=1)))
+        .order_by(Quiz.date_of_quiz.desc(), Quiz.id)
+        .limit(limit)
+    ).all()
+    nearest = sorted(upcoming + past, key=lambda row: (abs((row.date_of_quiz - today).days), row.id))
+    return [row.id for row in nearest[:limit]]
+
+
+def warm_quizzes(app):
+    # Compile the hot quizzes into the quiz cache and make sure their
+    # snapshots are stored, so submit_test can skip that write.
+    days = app.config.get('WARMUP_QUIZ_DAYS', DEFAULT_QUIZ_DAYS)
+    limit = app.config.get('QUIZ_CACHE_SIZE', quiz_cache.DEFAULT_SIZE)
+    quiz_ids = hot_quiz_ids(days, limit)
+    for quiz_id in quiz_ids:
+        quiz = quiz_cache.get_quiz(quiz_id)
+        if quiz is not None:
+            snapshots.ensure_snapshot(quiz.snapshot_hash, quiz.id, quiz.snapshot)
+    return len(quiz_ids)
+
+
+def warm_up(app):
+    started = time.perf_counter()
+    with app.app_context():
+        templates = compile_templates(app)
+        if not templates:
+            app.logger.warning('Found no templates to compile in %s',
+                               os.path.join(app.root_path, app.template_folder))
+        quizzes = warm_quizzes(app)
+        db.session.remove()
+    app.logger.info('Warmed up %d templates and %d quizzes in %.2fs', templates, quizzes,
+                    time.perf_counter() - started)
+
+
+def dispose_engines(app, close=False):
+    # Drop the pooled connections. A forked child must pass close=False:
+    # the connections it inherited still belong to the parent.
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)